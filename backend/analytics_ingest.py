@@ -0,0 +1,161 @@
+"""
+Загрузка статистики Яндекс.Метрики по UTM term в таблицу analytics_utm_daily
+
+- ID товара ищется в utm_term одним проходом по строке: автомат Ахо-Корасик
+  строится один раз по всем ID товаров (раньше - вложенный перебор
+  строк × товаров × фидов)
+- Фид товара берется из заранее построенного индекса product_id -> feed_id
+- Страницы Метрики записываются пачками (upsert по (date, utm_term))
+- Синхронизация инкрементальная: от последней загруженной даты
+  (с перекрытием - Метрика дообрабатывает последние дни), а не 30 дней каждый раз
+"""
+import logging
+import os
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+METRICA_SYNC_DAYS = int(os.getenv('METRICA_SYNC_DAYS', '30'))
+METRICA_SYNC_OVERLAP_DAYS = int(os.getenv('METRICA_SYNC_OVERLAP_DAYS', '1'))
+METRICA_PAGE_SIZE = int(os.getenv('METRICA_PAGE_SIZE', '10000'))
+
+logger = logging.getLogger(__name__)
+
+
+class ProductTermMatcher:
+    """Поиск ID товара внутри utm_term за один проход (Ахо-Корасик)
+
+    При нескольких совпадениях побеждает ID, стоящий раньше в исходном
+    списке - как в прежнем переборе товаров по порядку.
+    """
+
+    def __init__(self, product_ids: Iterable[str]):
+        self.product_ids: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Лучший (самый ранний) ID, оканчивающийся в узле или на его суффикс-ссылках
+        self._best: List[int] = [-1]
+
+        for product_id in product_ids:
+            if not product_id:
+                continue
+            rank = len(self.product_ids)
+            self.product_ids.append(product_id)
+            node = 0
+            for ch in product_id:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(-1)
+                node = nxt
+            if self._best[node] == -1:
+                self._best[node] = rank
+
+        # Суффикс-ссылки обходом в ширину: у более коротких узлов они уже готовы
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                inherited = self._best[self._fail[nxt]]
+                if inherited != -1 and (self._best[nxt] == -1 or inherited < self._best[nxt]):
+                    self._best[nxt] = inherited
+                queue.append(nxt)
+
+    def match(self, text: str) -> Optional[str]:
+        """ID товара, входящий в text, или None"""
+        goto, fail, best = self._goto, self._fail, self._best
+        node = 0
+        found = -1
+        for ch in text or "":
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            rank = best[node]
+            if rank != -1 and (found == -1 or rank < found):
+                found = rank
+                if found == 0:
+                    break
+        return self.product_ids[found] if found != -1 else None
+
+
+def build_feed_index(feeds: List[Dict[str, Any]]) -> Dict[str, str]:
+    """product_id -> id первого фида, в ручном списке которого есть товар"""
+    index: Dict[str, str] = {}
+    for feed in feeds:
+        for product_id in (feed.get("settings") or {}).get("productIds") or []:
+            index.setdefault(product_id, feed["id"])
+    return index
+
+
+def sync_date_range(last_date: Optional[date], today: Optional[date] = None) -> tuple:
+    """Период синхронизации: от последней загруженной даты (с перекрытием) до сегодня"""
+    today = today or datetime.now().date()
+    if last_date is None:
+        date_from = today - timedelta(days=METRICA_SYNC_DAYS)
+    else:
+        date_from = min(last_date - timedelta(days=METRICA_SYNC_OVERLAP_DAYS), today)
+    return date_from.isoformat(), today.isoformat()
+
+
+class AnalyticsIngestion:
+    """Постраничная загрузка статистики UTM term из Метрики в БД"""
+
+    def __init__(self, client, db):
+        self.client = client
+        self.db = db
+
+    def run(self, on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Returns:
+            {'dateFrom', 'dateTo', 'rows', 'saved', 'matched', 'pages'}
+        """
+        date_from, date_to = sync_date_range(self.db.get_analytics_last_date())
+        matcher = ProductTermMatcher(self.db.get_product_ids())
+        feed_index = build_feed_index(self.db.get_feeds())
+        stats = {'dateFrom': date_from, 'dateTo': date_to, 'rows': 0, 'saved': 0, 'matched': 0, 'pages': 0}
+        # Совпадения кэшируются: одна и та же метка повторяется в каждом дне периода
+        matched_terms: Dict[str, Optional[str]] = {}
+
+        for records in self.client.iter_daily_utm_pages(date_from, date_to, page_size=METRICA_PAGE_SIZE):
+            rows = []
+            for record in records:
+                utm_term = record["utm_term"]
+                if not utm_term or not record.get("date"):
+                    continue
+                if utm_term not in matched_terms:
+                    matched_terms[utm_term] = matcher.match(utm_term)
+                product_id = matched_terms[utm_term]
+                rows.append({
+                    "date": record["date"],
+                    "utm_term": utm_term,
+                    "visits": record["visits"],
+                    "users": record["users"],
+                    "pageviews": record["pageviews"],
+                    "bounce_rate": record["bounceRate"],
+                    "product_id": product_id,
+                    "feed_id": feed_index.get(product_id) if product_id else None,
+                })
+                if product_id:
+                    stats['matched'] += 1
+
+            saved = self.db.upsert_analytics_rows(rows)
+            if saved is None:
+                raise Exception("Не удалось сохранить статистику Метрики")
+            stats['rows'] += len(records)
+            stats['saved'] += saved
+            stats['pages'] += 1
+            if on_progress:
+                on_progress(dict(stats))
+
+        logger.info(
+            f"Метрика {date_from} - {date_to}: строк {stats['rows']}, "
+            f"записано {stats['saved']}, с товаром {stats['matched']}"
+        )
+        return stats
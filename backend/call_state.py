@@ -0,0 +1,504 @@
+"""
+Хранилище состояния сигналинга звонков (WebRTC offer/answer/ICE, групповые звонки).
+
+Раньше всё состояние жило в ``runtime-data/call-signaling.json``: каждый опрос
+``GET /api/calls`` читал, чистил и целиком переписывал файл под глобальной
+блокировкой. Теперь backend подключаемый:
+
+- ``memory``   - очереди по пользователям в памяти процесса, истечение через
+  heap-индексы TTL, опциональный снапшот в JSON-файл (один воркер)
+- ``postgres`` - UNLOGGED-таблицы, общие для всех воркеров
+
+Выбирается переменной окружения ``CALL_STATE_BACKEND``.
+
+Форма данных прежняя: сигнал в очереди - ``{"signal", "ts", "scope"}``,
+сессии p2p и групповые звонки - словари как в API.
+"""
+import asyncio
+import copy
+import heapq
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+CALL_SIGNAL_TTL_MS = 30_000
+CALL_SESSION_TTL_MS = 45_000
+GROUP_CALL_STALE_MS = 60_000
+CALL_SIGNALING_DIR = Path(os.getenv("CALL_SIGNALING_DIR", str((Path(__file__).resolve().parent.parent / "runtime-data").resolve())))
+CALL_SIGNALING_FILE = CALL_SIGNALING_DIR / "call-signaling.json"
+CALL_SNAPSHOT_INTERVAL = float(os.getenv("CALL_STATE_SNAPSHOT_INTERVAL", "5"))
+# Как часто backend на PostgreSQL проверяет очередь при long-polling
+CALL_POLL_INTERVAL = 0.5
+
+# Получатели сигналов, поставленных внутри locked_state(): будятся после COMMIT
+_pending_wakeups: ContextVar[Optional[List[str]]] = ContextVar("call_pending_wakeups", default=None)
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _matches_scope(entry_scope: str, scope: str) -> bool:
+    return scope == "all" or str(entry_scope or "p2p") == scope
+
+
+def _group_call_expired(call: Dict[str, Any], now: int) -> bool:
+    if call.get("participants"):
+        return False
+    return now - int(call.get("startedAt", 0) or 0) > GROUP_CALL_STALE_MS
+
+
+class CallState:
+    """Изменяемый вид на сессии p2p и групповые звонки внутри ``locked_state()``"""
+
+    def __init__(self, sessions: Dict[str, Any], group_calls: Dict[str, Any]):
+        self.sessions = sessions
+        self.group_calls = group_calls
+
+
+class _SignalWaiters:
+    """Ожидающие long-poll запросы по пользователям (в рамках процесса)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+
+    def add(self, user_id: str):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.setdefault(user_id, set()).add(waiter)
+        return waiter
+
+    def remove(self, user_id: str, waiter):
+        with self._lock:
+            waiters = self._waiters.get(user_id)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    self._waiters.pop(user_id, None)
+
+    def notify(self, user_id: str):
+        with self._lock:
+            waiters = list(self._waiters.get(user_id, ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Event loop ожидающего уже закрыт
+                pass
+
+    def count(self) -> int:
+        with self._lock:
+            return sum(len(w) for w in self._waiters.values())
+
+
+class MemoryCallStateStore:
+    """Состояние звонков в памяти процесса.
+
+    Очередь каждого пользователя - deque в порядке поступления, поэтому
+    выдача сигналов стоит O(сигналов этого пользователя). Истечение очередей,
+    сессий и групповых звонков ведёт один heap ``(expires_at, kind, key)``:
+    у каждого ключа не больше одной записи в heap, устаревшие записи
+    перепроверяются при извлечении.
+    """
+
+    def __init__(self, snapshot_file: Optional[Path] = None, snapshot_interval: float = CALL_SNAPSHOT_INTERVAL):
+        self._lock = threading.RLock()
+        self._queues: Dict[str, Deque[Dict[str, Any]]] = {}
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._group_calls: Dict[str, Dict[str, Any]] = {}
+        self._expiry: List[Tuple[int, str, str]] = []
+        self._tracked: Set[Tuple[str, str]] = set()
+        self._waiters = _SignalWaiters()
+        self._snapshot_file = snapshot_file
+        self._snapshot_interval = snapshot_interval
+        self._dirty = False
+        self._stop = threading.Event()
+        if snapshot_file is not None:
+            self._load_snapshot()
+            threading.Thread(target=self._snapshot_loop, name="call-state-snapshot", daemon=True).start()
+
+    # ---- TTL-индекс ----
+
+    def _track(self, kind: str, key: str, expires_at: int):
+        if (kind, key) in self._tracked:
+            return
+        self._tracked.add((kind, key))
+        heapq.heappush(self._expiry, (expires_at, kind, key))
+
+    def _expires_at(self, kind: str, key: str) -> Optional[int]:
+        """Актуальный срок жизни ключа или None, если ключа больше нет"""
+        if kind == "queue":
+            queue = self._queues.get(key)
+            return int(queue[0].get("ts", 0)) + CALL_SIGNAL_TTL_MS if queue else None
+        if kind == "session":
+            session = self._sessions.get(key)
+            return int(session.get("lastActivityAt", 0)) + CALL_SESSION_TTL_MS if session else None
+        call = self._group_calls.get(key)
+        if not call or call.get("participants"):
+            return None
+        return int(call.get("startedAt", 0) or 0) + GROUP_CALL_STALE_MS + 1
+
+    def _prune(self, now: int):
+        """Удалить истёкшее; амортизированно O(истёкших ключей)"""
+        while self._expiry and self._expiry[0][0] <= now:
+            _, kind, key = heapq.heappop(self._expiry)
+            self._tracked.discard((kind, key))
+            if kind == "queue":
+                queue = self._queues.get(key)
+                while queue and now - int(queue[0].get("ts", 0)) >= CALL_SIGNAL_TTL_MS:
+                    queue.popleft()
+                    self._dirty = True
+                if not queue:
+                    self._queues.pop(key, None)
+            elif kind == "session":
+                session = self._sessions.get(key)
+                if session and now - int(session.get("lastActivityAt", 0)) >= CALL_SESSION_TTL_MS:
+                    self._sessions.pop(key, None)
+                    self._dirty = True
+            else:
+                call = self._group_calls.get(key)
+                if call and _group_call_expired(call, now):
+                    self._group_calls.pop(key, None)
+                    self._dirty = True
+            expires_at = self._expires_at(kind, key)
+            if expires_at is not None:
+                self._track(kind, key, expires_at)
+
+    # ---- API хранилища ----
+
+    def enqueue_signal(self, signal: Dict[str, Any], scope: str):
+        to_user_id = str(signal.get("toUserId", "")).strip()
+        if not to_user_id:
+            return
+        entry = {"signal": signal, "ts": _now_ms(), "scope": scope}
+        with self._lock:
+            self._queues.setdefault(to_user_id, deque()).append(entry)
+            self._track("queue", to_user_id, entry["ts"] + CALL_SIGNAL_TTL_MS)
+            self._dirty = True
+        self._waiters.notify(to_user_id)
+
+    def take_signals(self, user_id: str, scope: str) -> List[Dict[str, Any]]:
+        """Забрать сигналы пользователя для scope (p2p / group / all)"""
+        with self._lock:
+            self._prune(_now_ms())
+            queue = self._queues.get(user_id)
+            if not queue:
+                return []
+            deliverable = [entry for entry in queue if _matches_scope(entry.get("scope"), scope)]
+            if not deliverable:
+                return []
+            remaining = deque(entry for entry in queue if not _matches_scope(entry.get("scope"), scope))
+            if remaining:
+                self._queues[user_id] = remaining
+            else:
+                self._queues.pop(user_id, None)
+            self._dirty = True
+        return [entry.get("signal", {}) for entry in deliverable]
+
+    def has_signals(self, user_id: str, scope: str) -> bool:
+        with self._lock:
+            self._prune(_now_ms())
+            return any(_matches_scope(entry.get("scope"), scope) for entry in self._queues.get(user_id, ()))
+
+    async def wait_for_signals(self, user_id: str, scope: str, timeout: float):
+        """Дождаться сигнала для пользователя (или таймаута)"""
+        waiter = self._waiters.add(user_id)
+        try:
+            if self.has_signals(user_id, scope):
+                return
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters.remove(user_id, waiter)
+
+    @contextmanager
+    def locked_state(self):
+        """Эксклюзивный доступ к сессиям и групповым звонкам.
+
+        Изменения словарей внутри блока сохраняются при выходе.
+        """
+        with self._lock:
+            now = _now_ms()
+            self._prune(now)
+            yield CallState(self._sessions, self._group_calls)
+            for skey, session in self._sessions.items():
+                self._track("session", skey, int(session.get("lastActivityAt", now)) + CALL_SESSION_TTL_MS)
+            for call_id, call in self._group_calls.items():
+                expires_at = self._expires_at("group", call_id)
+                if expires_at is not None:
+                    self._track("group", call_id, expires_at)
+            self._dirty = True
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "queuedUsers": len(self._queues),
+                "queuedSignals": sum(len(q) for q in self._queues.values()),
+                "sessions": len(self._sessions),
+                "groupCalls": len(self._group_calls),
+                "waiters": self._waiters.count(),
+                "snapshot": str(self._snapshot_file) if self._snapshot_file else None,
+            }
+
+    # ---- Снапшот ----
+
+    def _load_snapshot(self):
+        try:
+            parsed = json.loads(self._snapshot_file.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"[Calls] ⚠️ Failed to read call state snapshot: {e}")
+            return
+        if not isinstance(parsed, dict):
+            return
+        now = _now_ms()
+        with self._lock:
+            for user_id, entries in (parsed.get("queues") or {}).items():
+                fresh = sorted(
+                    (e for e in entries if now - int(e.get("ts", 0)) < CALL_SIGNAL_TTL_MS),
+                    key=lambda e: int(e.get("ts", 0)),
+                )
+                if fresh:
+                    self._queues[str(user_id)] = deque(fresh)
+                    self._track("queue", str(user_id), int(fresh[0].get("ts", 0)) + CALL_SIGNAL_TTL_MS)
+            self._sessions.update(parsed.get("sessions") or {})
+            self._group_calls.update(parsed.get("groupCalls") or {})
+        with self.locked_state():
+            pass
+        print(f"[Calls] Restored call state: {len(self._queues)} queues, {len(self._sessions)} sessions")
+
+    def save_snapshot(self):
+        """Записать состояние в файл, если оно менялось"""
+        if self._snapshot_file is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {
+                "queues": {user_id: list(queue) for user_id, queue in self._queues.items()},
+                "sessions": self._sessions,
+                "groupCalls": self._group_calls,
+            }
+            payload = json.dumps(state, ensure_ascii=False)
+            self._dirty = False
+        try:
+            self._snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self._snapshot_file.with_suffix(".json.tmp")
+            temp_file.write_text(payload, encoding="utf-8")
+            temp_file.replace(self._snapshot_file)
+        except Exception as e:
+            print(f"[Calls] ⚠️ Failed to write call state snapshot: {e}")
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self._snapshot_interval):
+            self.save_snapshot()
+
+    def close(self):
+        self._stop.set()
+        self.save_snapshot()
+
+
+class PostgresCallStateStore:
+    """Состояние звонков в UNLOGGED-таблицах PostgreSQL (общее для воркеров).
+
+    Очередь читается и очищается одним ``DELETE ... RETURNING`` по индексу
+    ``(to_user_id, id)``. Сессии и групповые звонки - короткоживущие и
+    немногочисленные, поэтому ``locked_state()`` читает их целиком под
+    advisory-блокировкой в транзакции и записывает только изменения.
+    Таблицы создает migrations/005_call_signaling_tables.sql (schema_migrations).
+    """
+
+    # Ключ pg_advisory_xact_lock для сессий звонков
+    LOCK_KEY = 0x43414C4C
+    PRUNE_INTERVAL_MS = 5_000
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._waiters = _SignalWaiters()
+        self._last_prune = 0
+
+    def _prune(self, now: int):
+        if now - self._last_prune < self.PRUNE_INTERVAL_MS:
+            return
+        self._last_prune = now
+        self.conn.execute_query("DELETE FROM call_signal_queue WHERE created_at_ms <= %s", (now - CALL_SIGNAL_TTL_MS,))
+        self.conn.execute_query("DELETE FROM call_sessions WHERE last_activity_ms <= %s", (now - CALL_SESSION_TTL_MS,))
+        self.conn.execute_query(
+            "DELETE FROM call_group_calls WHERE participant_count = 0 AND started_at_ms < %s",
+            (now - GROUP_CALL_STALE_MS,)
+        )
+
+    def enqueue_signal(self, signal: Dict[str, Any], scope: str):
+        to_user_id = str(signal.get("toUserId", "")).strip()
+        if not to_user_id:
+            return
+        self.conn.execute_query(
+            "INSERT INTO call_signal_queue (to_user_id, scope, signal, created_at_ms) VALUES (%s, %s, %s, %s)",
+            (to_user_id, scope, json.dumps(signal, ensure_ascii=False), _now_ms())
+        )
+        pending = _pending_wakeups.get()
+        if pending is not None:
+            # Строка еще не закоммичена: ожидающий не увидел бы ее
+            pending.append(to_user_id)
+        else:
+            self._waiters.notify(to_user_id)
+
+    def take_signals(self, user_id: str, scope: str) -> List[Dict[str, Any]]:
+        now = _now_ms()
+        self._prune(now)
+        if scope == "all":
+            rows = self.conn.fetch_all(
+                "DELETE FROM call_signal_queue WHERE to_user_id = %s RETURNING id, signal, created_at_ms",
+                (user_id,)
+            )
+        else:
+            rows = self.conn.fetch_all(
+                "DELETE FROM call_signal_queue WHERE to_user_id = %s AND scope = %s RETURNING id, signal, created_at_ms",
+                (user_id, scope)
+            )
+        rows = [row for row in rows if now - int(row['created_at_ms']) < CALL_SIGNAL_TTL_MS]
+        rows.sort(key=lambda row: row['id'])
+        return [row['signal'] for row in rows]
+
+    def has_signals(self, user_id: str, scope: str) -> bool:
+        query = "SELECT 1 FROM call_signal_queue WHERE to_user_id = %s AND created_at_ms > %s"
+        params: Tuple[Any, ...] = (user_id, _now_ms() - CALL_SIGNAL_TTL_MS)
+        if scope != "all":
+            query += " AND scope = %s"
+            params += (scope,)
+        return self.conn.fetch_one(query + " LIMIT 1", params) is not None
+
+    async def wait_for_signals(self, user_id: str, scope: str, timeout: float):
+        """Дождаться сигнала: мгновенно для сигналов из этого воркера,
+        с интервалом ``CALL_POLL_INTERVAL`` - для остальных"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        waiter = self._waiters.add(user_id)
+        try:
+            while True:
+                if await loop.run_in_executor(None, self.has_signals, user_id, scope):
+                    return
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), min(CALL_POLL_INTERVAL, remaining))
+                    return
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiters.remove(user_id, waiter)
+
+    @contextmanager
+    def locked_state(self):
+        now = _now_ms()
+        self._prune(now)
+        pending: List[str] = []
+        token = _pending_wakeups.set(pending)
+        try:
+            with self.conn.transaction() as tx:
+                self.conn.fetch_one("SELECT pg_advisory_xact_lock(%s)", (self.LOCK_KEY,))
+                sessions = {
+                    row['session_key']: row['data']
+                    for row in self.conn.fetch_all(
+                        "SELECT session_key, data FROM call_sessions WHERE last_activity_ms > %s",
+                        (now - CALL_SESSION_TTL_MS,)
+                    )
+                }
+                group_calls = {
+                    row['call_id']: row['data']
+                    for row in self.conn.fetch_all(
+                        "SELECT call_id, data FROM call_group_calls WHERE participant_count > 0 OR started_at_ms >= %s",
+                        (now - GROUP_CALL_STALE_MS,)
+                    )
+                }
+                original_sessions = copy.deepcopy(sessions)
+                original_group_calls = copy.deepcopy(group_calls)
+
+                yield CallState(sessions, group_calls)
+
+                removed_sessions = [key for key in original_sessions if key not in sessions]
+                if removed_sessions:
+                    self.conn.execute_query("DELETE FROM call_sessions WHERE session_key = ANY(%s)", (removed_sessions,))
+                for key, session in sessions.items():
+                    if original_sessions.get(key) != session:
+                        self.conn.execute_query(
+                            """
+                            INSERT INTO call_sessions (session_key, data, last_activity_ms) VALUES (%s, %s, %s)
+                            ON CONFLICT (session_key) DO UPDATE
+                            SET data = EXCLUDED.data, last_activity_ms = EXCLUDED.last_activity_ms
+                            """,
+                            (key, json.dumps(session, ensure_ascii=False), int(session.get("lastActivityAt", now)))
+                        )
+
+                removed_calls = [call_id for call_id in original_group_calls if call_id not in group_calls]
+                if removed_calls:
+                    self.conn.execute_query("DELETE FROM call_group_calls WHERE call_id = ANY(%s)", (removed_calls,))
+                for call_id, call in group_calls.items():
+                    if original_group_calls.get(call_id) != call:
+                        self.conn.execute_query(
+                            """
+                            INSERT INTO call_group_calls (call_id, chat_id, data, participant_count, started_at_ms)
+                            VALUES (%s, %s, %s, %s, %s)
+                            ON CONFLICT (call_id) DO UPDATE
+                            SET chat_id = EXCLUDED.chat_id, data = EXCLUDED.data,
+                                participant_count = EXCLUDED.participant_count, started_at_ms = EXCLUDED.started_at_ms
+                            """,
+                            (
+                                call_id, str(call.get("chatId") or ""), json.dumps(call, ensure_ascii=False),
+                                len(call.get("participants") or []), int(call.get("startedAt", now) or now)
+                            )
+                        )
+        finally:
+            _pending_wakeups.reset(token)
+        if tx.committed:
+            for user_id in dict.fromkeys(pending):
+                self._waiters.notify(user_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        counts = self.conn.fetch_one(
+            """
+            SELECT
+                (SELECT COUNT(*) FROM call_signal_queue) AS queued_signals,
+                (SELECT COUNT(DISTINCT to_user_id) FROM call_signal_queue) AS queued_users,
+                (SELECT COUNT(*) FROM call_sessions) AS sessions,
+                (SELECT COUNT(*) FROM call_group_calls) AS group_calls
+            """
+        ) or {}
+        return {
+            "backend": "postgres",
+            "queuedUsers": int(counts.get('queued_users') or 0),
+            "queuedSignals": int(counts.get('queued_signals') or 0),
+            "sessions": int(counts.get('sessions') or 0),
+            "groupCalls": int(counts.get('group_calls') or 0),
+            "waiters": self._waiters.count(),
+        }
+
+    def close(self):
+        pass
+
+
+def create_call_state_store(conn=None):
+    """Создать хранилище по ``CALL_STATE_BACKEND`` (memory | postgres).
+
+    Args:
+        conn: PostgresConnection для backend ``postgres``
+
+    Returns:
+        MemoryCallStateStore или PostgresCallStateStore
+    """
+    backend = os.getenv("CALL_STATE_BACKEND", "memory").strip().lower()
+    if backend == "postgres" and conn is not None:
+        return PostgresCallStateStore(conn)
+    persist = os.getenv("CALL_STATE_SNAPSHOT", "true").strip().lower() in ("1", "true", "yes")
+    return MemoryCallStateStore(snapshot_file=CALL_SIGNALING_FILE if persist else None)
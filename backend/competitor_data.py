@@ -5,11 +5,26 @@ import json
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-import asyncio
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+class _SourceSnapshot:
+    """Загруженный файл источника: программы, продукты, индекс таймлайна и счетчики"""
+    
+    __slots__ = ("file_key", "programs", "products", "timeline", "items_count", "items_with_dates")
+    
+    def __init__(self, file_key, programs, products, timeline, items_with_dates):
+        self.file_key = file_key
+        self.programs = programs
+        self.products = products
+        # [(ключ сортировки, дата, базовая информация о туре)]
+        self.timeline = timeline
+        self.items_count = len(programs)
+        self.items_with_dates = items_with_dates
+
+
 class CompetitorDataManager:
     def __init__(self):
         self.base_path = Path(__file__).parent.parent / "magput-parser"
@@ -26,6 +41,11 @@ class CompetitorDataManager:
                 "canParse": True  # Поддерживает парсинг через API
             }
         }
+        # Файлы читаются один раз и перечитываются только при изменении mtime/размера
+        self._lock = threading.Lock()
+        self._snapshots: Dict[str, _SourceSnapshot] = {}
+        self._timeline_key = None
+        self._timeline: List[tuple] = []
     
     def load_json_file(self, filename: str) -> Dict[str, Any]:
         """Загрузка JSON файла"""
@@ -40,20 +60,113 @@ class CompetitorDataManager:
             print(f"Error loading {filename}: {e}")
             return {"programs": []}
     
+    def _file_key(self, filename: str):
+        try:
+            stat = (self.base_path / filename).stat()
+            return (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+    
+    def _build_snapshot(self, source_id: str, source: Dict[str, Any], file_key) -> _SourceSnapshot:
+        """Разобрать файл источника и построить индексы"""
+        data = self.load_json_file(source["file"]) if file_key else {"programs": []}
+        programs = []
+        products = []
+        timeline = []
+        items_with_dates = 0
+        
+        for program in data.get("programs", []):
+            # Добавляем информацию об источнике
+            program_copy = program.copy()
+            program_copy["source"] = "magput"
+            program_copy["sourceId"] = source_id
+            program_copy["sourceName"] = source["name"]
+            programs.append(program_copy)
+            
+            content = program_copy.get("content") or {}
+            duration = content.get("duration") or {}
+            price_min = content.get("priceMin") or {}
+            route = [r.get("name", "") for r in program_copy.get("route", [])]
+            image = (program_copy.get("mainPhoto") or {}).get("url")
+            dates = program_copy.get("dates", [])
+            if dates:
+                items_with_dates += 1
+            
+            products.append({
+                "id": f"{source_id}-{program_copy.get('id')}",
+                "tourId": program_copy.get("id"),
+                "name": content.get("name", ""),
+                "price": price_min.get("brutto", 0),
+                "currency": price_min.get("currency", "руб"),
+                "days": duration.get("days", 1),
+                "source": "magput",
+                "sourceId": source_id,
+                "sourceName": source["name"],
+                "image": image,
+                "route": route,
+                "datesCount": len(dates),
+                "enabled": True
+            })
+            
+            tour_info = {
+                "tourId": program_copy.get("id"),
+                "tourName": content.get("name", ""),
+                "days": duration.get("days", 1),
+                "price": price_min.get("brutto", 0),
+                "currency": price_min.get("currency", "руб"),
+                "source": "magput",
+                "sourceId": source_id,
+                "sourceName": source["name"],
+                "image": image,
+                "route": route,
+            }
+            
+            # Каждая дата - отдельный элемент таймлайна; тур без дат - один элемент
+            if dates:
+                for date_obj in dates:
+                    date_str = date_obj.get("date", "")
+                    if date_str:
+                        timeline.append((date_str, date_str, tour_info))
+            else:
+                timeline.append(("9999-12-31", None, tour_info))
+        
+        return _SourceSnapshot(file_key, programs, products, timeline, items_with_dates)
+    
+    def _snapshots_for(self, enabled_only: bool = False) -> List[tuple]:
+        """Актуальные снимки источников: [(source_id, source, snapshot)]"""
+        result = []
+        with self._lock:
+            for source_id, source in self.sources.items():
+                if enabled_only and not source["enabled"]:
+                    continue
+                file_key = self._file_key(source["file"])
+                snapshot = self._snapshots.get(source_id)
+                if snapshot is None or snapshot.file_key != file_key:
+                    snapshot = self._build_snapshot(source_id, source, file_key)
+                    self._snapshots[source_id] = snapshot
+                result.append((source_id, source, snapshot))
+        return result
+    
+    def invalidate(self, source_id: Optional[str] = None):
+        """Сбросить загруженные данные (после записи файла источника)"""
+        with self._lock:
+            if source_id is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(source_id, None)
+            self._timeline_key = None
+    
     def get_sources(self) -> List[Dict[str, Any]]:
         """Получить список всех источников"""
         sources_list = []
-        for source_id, source in self.sources.items():
-            data = self.load_json_file(source["file"])
+        for source_id, source, snapshot in self._snapshots_for():
             source_copy = source.copy()
-            source_copy["itemsCount"] = len(data.get("programs", []))
-            source_copy["status"] = "success" if source_copy["itemsCount"] > 0 else "idle"
+            source_copy["itemsCount"] = snapshot.items_count
+            source_copy["status"] = "success" if snapshot.items_count > 0 else "idle"
             
             # Добавляем информацию о датах
-            programs = data.get("programs", [])
-            items_with_dates = sum(1 for p in programs if p.get("dates"))
-            source_copy["itemsWithDates"] = items_with_dates
-            source_copy["itemsWithoutDates"] = source_copy["itemsCount"] - items_with_dates
+            source_copy["itemsWithDates"] = snapshot.items_with_dates
+            source_copy["itemsWithoutDates"] = snapshot.items_count - snapshot.items_with_dates
             
             sources_list.append(source_copy)
         return sources_list
@@ -69,7 +182,7 @@ class CompetitorDataManager:
         Returns:
             Результат парсинга
         """
-        from parser.magput_parser import MagputParser
+        from parser.magput_pipeline import MagputIngestion
         
         if source_id not in self.sources:
             raise ValueError(f"Источник {source_id} не найден")
@@ -85,26 +198,33 @@ class CompetitorDataManager:
                 "startedAt": datetime.now().isoformat()
             })
             
-            parser = MagputParser()
             sub_type = source.get("subType", "11")
             
             logger.info(f"Начало парсинга {source['name']} (SubType: {sub_type})")
             
-            # Обновляем состояние
-            db_manager.set_parsing_state(source_id, {
-                "status": "parsing",
-                "progress": 25,
-                "message": "Получение данных с Magput..."
-            })
+            # Страницы загружаются параллельно; сырые программы копятся по
+            # страницам, чтобы файл сохранял порядок выдачи
+            pages: Dict[int, List[Dict[str, Any]]] = {}
             
-            # Парсим туры (используем asyncio.to_thread для синхронного кода)
-            tours = await asyncio.to_thread(parser.fetch_tours, sub_type=sub_type)
+            def collect_page(page: int, page_tours: List[Dict[str, Any]]):
+                pages[page] = [tour.get("rawData", tour) for tour in page_tours]
+            
+            def report_progress(stats: Dict[str, Any]):
+                db_manager.set_parsing_state(source_id, {
+                    "status": "parsing",
+                    "progress": int(90 * stats["pagesWritten"] / max(stats["pages"], 1)),
+                    "message": f"Получено страниц {stats['pagesWritten']}/{stats['pages']} ({stats['tours']} туров)..."
+                })
+            
+            ingestion = MagputIngestion(sub_type=sub_type, checkpoint_key=f"competitor-{source_id}")
+            await ingestion.run(collect_page, on_progress=report_progress)
+            programs = [program for page in sorted(pages) for program in pages[page]]
             
             # Обновляем состояние
             db_manager.set_parsing_state(source_id, {
                 "status": "parsing",
-                "progress": 75,
-                "message": f"Сохранение {len(tours)} туров..."
+                "progress": 95,
+                "message": f"Сохранение {len(programs)} туров..."
             })
             
             # Сохраняем результат
@@ -113,10 +233,10 @@ class CompetitorDataManager:
             
             # Для Magput сохраняем полный результат парсера
             data = {
-                "count": len(tours),
+                "count": len(programs),
                 "currentPage": 1,
-                "itemsPerPage": len(tours),
-                "programs": [tour.get("rawData", tour) for tour in tours],
+                "itemsPerPage": len(programs),
+                "programs": programs,
                 "lastUpdate": datetime.now().isoformat(),
                 "source": "magput",
                 "subType": sub_type
@@ -124,22 +244,23 @@ class CompetitorDataManager:
             
             with open(file_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
+            self.invalidate(source_id)
             
             # Завершаем парсинг
             db_manager.set_parsing_state(source_id, {
                 "status": "completed",
                 "progress": 100,
-                "message": f"Успешно спарсено {len(tours)} туров",
+                "message": f"Успешно спарсено {len(programs)} туров",
                 "completedAt": datetime.now().isoformat(),
-                "itemsCount": len(tours)
+                "itemsCount": len(programs)
             })
             
-            logger.info(f"Парсинг {source['name']} завершен: {len(tours)} туров")
+            logger.info(f"Парсинг {source['name']} завершен: {len(programs)} туров")
             
             return {
                 "success": True,
-                "itemsCount": len(tours),
-                "message": f"Успешно спарсено {len(tours)} туров"
+                "itemsCount": len(programs),
+                "message": f"Успешно спарсено {len(programs)} туров"
             }
             
         except Exception as e:
@@ -156,69 +277,33 @@ class CompetitorDataManager:
             raise
     
     def get_all_programs(self) -> List[Dict[str, Any]]:
-        """Получить все программы из всех источников"""
+        """Получить все программы из всех источников (общие объекты - не изменять)"""
         all_programs = []
-        
-        for source_id, source in self.sources.items():
-            if not source["enabled"]:
-                continue
-                
-            data = self.load_json_file(source["file"])
-            programs = data.get("programs", [])
-            
-            for program in programs:
-                # Добавляем информацию об источнике
-                program_copy = program.copy()
-                program_copy["source"] = "magput"
-                program_copy["sourceId"] = source_id
-                program_copy["sourceName"] = source["name"]
-                all_programs.append(program_copy)
-        
+        for _, _, snapshot in self._snapshots_for(enabled_only=True):
+            all_programs.extend(snapshot.programs)
         return all_programs
     
     def get_timeline_data(self, limit: int = 100, offset: int = 0) -> Dict[str, Any]:
         """Получить данные для таймлайна - туры с датами с пагинацией"""
-        all_programs = self.get_all_programs()
-        timeline_items = []
-        
-        for program in all_programs:
-            # Получаем базовую информацию о туре
-            tour_info = {
-                "tourId": program.get("id"),
-                "tourName": program["content"].get("name", ""),
-                "days": program["content"]["duration"].get("days", 1),
-                "price": program["content"]["priceMin"].get("brutto", 0),
-                "currency": program["content"]["priceMin"].get("currency", "руб"),
-                "source": program.get("source"),
-                "sourceId": program.get("sourceId"),
-                "sourceName": program.get("sourceName"),
-                "image": program.get("mainPhoto", {}).get("url"),
-                "route": [r.get("name", "") for r in program.get("route", [])],
-            }
-            
-            # Добавляем каждую дату как отдельный элемент таймлайна
-            dates = program.get("dates", [])
-            if dates:
-                for date_obj in dates:
-                    date_str = date_obj.get("date", "")
-                    if date_str:
-                        timeline_item = tour_info.copy()
-                        timeline_item["date"] = date_str
-                        timeline_item["dateFormatted"] = self.format_date(date_str)
-                        timeline_items.append(timeline_item)
-            else:
-                # Если дат нет, добавляем тур без даты
-                timeline_item = tour_info.copy()
-                timeline_item["date"] = None
-                timeline_item["dateFormatted"] = "Дата не указана"
-                timeline_items.append(timeline_item)
-        
-        # Сортируем по дате
-        timeline_items.sort(key=lambda x: x.get("date") or "9999-12-31")
+        snapshots = self._snapshots_for(enabled_only=True)
+        key = tuple((source_id, snapshot.file_key) for source_id, _, snapshot in snapshots)
+        with self._lock:
+            if self._timeline_key != key:
+                # Индекс, отсортированный по дате, строится один раз на версию файлов
+                timeline = [entry for _, _, snapshot in snapshots for entry in snapshot.timeline]
+                timeline.sort(key=lambda entry: entry[0])
+                self._timeline = timeline
+                self._timeline_key = key
+            timeline = self._timeline
         
-        # Применяем пагинацию
-        total = len(timeline_items)
-        paginated_items = timeline_items[offset:offset + limit]
+        # Применяем пагинацию: материализуются только элементы страницы
+        total = len(timeline)
+        paginated_items = []
+        for _, date_str, tour_info in timeline[offset:offset + limit]:
+            timeline_item = tour_info.copy()
+            timeline_item["date"] = date_str
+            timeline_item["dateFormatted"] = self.format_date(date_str) if date_str else "Дата не указана"
+            paginated_items.append(timeline_item)
         
         return {
             "items": paginated_items,
@@ -242,27 +327,9 @@ class CompetitorDataManager:
     
     def get_products(self) -> List[Dict[str, Any]]:
         """Получить уникальные продукты (туры без привязки к датам)"""
-        all_programs = self.get_all_programs()
         products = []
-        
-        for program in all_programs:
-            product = {
-                "id": f"{program.get('sourceId')}-{program.get('id')}",
-                "tourId": program.get("id"),
-                "name": program["content"].get("name", ""),
-                "price": program["content"]["priceMin"].get("brutto", 0),
-                "currency": program["content"]["priceMin"].get("currency", "руб"),
-                "days": program["content"]["duration"].get("days", 1),
-                "source": program.get("source"),
-                "sourceId": program.get("sourceId"),
-                "sourceName": program.get("sourceName"),
-                "image": program.get("mainPhoto", {}).get("url"),
-                "route": [r.get("name", "") for r in program.get("route", [])],
-                "datesCount": len(program.get("dates", [])),
-                "enabled": True
-            }
-            products.append(product)
-        
+        for _, _, snapshot in self._snapshots_for(enabled_only=True):
+            products.extend(product.copy() for product in snapshot.products)
         return products
 
 # Глобальный экземпляр
@@ -3,6 +3,7 @@ Database adapter that provides compatibility layer between JSON and PostgreSQL
 Can switch between implementations based on environment variable
 """
 import os
+from datetime import datetime
 from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
 
@@ -17,10 +18,15 @@ if USE_POSTGRES:
         """Adapter to PostgreSQL database"""
         
         def __init__(self):
-            self.conn = PostgresConnection()
+            self.conn = PostgresConnection(
+                pool_min_size=int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+                pool_max_size=int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+            )
             if not self.conn.connect():
                 raise Exception("Failed to connect to PostgreSQL")
             self.db = PostgresDatabase(self.conn)
+            # Состояние парсинга источников конкурентов - прогресс текущего процесса
+            self._parsing_state: Dict[str, Dict[str, Any]] = {}
         
         # Delegate all methods to PostgreSQL implementation
         def get_settings(self) -> Dict[str, Any]:
@@ -62,6 +68,17 @@ if USE_POSTGRES:
         def get_products(self, source_id: Optional[str] = None) -> List[Dict[str, Any]]:
             return self.db.get_products(source_id)
         
+        def get_product_ids(self) -> List[str]:
+            return self.db.get_product_ids()
+        
+        def iter_products(self, source_id: Optional[str] = None, product_ids: Optional[List[str]] = None,
+                          include_hidden: bool = False, batch_size: int = 500):
+            return self.db.iter_products(source_id, product_ids, include_hidden, batch_size)
+        
+        def get_products_version(self, source_ids: Optional[List[str]] = None,
+                                 product_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+            return self.db.get_products_version(source_ids, product_ids)
+        
         def get_product(self, product_id: str) -> Optional[Dict[str, Any]]:
             return self.db.get_product(product_id)
         
@@ -77,24 +94,39 @@ if USE_POSTGRES:
         def delete_products_by_source(self, source_id: str) -> int:
             return self.db.delete_products_by_source(source_id)
         
-        def mark_missing_products(self, source_id: str, current_product_ids: List[str]):
+        def mark_missing_products(self, source_id: str, current_product_ids: List[str]) -> int:
             """Mark products as hidden if they're missing from source"""
-            products = self.db.get_products(source_id)
-            for product in products:
-                if product['id'] not in current_product_ids:
-                    self.db.update_product(product['id'], {'hidden': True})
-                else:
-                    self.db.update_product(product['id'], {'hidden': False})
-        
-        def sync_products(self, source_id: str, new_products: List[Dict[str, Any]]):
-            """Sync products for a source (delete old, add new)"""
-            self.delete_products_by_source(source_id)
-            self.add_products(new_products)
+            return self.db.mark_missing_products(source_id, current_product_ids)
+        
+        def sync_products(
+            self,
+            source_id: str,
+            new_products: List[Dict[str, Any]],
+            hide_missing: bool = True
+        ) -> Optional[Dict[str, int]]:
+            """Sync products for a source: upsert changed rows, hide missing ones.
+            
+            Returns inserted/updated/unchanged/hidden counts, None on failure.
+            """
+            return self.db.sync_products(source_id, new_products, hide_missing)
         
         def update_product_dates(self, product_id: str, dates: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
             """Update product dates"""
             return self.db.update_product(product_id, {'dates': dates})
         
+        def update_products_dates_batch(self, dates_by_product: Dict[str, List[Dict[str, Any]]]) -> Optional[int]:
+            """Update dates for many products at once; returns updated count, None on failure"""
+            return self.db.update_products_dates_batch(dates_by_product)
+        
+        def get_parsing_state(self, source_id: str) -> Optional[Dict[str, Any]]:
+            return self._parsing_state.get(source_id)
+        
+        def set_parsing_state(self, source_id: str, state: Dict[str, Any]):
+            self._parsing_state[source_id] = {**state, 'updatedAt': datetime.now().isoformat()}
+        
+        def clear_parsing_state(self, source_id: str):
+            self._parsing_state.pop(source_id, None)
+        
         def get_users(self) -> List[Dict[str, Any]]:
             return self.db.get_users()
         
@@ -141,9 +173,16 @@ if USE_POSTGRES:
         def get_user_chats(self, user_id: str) -> List[Dict[str, Any]]:
             return self.db.get_user_chats(user_id)
         
+        def get_chat_summaries(self, user_id: str) -> List[Dict[str, Any]]:
+            return self.db.get_chat_summaries(user_id)
+        
         def get_chat(self, chat_id: str) -> Optional[Dict[str, Any]]:
             return self.db.get_chat(chat_id)
         
+        def mark_chat_read(self, chat_id: str, user_id: str, message_id: Optional[str] = None,
+                           read_at: Optional[datetime] = None) -> Optional[str]:
+            return self.db.mark_chat_read(chat_id, user_id, message_id, read_at)
+        
         def find_private_chat(self, user_id1: str, user_id2: str) -> Optional[Dict[str, Any]]:
             return self.db.find_private_chat(user_id1, user_id2)
         
@@ -168,9 +207,16 @@ if USE_POSTGRES:
         def get_chat_messages(self, chat_id: str) -> List[Dict[str, Any]]:
             return self.db.get_chat_messages(chat_id)
         
+        def get_messages_page(self, chat_id: str, limit: int = 50, before_id: Optional[str] = None, after_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+            return self.db.get_messages_page(chat_id, limit, before_id, after_id)
+        
         def add_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
             return self.db.add_message(message)
         
+        def add_notification_messages(self, user_refs: List[str], message: Dict[str, Any],
+                                      from_user_ref: Optional[str] = None) -> List[Dict[str, Any]]:
+            return self.db.add_notification_messages(user_refs, message, from_user_ref)
+        
         def update_message(self, message_id: str, content: str) -> bool:
             return self.db.update_message(message_id, content)
         
@@ -211,6 +257,11 @@ if USE_POSTGRES:
         def get_events(self, entity: Optional[str] = None) -> List[Dict[str, Any]]:
             return self.db.get_events(entity)
 
+        def query_events(self, entity: str = 'event', date_from=None, date_to=None, event_type: Optional[str] = None,
+                         tag: Optional[str] = None, visible_to: Optional[str] = None,
+                         limit: Optional[int] = None, offset: int = 0):
+            return self.db.query_events(entity, date_from, date_to, event_type, tag, visible_to, limit, offset)
+
         def get_event(self, event_id: str, entity: Optional[str] = None) -> Optional[Dict[str, Any]]:
             return self.db.get_event(event_id, entity)
 
@@ -227,6 +278,12 @@ if USE_POSTGRES:
         def get_tasks(self, user_id: Optional[str] = None, list_id: Optional[str] = None) -> List[Dict[str, Any]]:
             return self.db.get_tasks(user_id, list_id)
         
+        def get_todo_version(self) -> int:
+            return self.db.get_todo_version()
+
+        def get_todo_changes(self, since: int, user_id: Optional[str] = None) -> Dict[str, Any]:
+            return self.db.get_todo_changes(since, user_id)
+
         def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
             return self.db.get_task(task_id)
         
@@ -323,6 +380,71 @@ if USE_POSTGRES:
         def delete_shared_link(self, link_id: str) -> bool:
             return self.db.delete_shared_link(link_id)
         
+        # Analytics
+        def upsert_analytics_rows(self, rows: List[Dict[str, Any]]) -> Optional[int]:
+            return self.db.upsert_analytics_rows(rows)
+        
+        def get_analytics_last_date(self):
+            return self.db.get_analytics_last_date()
+        
+        def get_analytics(self, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+            return self.db.get_analytics(filters)
+        
+        def clear_analytics(self) -> bool:
+            return self.db.clear_analytics()
+        
+        # Direct Parser
+        def get_direct_ads(self, query: Optional[str] = None, platform: Optional[str] = None,
+                           domain: Optional[str] = None, date_from: Optional[str] = None,
+                           date_to: Optional[str] = None, limit: int = 100, offset: int = 0) -> Dict[str, Any]:
+            return self.db.get_direct_ads(query, platform, domain, date_from, date_to, limit, offset)
+        
+        def add_direct_ads(self, ads: List[Dict[str, Any]], task_id: Optional[str] = None,
+                           session_id: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+            return self.db.add_direct_ads(ads, task_id, session_id)
+        
+        def delete_direct_ad(self, ad_id: str) -> bool:
+            return self.db.delete_direct_ad(ad_id)
+        
+        def delete_direct_ads(self, query: Optional[str] = None, date_before: Optional[str] = None) -> int:
+            return self.db.delete_direct_ads(query, date_before)
+        
+        def count_direct_ads(self) -> int:
+            return self.db.count_direct_ads()
+        
+        def get_direct_ads_stats(self) -> Dict[str, Any]:
+            return self.db.get_direct_ads_stats()
+        
+        def get_direct_ad_domains(self) -> List[Dict[str, Any]]:
+            return self.db.get_direct_ad_domains()
+        
+        def get_direct_searches(self) -> List[Dict[str, Any]]:
+            return self.db.get_direct_searches()
+        
+        def save_direct_search(self, search: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            return self.db.save_direct_search(search)
+        
+        def touch_direct_searches(self, queries: List[str]) -> bool:
+            return self.db.touch_direct_searches(queries)
+        
+        def set_direct_search_results(self, results_by_query: Dict[str, int]) -> bool:
+            return self.db.set_direct_search_results(results_by_query)
+        
+        def request_scope(self):
+            """Pin one pooled connection for the duration of a request"""
+            return self.conn.request_scope()
+        
+        def release_request_connection(self):
+            """Return the request's pinned connection to the pool (long-polling)"""
+            self.conn.release_request_connection()
+        
+        def get_pool_stats(self) -> Optional[Dict[str, Any]]:
+            return self.conn.pool_stats()
+        
+        def open_dedicated_connection(self):
+            """Raw connection outside the pool (LISTEN/NOTIFY and similar)"""
+            return self.conn._open_connection()
+        
         def save_to_disk(self):
             """No-op for PostgreSQL"""
             pass
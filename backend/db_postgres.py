@@ -19,15 +19,343 @@ except ImportError:
     PSYCOPG_VERSION = 2
     print("Using psycopg2")
 
+import hashlib
+import threading
+import time
+import uuid
+from collections import deque
+from decimal import Decimal, InvalidOperation
 from contextlib import contextmanager
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import urlparse
 from dotenv import load_dotenv
+from query_stats import query_stats
 
 load_dotenv()
 
+
+# Product fields stored in their own columns; everything else goes to metadata
+PRODUCT_SYNC_COLUMNS = {
+    'id', 'name', 'description', 'price', 'currency', 'url', 'image', 'image_url',
+    'dates', 'source_id', 'sourceId', 'hidden', 'metadata',
+}
+
+
+def _to_price(value: Any) -> Optional[str]:
+    """Parsed price ('12 500', '990.5', 1200) as a numeric string, or None"""
+    if value is None or value == '':
+        return None
+    try:
+        return str(Decimal(str(value).replace(' ', '').replace('\xa0', '').replace(',', '.')))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def _product_sync_row(source_id: str, product: Dict[str, Any]) -> Dict[str, Any]:
+    """Map a parsed tour to product columns plus a content hash of them"""
+    metadata = dict(product.get('metadata') or {})
+    for key, value in product.items():
+        if key not in PRODUCT_SYNC_COLUMNS:
+            metadata[key] = value
+    row = {
+        'id': str(product['id']),
+        'name': product.get('name') or '',
+        'description': product.get('description'),
+        'price': _to_price(product.get('price')),
+        'currency': product.get('currency'),
+        'url': product.get('url'),
+        'image_url': product.get('image_url') or product.get('image'),
+        'metadata': metadata,
+        'has_dates': 'dates' in product,
+        'dates': product.get('dates') if 'dates' in product else None,
+    }
+    fingerprint = json.dumps([source_id, row], sort_keys=True, default=str, ensure_ascii=False)
+    row['content_hash'] = hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
+    return row
+
+
+# Direct Parser ad fields stored in their own columns; everything else goes to extra
+DIRECT_AD_COLUMNS = {
+    'id', 'platform', 'type', 'query', 'title', 'description', 'url', 'display_url', 'domain',
+    'position', 'is_premium', 'sitelinks', 'extensions', 'session_id', 'task_id', 'taskId',
+    'timestamp', 'createdAt', 'created_at',
+}
+DIRECT_AD_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _parse_timestamp(value: Any) -> Optional[datetime]:
+    """'2026-01-31 10:00:00' / ISO string / datetime as naive datetime, or None"""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if not value or not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value.strip().replace('Z', '+00:00')).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _like_pattern(value: str) -> str:
+    """Substring pattern for ILIKE with the user's wildcards escaped"""
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def _direct_ad_row(ad: Dict[str, Any], task_id: Optional[str] = None,
+                   session_id: Optional[str] = None) -> Dict[str, Any]:
+    """Map an ad from the parser/agent to direct_ads columns"""
+    url = str(ad.get('url') or '')
+    try:
+        domain = urlparse(url).netloc.lower()
+    except ValueError:
+        domain = ''
+    try:
+        position = int(ad['position']) if ad.get('position') not in (None, '') else None
+    except (TypeError, ValueError):
+        position = None
+    is_premium = ad.get('is_premium')
+    if isinstance(is_premium, str):
+        is_premium = is_premium.strip().lower() in ('1', 'true', 'yes')
+    timestamp = _parse_timestamp(ad.get('timestamp')) or datetime.now()
+    return {
+        'id': str(ad.get('id') or uuid.uuid4()),
+        'platform': str(ad.get('platform') or ''),
+        'type': str(ad.get('type') or ''),
+        'query': str(ad.get('query') or ''),
+        'title': str(ad.get('title') or ''),
+        'description': str(ad.get('description') or ''),
+        'url': url,
+        'display_url': str(ad.get('display_url') or ''),
+        'domain': domain,
+        'position': position,
+        'is_premium': bool(is_premium),
+        'sitelinks': ad.get('sitelinks') if isinstance(ad.get('sitelinks'), list) else [],
+        'extensions': ad.get('extensions') if isinstance(ad.get('extensions'), dict) else {},
+        'extra': {k: v for k, v in ad.items() if k not in DIRECT_AD_COLUMNS},
+        'session_id': session_id or ad.get('session_id'),
+        'task_id': task_id or ad.get('task_id') or ad.get('taskId'),
+        'timestamp': timestamp.strftime(DIRECT_AD_TIMESTAMP_FORMAT),
+    }
+
+
+def _hydrate_direct_ad(row: Dict[str, Any]) -> Dict[str, Any]:
+    """direct_ads row in the API shape (extra fields merged back)"""
+    ad = dict(row.get('extra') or {})
+    for key in ('id', 'platform', 'type', 'query', 'title', 'description', 'url',
+                'display_url', 'position', 'is_premium', 'sitelinks', 'extensions'):
+        ad[key] = row.get(key)
+    if row.get('session_id'):
+        ad['session_id'] = row['session_id']
+    if row.get('task_id'):
+        ad['taskId'] = row['task_id']
+    ad['timestamp'] = row['timestamp'].strftime(DIRECT_AD_TIMESTAMP_FORMAT) if row.get('timestamp') else None
+    ad['createdAt'] = row['created_at'].isoformat() if row.get('created_at') else None
+    return ad
+
+
+def _hydrate_direct_search(row: Dict[str, Any]) -> Dict[str, Any]:
+    last_searched = row.get('last_searched')
+    return {
+        'id': row.get('id'),
+        'query': row.get('query'),
+        'pages_parsed': row.get('pages_parsed'),
+        'ads_found': row.get('ads_found'),
+        'status': row.get('status'),
+        'timestamp': last_searched.strftime(DIRECT_AD_TIMESTAMP_FORMAT) if last_searched else None,
+        'lastSearched': last_searched.isoformat() if last_searched else None,
+        'searchCount': row.get('search_count'),
+        'resultsCount': row.get('results_count'),
+    }
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of PostgreSQL connections with checkout metrics.
+
+    Liveness is verified only on checkout: a connection that sat idle longer
+    than ``check_idle_after`` seconds is pinged with ``SELECT 1`` before it is
+    handed out, and dead connections are transparently replaced.
+    """
+
+    def __init__(self, connect_fn, min_size: int = 1, max_size: int = 10,
+                 timeout: float = 30.0, check_idle_after: float = 30.0):
+        self._connect = connect_fn
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.check_idle_after = check_idle_after
+        self._idle = deque()  # (connection, returned_at)
+        self._size = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._reconnects = 0
+
+    def open(self):
+        """Pre-create min_size connections"""
+        for _ in range(self.min_size):
+            conn = self._connect()
+            with self._cond:
+                self._size += 1
+                self._idle.append((conn, time.monotonic()))
+
+    def close(self):
+        """Close all idle connections"""
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._size -= 1
+                self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def is_broken(conn) -> bool:
+        if conn is None or conn.closed:
+            return True
+        return bool(getattr(conn, 'broken', False))
+
+    def _is_alive(self, conn, idle_since: float) -> bool:
+        if self.is_broken(conn):
+            return False
+        if time.monotonic() - idle_since < self.check_idle_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """Check out a live connection, waiting up to ``timeout`` seconds"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, idle_since = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"No PostgreSQL connection available within {self.timeout}s "
+                        f"(pool size {self.max_size})"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            if conn is None:
+                conn = self._connect()
+            elif not self._is_alive(conn, idle_since):
+                self._close_quietly(conn)
+                conn = self._connect()
+                with self._cond:
+                    self._reconnects += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        wait = time.monotonic() - started
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            if waited:
+                self._waits += 1
+        return conn
+
+    def putconn(self, conn):
+        """Return a connection to the pool, discarding it if broken"""
+        broken = self.is_broken(conn)
+        with self._cond:
+            self._in_use -= 1
+            if broken:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if broken:
+            self._close_quietly(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of pool usage metrics"""
+        with self._cond:
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total_ms': round(self._wait_total * 1000, 2),
+                'wait_time_max_ms': round(self._wait_max * 1000, 2),
+                'wait_time_avg_ms': round(self._wait_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                'timeouts': self._timeouts,
+                'reconnects': self._reconnects,
+            }
+
+
+class _PinnedConnection:
+    """Pool connection checked out lazily once and reused for a whole request"""
+
+    def __init__(self, pool: Optional[ConnectionPool], connection=None):
+        self.pool = pool
+        self.connection = connection
+        self.closed = False
+        self.in_transaction = False
+        self.failed = False
+        self.committed = False
+        self.lock = threading.RLock()
+
+    def give_back(self):
+        """Return the connection to the pool; the next query checks out a new one"""
+        with self.lock:
+            if self.connection is not None and self.pool is not None:
+                self.pool.putconn(self.connection)
+            self.connection = None
+
+    def release(self):
+        with self.lock:
+            self.closed = True
+            self.give_back()
+
+
+_pinned_connection: ContextVar[Optional[_PinnedConnection]] = ContextVar('pg_pinned_connection', default=None)
+
+
 class PostgresConnection:
-    """PostgreSQL connection wrapper"""
+    """PostgreSQL connection wrapper.
+
+    With ``pool_max_size`` > 0 connections come from a ``ConnectionPool``;
+    otherwise a single shared connection is used (migration scripts).
+    """
     
     def __init__(
         self,
@@ -35,7 +363,11 @@ class PostgresConnection:
         port: int = int(os.getenv('DB_PORT', '5432')),
         database: str = os.getenv('DB_NAME', 'shar_messenger'),
         user: str = os.getenv('DB_USER', 'postgres'),
-        password: str = os.getenv('DB_PASSWORD', 'postgres')
+        password: str = os.getenv('DB_PASSWORD', 'postgres'),
+        pool_min_size: int = 0,
+        pool_max_size: int = 0,
+        pool_timeout: float = float(os.getenv('DB_POOL_TIMEOUT', '30')),
+        pool_check_idle_after: float = float(os.getenv('DB_POOL_CHECK_IDLE_AFTER', '30'))
     ):
         self.host = host
         self.port = port
@@ -43,32 +375,50 @@ class PostgresConnection:
         self.user = user
         self.password = password
         self.connection = None
+        self.pool: Optional[ConnectionPool] = None
+        if pool_max_size > 0:
+            self.pool = ConnectionPool(
+                self._open_connection,
+                min_size=pool_min_size,
+                max_size=pool_max_size,
+                timeout=pool_timeout,
+                check_idle_after=pool_check_idle_after
+            )
         
+    def _open_connection(self):
+        """Open a new raw connection (raises on failure)"""
+        if PSYCOPG_VERSION == 3:
+            # psycopg3 - modern, better Windows support
+            return psycopg_module.connect(
+                host=self.host,
+                port=self.port,
+                dbname=self.database,
+                user=self.user,
+                password=self.password,
+                autocommit=True,
+                row_factory=dict_row
+            )
+        # psycopg2 - legacy with Windows encoding workarounds
+        os.environ['PGPASSFILE'] = 'nul'
+        os.environ['PGCLIENTENCODING'] = 'UTF8'
+        
+        dsn = f"host={self.host} port={self.port} dbname={self.database} user={self.user} password={self.password} client_encoding=UTF8"
+        connection = psycopg_module.connect(dsn)
+        connection.set_client_encoding('UTF8')
+        connection.autocommit = True
+        return connection
+
     def connect(self) -> bool:
         """Establish connection to PostgreSQL"""
+        driver = 'psycopg3' if PSYCOPG_VERSION == 3 else 'psycopg2'
         try:
-            if PSYCOPG_VERSION == 3:
-                # psycopg3 - modern, better Windows support
-                self.connection = psycopg_module.connect(
-                    host=self.host,
-                    port=self.port,
-                    dbname=self.database,
-                    user=self.user,
-                    password=self.password,
-                    autocommit=True,
-                    row_factory=dict_row
-                )
-                print(f"✓ Connected to PostgreSQL via psycopg3: {self.user}@{self.host}:{self.port}/{self.database}")
+            if self.pool is not None:
+                self.pool.open()
+                print(f"✓ PostgreSQL pool via {driver}: {self.user}@{self.host}:{self.port}/{self.database} "
+                      f"(min={self.pool.min_size}, max={self.pool.max_size})")
             else:
-                # psycopg2 - legacy with Windows encoding workarounds
-                os.environ['PGPASSFILE'] = 'nul'
-                os.environ['PGCLIENTENCODING'] = 'UTF8'
-                
-                dsn = f"host={self.host} port={self.port} dbname={self.database} user={self.user} password={self.password} client_encoding=UTF8"
-                self.connection = psycopg_module.connect(dsn)
-                self.connection.set_client_encoding('UTF8')
-                self.connection.autocommit = True
-                print(f"✓ Connected to PostgreSQL via psycopg2: {self.user}@{self.host}:{self.port}/{self.database}")
+                self.connection = self._open_connection()
+                print(f"✓ Connected to PostgreSQL via {driver}: {self.user}@{self.host}:{self.port}/{self.database}")
             
             return True
         except Exception as e:
@@ -77,12 +427,17 @@ class PostgresConnection:
     
     def disconnect(self):
         """Close connection to PostgreSQL"""
+        if self.pool is not None:
+            self.pool.close()
+            print("✅ PostgreSQL pool closed")
         if self.connection:
             self.connection.close()
             print("✅ Disconnected from PostgreSQL")
     
     def is_connected(self) -> bool:
         """Check if connection is alive"""
+        if self.pool is not None:
+            return True
         if not self.connection or self.connection.closed:
             return False
         try:
@@ -98,29 +453,200 @@ class PostgresConnection:
         if not self.is_connected():
             print("⚠️ Connection lost, reconnecting...")
             self.connect()
-    
+
+    def pool_stats(self) -> Optional[Dict[str, Any]]:
+        """Pool metrics, or None in single-connection mode"""
+        return self.pool.stats() if self.pool is not None else None
+
+    @contextmanager
+    def request_scope(self):
+        """Pin one pooled connection to every query run inside this scope.
+
+        The connection is checked out on the first query and returned when
+        the scope exits. Queries from other threads, or after the scope has
+        been released, fall back to a per-query checkout.
+        """
+        if self.pool is None:
+            yield None
+            return
+        pinned = _PinnedConnection(self.pool)
+        token = _pinned_connection.set(pinned)
+        try:
+            yield pinned
+        finally:
+            _pinned_connection.reset(token)
+            pinned.release()
+
+    def release_request_connection(self):
+        """Hand the request's pinned connection back to the pool early.
+
+        For long-lived requests (long-polling) that should not hold a pool
+        slot while they wait; later queries check out a connection again.
+        """
+        pinned = _pinned_connection.get()
+        if pinned is not None and pinned.pool is self.pool and not pinned.in_transaction:
+            pinned.give_back()
+
+    @contextmanager
+    def transaction(self):
+        """Run every query inside the block on one connection within BEGIN/COMMIT.
+
+        The query helpers keep swallowing errors, so a failed statement marks
+        the transaction and it is rolled back on exit instead of committed.
+        Check ``tx.committed`` after the block. Nested calls join the outer
+        transaction.
+        """
+        current = _pinned_connection.get()
+        if current is not None and current.in_transaction and current.pool is self.pool:
+            yield current
+            return
+
+        request = current if (
+            current is not None and self.pool is not None and current.pool is self.pool and not current.closed
+        ) else None
+        if request is not None and request.lock.acquire(blocking=False):
+            # The request already holds a pooled connection: run the transaction
+            # on it instead of checking out a second one
+            try:
+                if request.connection is None:
+                    request.connection = self.pool.getconn()
+                tx = _PinnedConnection(self.pool, request.connection)
+                try:
+                    with self._run_transaction(tx):
+                        yield tx
+                finally:
+                    if self.pool.is_broken(request.connection):
+                        self.pool.putconn(request.connection)
+                        request.connection = None
+            finally:
+                request.lock.release()
+            return
+
+        if self.pool is not None:
+            tx = _PinnedConnection(self.pool, self.pool.getconn())
+        else:
+            self.ensure_connection()
+            tx = _PinnedConnection(None, self.connection)
+        try:
+            with self._run_transaction(tx):
+                yield tx
+        finally:
+            tx.release()
+
+    @contextmanager
+    def _run_transaction(self, tx: _PinnedConnection):
+        """BEGIN on tx.connection, COMMIT or ROLLBACK on exit (tx becomes the pinned connection)"""
+        tx.in_transaction = True
+        token = _pinned_connection.set(tx)
+        try:
+            with tx.lock:
+                with tx.connection.cursor() as cursor:
+                    cursor.execute("BEGIN")
+                try:
+                    yield tx
+                except Exception:
+                    tx.failed = True
+                    raise
+                finally:
+                    end = "ROLLBACK" if tx.failed else "COMMIT"
+                    try:
+                        with tx.connection.cursor() as cursor:
+                            cursor.execute(end)
+                        tx.committed = not tx.failed
+                    except Exception as e:
+                        print(f"❌ Transaction {end} error: {e}")
+                        try:
+                            tx.connection.rollback()
+                        except Exception:
+                            pass
+        finally:
+            _pinned_connection.reset(token)
+            tx.in_transaction = False
+
+    @contextmanager
+    def _borrow(self):
+        """Yield a live connection for a single operation"""
+        pinned = _pinned_connection.get()
+        if pinned is not None and pinned.in_transaction and pinned.pool is self.pool:
+            with pinned.lock:
+                try:
+                    yield pinned.connection
+                except Exception:
+                    pinned.failed = True
+                    raise
+            return
+
+        if self.pool is None:
+            self.ensure_connection()
+            yield self.connection
+            return
+
+        if pinned is not None and pinned.pool is self.pool and pinned.lock.acquire(blocking=False):
+            try:
+                if not pinned.closed:
+                    if pinned.connection is None:
+                        pinned.connection = self.pool.getconn()
+                    conn = pinned.connection
+                    try:
+                        yield conn
+                    except Exception:
+                        if self.pool.is_broken(conn):
+                            pinned.connection = None
+                            self.pool.putconn(conn)
+                        raise
+                    return
+            finally:
+                pinned.lock.release()
+
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            self.pool.putconn(conn)
+
+    @staticmethod
+    def _dict_cursor(connection):
+        if PSYCOPG_VERSION == 3:
+            return connection.cursor()
+        return connection.cursor(cursor_factory=RealDictCursor)
+    
+    @staticmethod
+    @contextmanager
+    def _timed(query: str, params: Any = None):
+        """Record the statement's duration and outcome in query_stats"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            query_stats.record(query, params, time.perf_counter() - started, e)
+            raise
+        query_stats.record(query, params, time.perf_counter() - started)
+
     def execute_query(self, query: str, params: tuple = None) -> bool:
         """Execute INSERT/UPDATE/DELETE query"""
         try:
-            self.ensure_connection()
-            with self.connection.cursor() as cursor:
-                cursor.execute(query, params or ())
-                return True
+            with self._borrow() as connection:
+                try:
+                    with connection.cursor() as cursor, self._timed(query, params):
+                        cursor.execute(query, params or ())
+                        return True
+                except Exception:
+                    # Inside transaction() the error marks it failed and
+                    # transaction() rolls back; rolling back here would end the
+                    # BEGIN early and leave later statements in autocommit
+                    pinned = _pinned_connection.get()
+                    if pinned is None or not pinned.in_transaction or pinned.connection is not connection:
+                        connection.rollback()
+                    raise
         except Exception as e:
             print(f"❌ Query execution error: {e}")
-            self.connection.rollback()
             return False
     
     def fetch_all(self, query: str, params: tuple = None) -> List[Dict[str, Any]]:
         """Fetch all results from SELECT query"""
         try:
-            self.ensure_connection()
-            if PSYCOPG_VERSION == 3:
-                with self.connection.cursor() as cursor:
-                    cursor.execute(query, params or ())
-                    return cursor.fetchall()
-            else:
-                with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            with self._borrow() as connection:
+                with self._dict_cursor(connection) as cursor, self._timed(query, params):
                     cursor.execute(query, params or ())
                     return cursor.fetchall()
         except Exception as e:
@@ -130,13 +656,8 @@ class PostgresConnection:
     def fetch_one(self, query: str, params: tuple = None) -> Optional[Dict[str, Any]]:
         """Fetch one result from SELECT query"""
         try:
-            self.ensure_connection()
-            if PSYCOPG_VERSION == 3:
-                with self.connection.cursor() as cursor:
-                    cursor.execute(query, params or ())
-                    return cursor.fetchone()
-            else:
-                with self.connection.cursor(cursor_factory=RealDictCursor) as cursor:
+            with self._borrow() as connection:
+                with self._dict_cursor(connection) as cursor, self._timed(query, params):
                     cursor.execute(query, params or ())
                     return cursor.fetchone()
         except Exception as e:
@@ -146,10 +667,12 @@ class PostgresConnection:
     def execute_batch(self, query: str, data: List[tuple]) -> bool:
         """Execute batch INSERT/UPDATE/DELETE"""
         try:
-            with self.connection.cursor() as cursor:
-                for params in data:
-                    cursor.execute(query, params)
-                return True
+            with self._borrow() as connection:
+                with connection.cursor() as cursor:
+                    for params in data:
+                        with self._timed(query, params):
+                            cursor.execute(query, params)
+                    return True
         except Exception as e:
             print(f"❌ Batch execution error: {e}")
             return False
@@ -171,10 +694,11 @@ class PostgresConnection:
             with open(file_path, 'r', encoding='utf-8') as f:
                 sql_script = f.read()
             
-            with self.connection.cursor() as cursor:
-                cursor.execute(sql_script)
-                print(f"✅ SQL script executed: {file_path}")
-                return True
+            with self._borrow() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(sql_script)
+                    print(f"✅ SQL script executed: {file_path}")
+                    return True
         except Exception as e:
             print(f"❌ Error executing SQL script: {e}")
             return False
@@ -324,12 +848,209 @@ class PostgresDatabase:
     def get_products(self, source_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get products, optionally filtered by source"""
         if source_id:
-            query = "SELECT * FROM products WHERE source_id = %s ORDER BY created_at DESC"
+            query = "SELECT * FROM products WHERE source_id = %s ORDER BY added_at DESC"
             return self.conn.fetch_all(query, (source_id,))
         else:
-            query = "SELECT * FROM products ORDER BY created_at DESC"
+            query = "SELECT * FROM products ORDER BY added_at DESC"
             return self.conn.fetch_all(query)
     
+    def sync_products(
+        self,
+        source_id: str,
+        products: List[Dict[str, Any]],
+        hide_missing: bool = True
+    ) -> Optional[Dict[str, int]]:
+        """Incrementally sync a source's products in one transaction.
+
+        Each parsed product is hashed; only new or changed rows (and hidden
+        ones that came back) are upserted, in a single set-based statement.
+        Products missing from the parse are hidden, not deleted. Readers
+        never see a half-synced source.
+
+        With ``hide_missing=False`` only the upsert runs, so a source can be
+        written page by page and finished with ``mark_missing_products``.
+
+        Returns counts ``{'inserted', 'updated', 'unchanged', 'hidden'}``,
+        or None if the transaction was rolled back.
+        """
+        rows_by_id: Dict[str, Dict[str, Any]] = {}
+        for product in products:
+            if product.get('id'):
+                row = _product_sync_row(source_id, product)
+                rows_by_id[row['id']] = row
+
+        stats = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'hidden': 0}
+        with self.conn.transaction() as tx:
+            # Serialize concurrent syncs of the same source
+            self.conn.fetch_one("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"products_sync:{source_id}",))
+            existing = {
+                row['id']: row for row in self.conn.fetch_all(
+                    "SELECT id, content_hash, COALESCE(hidden, false) AS hidden FROM products WHERE source_id = %s",
+                    (source_id,)
+                )
+            }
+
+            changed = []
+            for product_id, row in rows_by_id.items():
+                current = existing.get(product_id)
+                if current is None:
+                    stats['inserted'] += 1
+                elif current['content_hash'] != row['content_hash'] or current['hidden']:
+                    stats['updated'] += 1
+                else:
+                    stats['unchanged'] += 1
+                    continue
+                changed.append(row)
+
+            if changed:
+                self.conn.execute_query("""
+                    INSERT INTO products
+                    (id, source_id, name, description, price, currency, url, image_url,
+                     metadata, dates, content_hash, hidden, hidden_at, added_at, updated_at)
+                    SELECT t.id, %s, t.name, t.description, t.price, t.currency, t.url, t.image_url,
+                           COALESCE(t.metadata, '{}'::jsonb),
+                           COALESCE(CASE WHEN t.has_dates THEN t.dates END, p.dates, '[]'::jsonb),
+                           t.content_hash, false, NULL, NOW(), NOW()
+                    FROM jsonb_to_recordset(%s::jsonb) AS t(
+                        id text, name text, description text, price numeric, currency text, url text,
+                        image_url text, metadata jsonb, has_dates boolean, dates jsonb, content_hash text
+                    )
+                    LEFT JOIN products p ON p.id = t.id
+                    ON CONFLICT (id) DO UPDATE SET
+                        source_id = EXCLUDED.source_id,
+                        name = EXCLUDED.name,
+                        description = EXCLUDED.description,
+                        price = EXCLUDED.price,
+                        currency = EXCLUDED.currency,
+                        url = EXCLUDED.url,
+                        image_url = EXCLUDED.image_url,
+                        metadata = EXCLUDED.metadata,
+                        dates = EXCLUDED.dates,
+                        content_hash = EXCLUDED.content_hash,
+                        hidden = false,
+                        hidden_at = NULL,
+                        updated_at = NOW()
+                """, (source_id, Json(changed)))
+
+            if hide_missing:
+                hidden = self.conn.fetch_all("""
+                    UPDATE products
+                    SET hidden = true, hidden_at = NOW(), updated_at = NOW()
+                    WHERE source_id = %s AND COALESCE(hidden, false) = false AND NOT (id = ANY(%s))
+                    RETURNING id
+                """, (source_id, list(rows_by_id.keys())))
+                stats['hidden'] = len(hidden)
+
+        if not tx.committed:
+            print(f"❌ Product sync for source {source_id} rolled back")
+            return None
+        return stats
+
+    def mark_missing_products(self, source_id: str, current_product_ids: List[str]) -> int:
+        """Hide products missing from the source and unhide present ones (two set-based updates)"""
+        ids = list(current_product_ids)
+        with self.conn.transaction():
+            self.conn.execute_query("""
+                UPDATE products SET hidden = false, hidden_at = NULL, updated_at = NOW()
+                WHERE source_id = %s AND hidden = true AND id = ANY(%s)
+            """, (source_id, ids))
+            hidden = self.conn.fetch_all("""
+                UPDATE products SET hidden = true, hidden_at = NOW(), updated_at = NOW()
+                WHERE source_id = %s AND COALESCE(hidden, false) = false AND NOT (id = ANY(%s))
+                RETURNING id
+            """, (source_id, ids))
+        return len(hidden)
+
+    def get_product_ids(self) -> List[str]:
+        """All product ids, newest first (same order as get_products)"""
+        return [row['id'] for row in self.conn.fetch_all("SELECT id FROM products ORDER BY added_at DESC")]
+
+    def update_products_dates_batch(self, dates_by_product: Dict[str, List[Dict[str, Any]]]) -> Optional[int]:
+        """Write parsed tour dates for many products in one statement.
+
+        Returns the number of updated rows, or None if the write failed.
+        """
+        if not dates_by_product:
+            return 0
+        rows = [{'id': product_id, 'dates': dates} for product_id, dates in dates_by_product.items()]
+        with self.conn.transaction() as tx:
+            updated = self.conn.fetch_all("""
+                UPDATE products p
+                SET dates = t.dates, dates_updated_at = NOW(), updated_at = NOW()
+                FROM jsonb_to_recordset(%s::jsonb) AS t(id text, dates jsonb)
+                WHERE p.id = t.id
+                RETURNING p.id
+            """, (Json(rows),))
+        if not tx.committed:
+            print(f"❌ Batch dates update for {len(rows)} products rolled back")
+            return None
+        return len(updated)
+
+    def iter_products(
+        self,
+        source_id: Optional[str] = None,
+        product_ids: Optional[List[str]] = None,
+        include_hidden: bool = False,
+        batch_size: int = 500
+    ) -> Iterator[Dict[str, Any]]:
+        """Yield products in id order, fetching them in keyset-paginated batches.
+
+        Each batch is a separate short query, so a slow consumer (a streamed
+        feed download) never holds a connection between batches.
+        """
+        conditions = []
+        params: List[Any] = []
+        if source_id is not None:
+            conditions.append("source_id = %s")
+            params.append(source_id)
+        if product_ids is not None:
+            conditions.append("id = ANY(%s)")
+            params.append(list(product_ids))
+        if not include_hidden:
+            conditions.append("COALESCE(hidden, false) = false")
+
+        last_id = None
+        while True:
+            page_conditions = list(conditions)
+            page_params = list(params)
+            if last_id is not None:
+                page_conditions.append("id > %s")
+                page_params.append(last_id)
+            where = f"WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+            page_params.append(batch_size)
+            rows = self.conn.fetch_all(f"SELECT * FROM products {where} ORDER BY id LIMIT %s", tuple(page_params))
+            yield from rows
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1]['id']
+
+    def get_products_version(
+        self,
+        source_ids: Optional[List[str]] = None,
+        product_ids: Optional[List[str]] = None
+    ) -> Dict[str, Any]:
+        """Fingerprint of a product scope: changes whenever any product in it changes.
+
+        Returns ``{'visible_count', 'digest'}``; used to key cached feeds.
+        """
+        if product_ids is not None:
+            where, param = "id = ANY(%s)", list(product_ids)
+        else:
+            where, param = "source_id = ANY(%s)", list(source_ids or [])
+        query = f"""
+            SELECT
+                COUNT(*) FILTER (WHERE NOT COALESCE(hidden, false)) AS visible_count,
+                md5(COALESCE(string_agg(
+                    id || ':' || COALESCE(updated_at::text, '') || ':' ||
+                    COALESCE(dates_updated_at::text, '') || ':' || COALESCE(hidden, false)::text,
+                    ',' ORDER BY id
+                ), '')) AS digest
+            FROM products
+            WHERE {where}
+        """
+        result = self.conn.fetch_one(query, (param,))
+        return dict(result) if result else {'visible_count': 0, 'digest': None}
+    
     def get_product(self, product_id: str) -> Optional[Dict[str, Any]]:
         """Get single product"""
         query = "SELECT * FROM products WHERE id = %s"
@@ -549,20 +1270,8 @@ class PostgresDatabase:
         return departments
     
     # ==================== CHATS ====================
-    def _ensure_chats_columns(self):
-        """Ensure optional chats columns exist for newer messaging features."""
-        try:
-            self.conn.execute_query("ALTER TABLE chats ADD COLUMN IF NOT EXISTS pinned_by_user JSONB DEFAULT '{}'::jsonb")
-            self.conn.execute_query("ALTER TABLE chats ADD COLUMN IF NOT EXISTS pinned_order_by_user JSONB DEFAULT '{}'::jsonb")
-            self.conn.execute_query("ALTER TABLE chats ADD COLUMN IF NOT EXISTS archived_by_user JSONB DEFAULT '{}'::jsonb")
-            self.conn.execute_query("ALTER TABLE chats ADD COLUMN IF NOT EXISTS discussion_status VARCHAR(50)")
-            self.conn.execute_query("ALTER TABLE chats ADD COLUMN IF NOT EXISTS avatar TEXT")
-        except Exception as e:
-            print(f"Error ensuring chats columns: {e}")
-
     def get_chats(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get chats, optionally filtered by user"""
-        self._ensure_chats_columns()
         if user_id:
             query = """
                 SELECT DISTINCT c.*, 
@@ -592,7 +1301,64 @@ class PostgresDatabase:
             if chat.get('participant_ids') is None:
                 chat['participant_ids'] = []
         
-        return chats
+        return self._attach_read_state(chats)
+    
+    def get_chat_summaries(self, user_id: str) -> List[Dict[str, Any]]:
+        """Get user's chats with last message, unread count and linked task status.
+
+        Everything is computed in one statement: the last message and the
+        read marker come from index lookups on messages(chat_id, created_at, id),
+        and only messages newer than the user's marker are counted, so the
+        cost follows the number of chats rather than the message history.
+        The read marker comes from chat_read_state: (last_read_at,
+        last_read_message_id) compared against messages(created_at, id).
+        """
+        query = """
+            WITH user_chats AS (
+                SELECT c.*,
+                    (COALESCE(c.is_favorites_chat, false) OR LEFT(c.id, 10) = 'favorites_') AS is_favorites,
+                    (COALESCE(c.is_notifications_chat, false) OR COALESCE(c.is_system_chat, false)) AS counts_own_messages
+                FROM chats c
+                WHERE c.id IN (SELECT chat_id FROM chat_participants WHERE user_id = %s)
+            )
+            SELECT uc.*,
+                (SELECT ARRAY_AGG(DISTINCT cp.user_id) FROM chat_participants cp WHERE cp.chat_id = uc.id) AS participant_ids,
+                CASE WHEN lm.id IS NULL THEN NULL ELSE to_jsonb(lm) END AS last_message,
+                t.id IS NOT NULL AS task_found,
+                t.status AS task_status,
+                t.is_completed AS task_is_completed,
+                t.archived AS task_archived,
+                CASE
+                    WHEN lm.id IS NULL OR uc.is_favorites THEN 0
+                    WHEN (rs.last_read_at, COALESCE(rs.last_read_message_id, lm.id)) >= (lm.created_at, lm.id) THEN 0
+                    ELSE (
+                        SELECT COUNT(*) FROM messages um
+                        WHERE um.chat_id = uc.id AND um.is_deleted = false
+                          AND (uc.counts_own_messages OR COALESCE(um.author_id, '') <> %s)
+                          AND (
+                              rs.last_read_at IS NULL
+                              OR (rs.last_read_message_id IS NOT NULL
+                                  AND (um.created_at, um.id) > (rs.last_read_at, rs.last_read_message_id))
+                              OR (rs.last_read_message_id IS NULL AND um.created_at > rs.last_read_at)
+                          )
+                    )
+                END AS user_unread_count
+            FROM user_chats uc
+            LEFT JOIN LATERAL (
+                SELECT m.* FROM messages m
+                WHERE m.chat_id = uc.id AND m.is_deleted = false
+                ORDER BY m.created_at DESC, m.id DESC
+                LIMIT 1
+            ) lm ON true
+            LEFT JOIN chat_read_state rs ON rs.chat_id = uc.id AND rs.user_id = %s
+            LEFT JOIN tasks t ON t.id = uc.todo_id
+            ORDER BY lm.created_at DESC NULLS LAST, uc.updated_at DESC
+        """
+        chats = self.conn.fetch_all(query, (user_id, user_id, user_id))
+        for chat in chats:
+            if chat.get('participant_ids') is None:
+                chat['participant_ids'] = []
+        return self._attach_read_state(chats)
     
     def get_user_chats(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all chats for a specific user (alias for get_chats)"""
@@ -600,7 +1366,6 @@ class PostgresDatabase:
     
     def get_chat(self, chat_id: str) -> Optional[Dict[str, Any]]:
         """Get single chat"""
-        self._ensure_chats_columns()
         query = """
             SELECT c.*, 
                 ARRAY_AGG(DISTINCT cp.user_id) AS participant_ids
@@ -614,12 +1379,11 @@ class PostgresDatabase:
             chat = dict(result)
             if chat.get('participant_ids') is None:
                 chat['participant_ids'] = []
-            return chat
+            return self._attach_read_state([chat])[0]
         return None
     
     def update_chat(self, chat_id: str, update_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Update chat"""
-        self._ensure_chats_columns()
         set_clauses = []
         params = []
         
@@ -636,8 +1400,6 @@ class PostgresDatabase:
             'isSystemChat': 'is_system_chat',
             'is_favorites_chat': 'is_favorites_chat',
             'isFavoritesChat': 'is_favorites_chat',
-            'read_messages_by_user': 'read_messages_by_user',
-            'readMessagesByUser': 'read_messages_by_user',
             'pinned_by_user': 'pinned_by_user',
             'pinnedByUser': 'pinned_by_user',
             'pinned_order_by_user': 'pinned_order_by_user',
@@ -650,9 +1412,18 @@ class PostgresDatabase:
             'updatedAt': 'updated_at'
         }
         
+        update_data = dict(update_data)
+        # Маркеры прочтения живут в chat_read_state: каждый только продвигается вперед
+        read_map = update_data.pop('read_messages_by_user', None) or update_data.pop('readMessagesByUser', None)
+        update_data.pop('readMessagesByUser', None)
+        if isinstance(read_map, dict):
+            for reader_id, marker in read_map.items():
+                read_at = self._parse_marker_time(marker)
+                self.mark_chat_read(chat_id, reader_id, message_id=None if read_at else (str(marker) if marker else None), read_at=read_at)
+
         for key, value in update_data.items():
             db_field = field_mapping.get(key, key)
-            if db_field in ['read_messages_by_user', 'pinned_by_user', 'pinned_order_by_user', 'archived_by_user']:
+            if db_field in ['pinned_by_user', 'pinned_order_by_user', 'archived_by_user']:
                 set_clauses.append(f"{db_field} = %s")
                 params.append(Json(value))
             else:
@@ -671,7 +1442,7 @@ class PostgresDatabase:
         """
         
         result = self.conn.fetch_one(query, tuple(params))
-        return dict(result) if result else None
+        return self._attach_read_state([dict(result)])[0] if result else None
     
     def find_private_chat(self, user_id1: str, user_id2: str) -> Optional[Dict[str, Any]]:
         """Find existing private chat between two users"""
@@ -691,12 +1462,11 @@ class PostgresDatabase:
             chat = dict(result)
             if chat.get('participant_ids') is None:
                 chat['participant_ids'] = []
-            return chat
+            return self._attach_read_state([chat])[0]
         return None
     
     def add_chat(self, chat: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Add new chat"""
-        self._ensure_chats_columns()
         query = """
             INSERT INTO chats 
             (id, title, is_group, todo_id, is_notifications_chat, is_system_chat, is_favorites_chat, 
@@ -736,7 +1506,6 @@ class PostgresDatabase:
     
     def find_chat_by_todo(self, todo_id: str) -> Optional[Dict[str, Any]]:
         """Find chat associated with a task"""
-        self._ensure_chats_columns()
         query = """
             SELECT c.*, 
                 ARRAY_AGG(DISTINCT cp.user_id) FILTER (WHERE cp.user_id IS NOT NULL) AS participant_ids
@@ -751,7 +1520,7 @@ class PostgresDatabase:
             chat = dict(result)
             if chat.get('participant_ids') is None:
                 chat['participant_ids'] = []
-            return chat
+            return self._attach_read_state([chat])[0]
         return None
     
     def delete_chat(self, chat_id: str) -> bool:
@@ -765,6 +1534,80 @@ class PostgresDatabase:
         query = "INSERT INTO chat_participants (chat_id, user_id) VALUES (%s, %s)"
         self.conn.execute_query(query, (chat_id, user_id))
     
+    # ==================== CHAT READ STATE ====================
+    def mark_chat_read(self, chat_id: str, user_id: str, message_id: Optional[str] = None,
+                       read_at: Optional[datetime] = None) -> Optional[str]:
+        """
+        Move the user's read marker forward, never back.
+
+        The marker is (last_read_at, last_read_message_id): the created_at and id
+        of the read message, or just a time when no message id is known
+        (read_at, default now). Returns the current marker as exposed in
+        read_messages_by_user.
+        """
+        if read_at is not None and read_at.tzinfo is not None:
+            read_at = read_at.astimezone(timezone.utc).replace(tzinfo=None)
+        query = """
+            INSERT INTO chat_read_state (chat_id, user_id, last_read_message_id, last_read_at, updated_at)
+            SELECT %s, %s, m.id, COALESCE(m.created_at, %s, NOW() AT TIME ZONE 'UTC'), NOW()
+            FROM (SELECT 1) AS one
+            LEFT JOIN messages m ON m.id = %s AND m.chat_id = %s
+            ON CONFLICT (chat_id, user_id) DO UPDATE
+            SET last_read_message_id = EXCLUDED.last_read_message_id,
+                last_read_at = EXCLUDED.last_read_at,
+                updated_at = NOW()
+            WHERE (EXCLUDED.last_read_at, COALESCE(EXCLUDED.last_read_message_id, ''))
+                > (chat_read_state.last_read_at, COALESCE(chat_read_state.last_read_message_id, ''))
+        """
+        if not self.conn.execute_query(query, (chat_id, str(user_id), read_at, message_id, chat_id)):
+            return None
+        row = self.conn.fetch_one(
+            "SELECT last_read_message_id, last_read_at FROM chat_read_state WHERE chat_id = %s AND user_id = %s",
+            (chat_id, str(user_id))
+        )
+        return self._read_marker(row) if row else None
+
+    @staticmethod
+    def _read_marker(row: Dict[str, Any]) -> str:
+        """Marker in the read_messages_by_user format: message id or UTC ISO time"""
+        if row.get('last_read_message_id'):
+            return str(row['last_read_message_id'])
+        read_at = row['last_read_at']
+        if read_at.tzinfo is None:
+            read_at = read_at.replace(tzinfo=timezone.utc)
+        return read_at.isoformat()
+
+    @staticmethod
+    def _parse_marker_time(marker: Any) -> Optional[datetime]:
+        """ISO time from a legacy read marker; None when the marker is a message id"""
+        marker = str(marker or '')
+        if not (marker[:4].isdigit() and marker[4:5] == '-'):
+            return None
+        try:
+            return datetime.fromisoformat(marker.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+
+    def get_read_markers(self, chat_ids: List[str]) -> Dict[str, Dict[str, str]]:
+        """{chat_id: {user_id: marker}} for the given chats"""
+        if not chat_ids:
+            return {}
+        rows = self.conn.fetch_all(
+            "SELECT chat_id, user_id, last_read_message_id, last_read_at FROM chat_read_state WHERE chat_id = ANY(%s)",
+            (list(chat_ids),)
+        )
+        markers: Dict[str, Dict[str, str]] = {}
+        for row in rows:
+            markers.setdefault(row['chat_id'], {})[str(row['user_id'])] = self._read_marker(row)
+        return markers
+
+    def _attach_read_state(self, chats: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Fill read_messages_by_user of chat rows from chat_read_state"""
+        markers = self.get_read_markers([chat['id'] for chat in chats])
+        for chat in chats:
+            chat['read_messages_by_user'] = markers.get(chat['id'], {})
+        return chats
+
     # ==================== MESSAGES ====================
     def get_messages(self, chat_id: str) -> List[Dict[str, Any]]:
         """Get messages from chat"""
@@ -779,6 +1622,52 @@ class PostgresDatabase:
         """Get messages from chat (alias for get_messages)"""
         return self.get_messages(chat_id)
     
+    def get_messages_page(self, chat_id: str, limit: int = 50,
+                          before_id: Optional[str] = None,
+                          after_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Keyset page of chat messages over (created_at, id).
+
+        Without cursors returns the newest ``limit`` messages. ``before_id``
+        pages towards older messages, ``after_id`` towards newer ones. Messages
+        are always returned in ascending order; ``has_more`` tells whether
+        another page exists in the requested direction.
+
+        Returns None if the cursor message does not exist in this chat, so the
+        caller can tell a bad cursor from the end of the history.
+        """
+        cursor_id = after_id or before_id
+        if after_id:
+            comparison, order = '>', 'ASC'
+        else:
+            comparison, order = '<', 'DESC'
+        
+        params: List[Any] = [chat_id]
+        cursor_clause = ''
+        if cursor_id:
+            cursor = self.conn.fetch_one(
+                "SELECT created_at, id FROM messages WHERE id = %s AND chat_id = %s",
+                (cursor_id, chat_id)
+            )
+            if cursor is None:
+                return None
+            cursor_clause = f"AND (m.created_at, m.id) {comparison} (%s, %s)"
+            params.extend([cursor['created_at'], cursor['id']])
+        params.append(limit + 1)
+        
+        query = f"""
+            SELECT m.* FROM messages m
+            WHERE m.chat_id = %s AND m.is_deleted = false
+            {cursor_clause}
+            ORDER BY m.created_at {order}, m.id {order}
+            LIMIT %s
+        """
+        rows = self.conn.fetch_all(query, tuple(params))
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if order == 'DESC':
+            rows.reverse()
+        return {'messages': rows, 'has_more': has_more}
+    
     def add_message(self, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Add new message"""
         query = """
@@ -812,6 +1701,122 @@ class PostgresDatabase:
         result = self.conn.fetch_one(query, params)
         return dict(result) if result else None
     
+    def add_notification_messages(self, user_refs: List[str], message: Dict[str, Any],
+                                  from_user_ref: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Fan out one system message to the notification chats of many users.
+
+        One query resolves every recipient (id, username or email), the sender
+        and the existing notification chats; one transaction creates missing
+        chats and inserts all messages with a multi-row INSERT.
+
+        Args:
+            user_refs: Recipients in request order (duplicates get separate messages)
+            message: Common fields: content, notification_type, linked_task_id,
+                linked_post_id, metadata
+            from_user_ref: Sender; unresolved - each recipient is the author
+
+        Returns:
+            [{'userRef', 'userId', 'chatId', 'messageId'} or {'userRef', 'error'}] in request order
+        """
+        if not user_refs:
+            return []
+        refs = [str(ref) for ref in user_refs]
+        rows = self.conn.fetch_all("""
+            SELECT r.ref, r.ord, u.id AS user_id, nc.chat_id, sender.id AS sender_id
+            FROM unnest(%s::text[]) WITH ORDINALITY AS r(ref, ord)
+            LEFT JOIN LATERAL (
+                SELECT id FROM users
+                WHERE id = r.ref OR username = r.ref OR email = r.ref
+                ORDER BY (id = r.ref) DESC
+                LIMIT 1
+            ) u ON true
+            LEFT JOIN LATERAL (
+                SELECT c.id AS chat_id FROM chats c
+                JOIN chat_participants cp ON cp.chat_id = c.id AND cp.user_id = u.id
+                WHERE c.is_notifications_chat = true
+                LIMIT 1
+            ) nc ON true
+            LEFT JOIN LATERAL (
+                SELECT id FROM users
+                WHERE %s::text IS NOT NULL AND (id = %s OR username = %s OR email = %s)
+                ORDER BY (id = %s) DESC
+                LIMIT 1
+            ) sender ON true
+            ORDER BY r.ord
+        """, (refs, from_user_ref, from_user_ref, from_user_ref, from_user_ref, from_user_ref))
+        if len(rows) != len(refs):
+            return [{'userRef': ref, 'error': 'Recipient lookup failed'} for ref in refs]
+
+        results: List[Dict[str, Any]] = []
+        new_chats: Dict[str, str] = {}
+        messages = []
+        for row in rows:
+            user_id = row.get('user_id')
+            if not user_id:
+                results.append({'userRef': row['ref'], 'error': 'User not found'})
+                continue
+            chat_id = row.get('chat_id')
+            if not chat_id:
+                chat_id = f"notifications-{user_id}"
+                new_chats[chat_id] = user_id
+            message_id = str(uuid.uuid4())
+            messages.append({
+                'id': message_id,
+                'chat_id': chat_id,
+                'author_id': row.get('sender_id') or user_id,
+            })
+            results.append({'userRef': row['ref'], 'userId': user_id, 'chatId': chat_id, 'messageId': message_id})
+
+        if not messages:
+            return results
+
+        with self.conn.transaction() as tx:
+            if new_chats:
+                chat_rows = [
+                    {'id': chat_id, 'user_id': user_id, 'pinned': {user_id: True}}
+                    for chat_id, user_id in new_chats.items()
+                ]
+                self.conn.execute_query("""
+                    INSERT INTO chats (id, title, is_group, is_notifications_chat, is_system_chat,
+                                       creator_id, read_messages_by_user, pinned_by_user)
+                    SELECT r.id, 'Уведомления', false, true, true, r.user_id, '{}'::jsonb, r.pinned
+                    FROM jsonb_to_recordset(%s::jsonb) AS r(id text, user_id text, pinned jsonb)
+                    ON CONFLICT (id) DO NOTHING
+                """, (Json(chat_rows),))
+                self.conn.execute_query("""
+                    INSERT INTO chat_participants (chat_id, user_id)
+                    SELECT r.id, r.user_id
+                    FROM jsonb_to_recordset(%s::jsonb) AS r(id text, user_id text)
+                    ON CONFLICT (chat_id, user_id) DO NOTHING
+                """, (Json(chat_rows),))
+            inserted = self.conn.fetch_all("""
+                INSERT INTO messages
+                (id, chat_id, author_id, author_name, content, mentions, is_edited, is_deleted,
+                 is_system_message, notification_type, linked_task_id, linked_post_id, attachments, metadata)
+                SELECT r.id, r.chat_id, r.author_id, %s, %s, '[]'::jsonb, false, false,
+                       true, %s, %s, %s, '[]'::jsonb, %s
+                FROM jsonb_to_recordset(%s::jsonb) AS r(id text, chat_id text, author_id text)
+                RETURNING id
+            """, (
+                message.get('author_name', 'Система'),
+                message.get('content'),
+                message.get('notification_type'),
+                message.get('linked_task_id'),
+                message.get('linked_post_id'),
+                Json(message.get('metadata', {})),
+                Json(messages),
+            ))
+            if len(inserted) != len(messages):
+                tx.failed = True
+
+        if not tx.committed:
+            return [
+                result if 'error' in result else {'userRef': result['userRef'], 'error': 'Failed to save notification'}
+                for result in results
+            ]
+        return results
+    
     def update_message(self, message_id: str, content: str) -> bool:
         """Update message content"""
         query = """
@@ -984,12 +1989,93 @@ class PostgresDatabase:
 
     def get_events(self, entity: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get all events, optionally filtered by entity type"""
-        query = "SELECT * FROM events ORDER BY created_at DESC"
-        rows = self.conn.fetch_all(query)
-        hydrated = [self._hydrate_event_row(row) for row in rows]
         if entity:
-            return [event for event in hydrated if event.get('entity') == entity]
-        return hydrated
+            query = "SELECT * FROM events WHERE COALESCE(metadata->>'entity', 'event') = %s ORDER BY created_at DESC"
+            rows = self.conn.fetch_all(query, (entity,))
+        else:
+            query = "SELECT * FROM events ORDER BY created_at DESC"
+            rows = self.conn.fetch_all(query)
+        return [self._hydrate_event_row(row) for row in rows]
+
+    def query_events(
+        self,
+        entity: str = 'event',
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+        event_type: Optional[str] = None,
+        tag: Optional[str] = None,
+        visible_to: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: int = 0
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Range query for events with all filters applied in SQL.
+
+        - date_from/date_to: events overlapping the window (start or end on/after
+          date_from, start on/before date_to)
+        - visible_to: user id; users with can_see_all_tasks or admin role see
+          everything, others see their own events, events they participate in
+          and events without participants
+        Ordered by start date, newest first. Returns (events, total before paging).
+        """
+        conditions = ["COALESCE(e.metadata->>'entity', 'event') = %s"]
+        params: List[Any] = [entity]
+
+        if date_from:
+            conditions.append("(e.start_date >= %s OR e.end_date >= %s)")
+            params.extend([date_from, date_from])
+        if date_to:
+            conditions.append("e.start_date < %s")
+            params.append(date_to + timedelta(days=1))
+        if event_type:
+            conditions.append("COALESCE(NULLIF(e.metadata->>'type', ''), e.metadata->>'eventType') = %s")
+            params.append(event_type)
+        if tag:
+            conditions.append("e.metadata->'tags' @> %s")
+            params.append(Json([tag]))
+        if visible_to:
+            conditions.append("""(
+                EXISTS (
+                    SELECT 1 FROM users u
+                    WHERE (u.id = %s OR u.username = %s OR u.email = %s)
+                      AND (u.can_see_all_tasks OR u.role = 'admin')
+                )
+                OR COALESCE(NULLIF(e.metadata->>'createdBy', ''), NULLIF(e.metadata->>'created_by', ''), e.user_id) = %s
+                OR e.metadata->'participants' @> jsonb_build_array(%s::text)
+                OR jsonb_typeof(e.metadata->'participants') IS DISTINCT FROM 'array'
+                OR e.metadata->'participants' = '[]'::jsonb
+            )""")
+            params.extend([visible_to] * 5)
+
+        query = f"""
+            SELECT e.*, COUNT(*) OVER () AS total_count
+            FROM events e
+            WHERE {' AND '.join(conditions)}
+            ORDER BY e.start_date DESC NULLS LAST, e.created_at DESC
+        """
+        if limit is not None:
+            query += " LIMIT %s OFFSET %s"
+            params.extend([limit, offset])
+        elif offset:
+            query += " OFFSET %s"
+            params.append(offset)
+
+        rows = self.conn.fetch_all(query, tuple(params))
+        total = int(rows[0]['total_count']) if rows else 0
+        if not rows and offset:
+            # Страница за пределами выборки - общее число считаем отдельно
+            count_row = self.conn.fetch_one(
+                f"SELECT COUNT(*) AS total FROM events e WHERE {' AND '.join(conditions)}",
+                tuple(params[:len(params) - (2 if limit is not None else 1)])
+            )
+            total = int(count_row['total']) if count_row else 0
+
+        events = []
+        for row in rows:
+            row = dict(row)
+            row.pop('total_count', None)
+            events.append(self._hydrate_event_row(row))
+        return events, total
 
     def get_event(self, event_id: str, entity: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """Get single event by id"""
@@ -1083,63 +2169,56 @@ class PostgresDatabase:
         return self.conn.execute_query(query, (event_id,))
     
     # ==================== TASKS (TODOS) ====================
+    def _get_task_viewer(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Access flags of a user plus ids/names of their department members, in one query.
+
+        Visibility predicates below take these as array parameters (= ANY / ?|),
+        so a department of any size is a single indexed query.
+        """
+        query = """
+            SELECT u.id, u.name, u.department, u.role, u.can_see_all_tasks, u.is_department_head,
+                   ARRAY(SELECT d.id FROM users d WHERE d.department = u.department) AS dept_ids,
+                   ARRAY(
+                       SELECT d.name FROM users d
+                       WHERE d.department = u.department AND COALESCE(d.name, '') <> ''
+                   ) AS dept_names
+            FROM users u
+            WHERE u.id = %s
+        """
+        result = self.conn.fetch_one(query, (user_id,))
+        return dict(result) if result else None
+
+    def _task_visibility(self, user_id: str) -> Tuple[str, tuple]:
+        """WHERE-условие видимости задач для пользователя и его параметры"""
+        viewer = self._get_task_viewer(user_id) or {}
+        dept_ids = list(viewer.get('dept_ids') or [])
+
+        if viewer.get('can_see_all_tasks') or viewer.get('role') == 'admin':
+            # Пользователь видит все задачи
+            return "TRUE", ()
+        if viewer.get('is_department_head') and viewer.get('department') and dept_ids:
+            # Руководитель отдела видит все задачи участников своего отдела
+            dept_names = list(viewer.get('dept_names') or [])
+            return """(
+                tasks.assigned_by_id = ANY(%s)
+                OR tasks.author_id = ANY(%s)
+                OR tasks.assigned_to = ANY(%s)
+                OR tasks.assigned_to_ids ?| %s
+            )""", (dept_ids, dept_ids, dept_names, dept_ids)
+        # Только связанные задачи (заказчик или исполнитель)
+        return """(
+            tasks.assigned_by_id = %s
+            OR tasks.assigned_to = %s
+            OR tasks.assigned_to_ids ? %s
+        )""", (user_id, user_id, user_id)
+
     def get_tasks(self, user_id: Optional[str] = None, list_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get all tasks, optionally filtered by user or list"""
         if user_id:
-            # Проверяем права пользователя
-            user_query = "SELECT can_see_all_tasks, is_department_head, department, role FROM users WHERE id = %s"
-            user_result = self.conn.fetch_one(user_query, (user_id,))
-            can_see_all = user_result and user_result.get('can_see_all_tasks', False)
-            is_admin = user_result and user_result.get('role') == 'admin'
-            is_dept_head = user_result and user_result.get('is_department_head', False)
-            user_dept = user_result.get('department') if user_result else None
-            
-            if can_see_all or is_admin:
-                # Пользователь видит все задачи
-                query = "SELECT * FROM tasks ORDER BY created_at DESC"
-                return self.conn.fetch_all(query)
-            elif is_dept_head and user_dept:
-                # Руководитель отдела видит все задачи участников своего отдела
-                dept_users_query = "SELECT id, name FROM users WHERE department = %s"
-                dept_users = self.conn.fetch_all(dept_users_query, (user_dept,))
-                dept_user_ids = [u['id'] for u in dept_users]
-                dept_user_names = [u['name'] for u in dept_users if u.get('name')]
-
-                if not dept_user_ids:
-                    query = "SELECT * FROM tasks WHERE assigned_by_id = %s OR author_id = %s ORDER BY created_at DESC"
-                    return self.conn.fetch_all(query, (user_id, user_id))
-
-                placeholders_ids = ','.join(['%s'] * len(dept_user_ids))
-                placeholders_names = ','.join(['%s'] * len(dept_user_names)) if dept_user_names else '%s'
-
-                assigned_to_ids_checks = []
-                assigned_to_ids_params = []
-                for uid in dept_user_ids:
-                    assigned_to_ids_checks.append("assigned_to_ids::jsonb @> %s::jsonb")
-                    assigned_to_ids_params.append(f'["{uid}"]')
-
-                query = f"""
-                    SELECT * FROM tasks
-                    WHERE assigned_by_id IN ({placeholders_ids})
-                    OR author_id IN ({placeholders_ids})
-                    OR assigned_to IN ({placeholders_names})
-                    OR ({' OR '.join(assigned_to_ids_checks)})
-                    ORDER BY created_at DESC
-                """
-
-                names_params = dept_user_names if dept_user_names else ['']
-                params = tuple(dept_user_ids + dept_user_ids + names_params + assigned_to_ids_params)
-                return self.conn.fetch_all(query, params)
-            else:
-                # Фильтруем только по связанным задачам (заказчик или исполнитель)
-                query = """
-                    SELECT * FROM tasks 
-                    WHERE assigned_by_id = %s 
-                    OR assigned_to = %s
-                    OR assigned_to_ids::jsonb @> %s::jsonb
-                    ORDER BY created_at DESC
-                """
-                return self.conn.fetch_all(query, (user_id, user_id, f'["{user_id}"]'))
+            clause, params = self._task_visibility(user_id)
+            query = f"SELECT * FROM tasks WHERE {clause} ORDER BY created_at DESC"
+            return self.conn.fetch_all(query, params)
         elif list_id:
             query = "SELECT * FROM tasks WHERE list_id = %s ORDER BY task_order, created_at DESC"
             return self.conn.fetch_all(query, (list_id,))
@@ -1276,106 +2355,68 @@ class PostgresDatabase:
         return self.conn.execute_query(query, (task_id,))
     
     # ==================== TODO LISTS ====================
+    def _todo_list_visibility(self, user_id: str) -> Optional[Tuple[str, tuple]]:
+        """WHERE-условие видимости списков (псевдоним l); None - пользователь не найден"""
+        viewer = self._get_task_viewer(user_id)
+        if not viewer:
+            print(f"[get_todo_lists] Пользователь {user_id} не найден!")
+            return None
+
+        # Админы и пользователи с can_see_all_tasks видят все списки
+        if viewer.get('role') == 'admin' or viewer.get('can_see_all_tasks'):
+            return "TRUE", ()
+
+        # Начальники отдела видят списки своих подчиненных:
+        # созданные сотрудниками отдела + списки с задачами, где участвуют сотрудники отдела
+        dept_ids = list(viewer.get('dept_ids') or [])
+        if viewer.get('is_department_head') and viewer.get('department') and dept_ids:
+            dept_names = list(viewer.get('dept_names') or [])
+            return """(
+                l.creator_id = ANY(%s)
+                OR l.id IN (
+                    SELECT list_id FROM tasks
+                    WHERE assigned_by_id = ANY(%s)
+                    OR assigned_to = ANY(%s)
+                    OR assigned_to_ids ?| %s
+                )
+            )""", (dept_ids, dept_ids, dept_names, dept_ids)
+
+        # Обычные пользователи видят списки где:
+        # 1. Они создатели (даже если список пустой)
+        # 2. Есть задачи где они участники
+        # 3. Список публичный (allowed_users и allowed_departments пустые или NULL)
+        # 4. Они в allowed_users (по id или имени)
+        # 5. Их отдел в allowed_departments
+        user_name = viewer.get('name')
+        user_dept = viewer.get('department')
+        identities = [user_id] + ([user_name] if user_name else [])
+        return """(
+            l.creator_id = %s
+            OR l.id IN (
+                SELECT list_id FROM tasks
+                WHERE assigned_by_id = %s
+                OR assigned_to = %s
+                OR assigned_to_ids ? %s
+            )
+            OR (
+                COALESCE(cardinality(l.allowed_users), 0) = 0
+                AND COALESCE(cardinality(l.allowed_departments), 0) = 0
+            )
+            OR l.allowed_users && %s::text[]
+            OR (%s::text IS NOT NULL AND %s::text = ANY(l.allowed_departments))
+        )""", (user_id, user_id, user_name, user_id, identities, user_dept, user_dept)
+
     def get_todo_lists(self, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get all todo lists, optionally filtered by user"""
-        print(f"[get_todo_lists] Запрос списков для user_id={user_id}")
-        
         if user_id:
-            # Получаем информацию о пользователе
-            user_query = "SELECT can_see_all_tasks, department, is_department_head, role, name FROM users WHERE id = %s"
-            user_result = self.conn.fetch_one(user_query, (user_id,))
-            
-            if not user_result:
-                print(f"[get_todo_lists] Пользователь {user_id} не найден!")
+            visibility = self._todo_list_visibility(user_id)
+            if visibility is None:
                 return []
-            
-            can_see_all = user_result.get('can_see_all_tasks', False)
-            is_admin = user_result.get('role') == 'admin'
-            is_dept_head = user_result.get('is_department_head', False)
-            user_dept = user_result.get('department')
-            user_name = user_result.get('name')
-            
-            print(f"[get_todo_lists] Пользователь: {user_name}, can_see_all={can_see_all}, is_admin={is_admin}, dept={user_dept}")
-            
-            # Админы и пользователи с can_see_all_tasks видят все списки
-            if is_admin or can_see_all:
-                print(f"[get_todo_lists] Пользователь - админ или имеет can_see_all_tasks, возвращаем все списки")
-                query = "SELECT * FROM todo_lists ORDER BY list_order, created_at"
-                result = self.conn.fetch_all(query)
-                print(f"[get_todo_lists] Найдено списков для админа: {len(result)}")
-                return result
-            
-            # Начальники отдела видят списки своих подчиненных
-            if is_dept_head and user_dept:
-                print(f"[get_todo_lists] Пользователь - начальник отдела {user_dept}")
-                # Получаем ID всех пользователей отдела
-                dept_users_query = "SELECT id FROM users WHERE department = %s"
-                dept_users = self.conn.fetch_all(dept_users_query, (user_dept,))
-                dept_user_ids = [u['id'] for u in dept_users]
-                print(f"[get_todo_lists] Сотрудников в отделе: {len(dept_user_ids)}")
-                
-                # Списки созданные сотрудниками отдела + списки с задачами где участвуют сотрудники отдела
-                if dept_user_ids:
-                    placeholders_creator = ','.join(['%s'] * len(dept_user_ids))
-                    placeholders_assigned_by = ','.join(['%s'] * len(dept_user_ids))
-                    placeholders_names = ','.join(['%s'] * len(dept_user_ids))
-                    
-                    # Для assigned_to_ids используем OR для каждого ID
-                    assigned_to_checks = []
-                    assigned_to_params = []
-                    for uid in dept_user_ids:
-                        assigned_to_checks.append("assigned_to_ids::jsonb @> %s::jsonb")
-                        assigned_to_params.append(f'["{uid}"]')
-                    
-                    query = f"""
-                        SELECT DISTINCT l.* FROM todo_lists l
-                        WHERE l.creator_id IN ({placeholders_creator})
-                        OR l.id IN (
-                            SELECT DISTINCT list_id FROM tasks 
-                            WHERE assigned_by_id IN ({placeholders_assigned_by})
-                            OR assigned_to IN (SELECT name FROM users WHERE id IN ({placeholders_names}))
-                            OR ({' OR '.join(assigned_to_checks)})
-                        )
-                        ORDER BY l.list_order, l.created_at
-                    """
-                    params = tuple(dept_user_ids + dept_user_ids + dept_user_ids + assigned_to_params)
-                    result = self.conn.fetch_all(query, tuple(params))
-                    print(f"[get_todo_lists] Найдено списков для начальника отдела: {len(result)}")
-                    return result
-            
-            print(f"[get_todo_lists] Обычный пользователь без специальных прав")
-            # Обычные пользователи видят списки где:
-            # 1. Они создатели (даже если список пустой)
-            # 2. Есть задачи где они участники
-            # 3. Список публичный (allowed_users и allowed_departments пустые или NULL)
-            # 4. Они в allowed_users
-            # 5. Их отдел в allowed_departments
-            query = """
-                SELECT DISTINCT l.* FROM todo_lists l
-                WHERE l.creator_id = %s
-                OR l.id IN (
-                    SELECT DISTINCT list_id FROM tasks 
-                    WHERE assigned_by_id = %s
-                    OR assigned_to = %s
-                    OR assigned_to_ids::jsonb @> %s::jsonb
-                )
-                OR (
-                    (l.allowed_users IS NULL OR l.allowed_users::text = '[]' OR l.allowed_users::text = 'null')
-                    AND (l.allowed_departments IS NULL OR l.allowed_departments::text = '[]' OR l.allowed_departments::text = 'null')
-                )
-                OR (l.allowed_users IS NOT NULL AND (l.allowed_users::jsonb @> %s::jsonb OR l.allowed_users::jsonb @> %s::jsonb))
-                OR (
-                    %s IS NOT NULL 
-                    AND l.allowed_departments IS NOT NULL 
-                    AND l.allowed_departments::jsonb @> %s::jsonb
-                )
-                ORDER BY l.list_order, l.created_at
-            """
-            dept_json = f'["{user_dept}"]' if user_dept else None
-            result = self.conn.fetch_all(query, (user_id, user_id, user_name, f'["{user_id}"]', f'["{user_id}"]', f'["{user_name}"]', user_dept, dept_json))
-            print(f"[get_todo_lists] Найдено списков для обычного пользователя: {len(result)}")
+            clause, params = visibility
+            query = f"SELECT l.* FROM todo_lists l WHERE {clause} ORDER BY l.list_order, l.created_at"
+            result = self.conn.fetch_all(query, params)
             if len(result) == 0:
-                print(f"[get_todo_lists] WARNING: Проверьте права доступа для пользователя {user_id} ({user_name})")
+                print(f"[get_todo_lists] WARNING: Проверьте права доступа для пользователя {user_id}")
             return result
         else:
             query = "SELECT * FROM todo_lists ORDER BY list_order, created_at"
@@ -1383,18 +2424,6 @@ class PostgresDatabase:
     
     def add_todo_list(self, list_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Add new todo list"""
-        # Сначала проверяем наличие обязательных колонок
-        try:
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS creator_id VARCHAR(255)")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_executor_id VARCHAR(255)")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_customer_id VARCHAR(255)")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_add_to_calendar BOOLEAN DEFAULT FALSE")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS stages_enabled BOOLEAN DEFAULT FALSE")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS allowed_users TEXT[] DEFAULT ARRAY[]::TEXT[]")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS allowed_departments TEXT[] DEFAULT ARRAY[]::TEXT[]")
-        except Exception as e:
-            print(f"Error checking/adding todo_lists columns: {e}")
-        
         query = """
             INSERT INTO todo_lists 
             (id, name, color, icon, department, list_order, creator_id, default_executor_id, default_customer_id, default_add_to_calendar, stages_enabled, allowed_users, allowed_departments)
@@ -1442,20 +2471,6 @@ class PostgresDatabase:
     
     def update_todo_list(self, list_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Update todo list"""
-        # На проде схема могла быть частично мигрирована.
-        # Гарантируем наличие колонок перед UPDATE, чтобы не получать ложный 404
-        # из-за SQL ошибки "column does not exist".
-        try:
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS creator_id VARCHAR(255)")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_executor_id VARCHAR(255)")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_customer_id VARCHAR(255)")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_add_to_calendar BOOLEAN DEFAULT FALSE")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS stages_enabled BOOLEAN DEFAULT FALSE")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS allowed_users TEXT[] DEFAULT ARRAY[]::TEXT[]")
-            self.conn.execute_query("ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS allowed_departments TEXT[] DEFAULT ARRAY[]::TEXT[]")
-        except Exception as e:
-            print(f"Error checking/adding todo_lists columns before update: {e}")
-
         set_clauses = []
         params = []
         
@@ -1562,6 +2577,75 @@ class PostgresDatabase:
         query = "DELETE FROM todo_categories WHERE id = %s"
         return self.conn.execute_query(query, (category_id,))
     
+    # ==================== TODO CHANGES ====================
+    def get_todo_version(self) -> int:
+        """Change cursor for get_todo_changes: xmin of the current snapshot.
+
+        Read it before the rows. Every transaction below it has finished, so a
+        change committed late (after a higher version) is still picked up by
+        the next delta instead of falling behind the cursor.
+        """
+        row = self.conn.fetch_one("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS cursor")
+        return int(row['cursor']) if row else 0
+
+    def get_todo_changes(self, since: int, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Tasks, lists and categories written by transactions at or after the
+        cursor `since` (from get_todo_version). Rows already seen may repeat.
+
+        Changed rows the user can no longer see are reported as deleted, so
+        a client replaying deltas ends up with the same set as a full load.
+
+        Returns:
+            {'tasks', 'lists', 'categories', 'deleted': {'tasks', 'lists', 'categories'}}
+        """
+        deleted: Dict[str, List[str]] = {'tasks': [], 'lists': [], 'categories': []}
+
+        task_clause, task_params = self._task_visibility(user_id) if user_id else ("TRUE", ())
+        rows = self.conn.fetch_all(f"""
+            SELECT tasks.*, ({task_clause}) AS is_visible
+            FROM tasks WHERE change_xid >= %s::text::xid8
+            ORDER BY created_at DESC
+        """, task_params + (since,))
+        tasks = []
+        for row in rows:
+            row = dict(row)
+            if row.pop('is_visible'):
+                tasks.append(row)
+            else:
+                deleted['tasks'].append(row['id'])
+
+        # Список может стать видимым из-за изменения задачи в нем
+        visibility = self._todo_list_visibility(user_id) if user_id else ("TRUE", ())
+        list_clause, list_params = visibility or ("FALSE", ())
+        rows = self.conn.fetch_all(f"""
+            SELECT l.*, ({list_clause}) AS is_visible
+            FROM todo_lists l
+            WHERE l.change_xid >= %s::text::xid8
+            OR l.id IN (SELECT list_id FROM tasks WHERE change_xid >= %s::text::xid8)
+            ORDER BY l.list_order, l.created_at
+        """, list_params + (since, since))
+        lists = []
+        for row in rows:
+            row = dict(row)
+            if row.pop('is_visible'):
+                lists.append(row)
+            else:
+                deleted['lists'].append(row['id'])
+
+        categories = self.conn.fetch_all(
+            "SELECT * FROM todo_categories WHERE change_xid >= %s::text::xid8 ORDER BY category_order, created_at",
+            (since,)
+        )
+
+        kinds = {'task': 'tasks', 'list': 'lists', 'category': 'categories'}
+        for row in self.conn.fetch_all(
+            "SELECT kind, id FROM todo_tombstones WHERE change_xid >= %s::text::xid8 ORDER BY version", (since,)
+        ):
+            deleted[kinds[row['kind']]].append(row['id'])
+
+        return {'tasks': tasks, 'lists': lists, 'categories': categories, 'deleted': deleted}
+    
     # ==================== LINKS ====================
     def get_links(self, user_id: Optional[str] = None, list_id: Optional[str] = None, department: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get all links, optionally filtered"""
@@ -1880,30 +2964,8 @@ class PostgresDatabase:
         return self.conn.execute_query(query, (plan_id,))
     
     # ==================== SHARED LINKS ====================
-    def _ensure_shared_links_table(self) -> None:
-        """Ensure shared_links table exists"""
-        table_query = """
-            CREATE TABLE IF NOT EXISTS shared_links (
-                id VARCHAR(255) PRIMARY KEY,
-                token VARCHAR(255) UNIQUE NOT NULL,
-                resource_type VARCHAR(50) NOT NULL,
-                resource_id VARCHAR(255),
-                permission VARCHAR(50) NOT NULL DEFAULT 'viewer',
-                created_by VARCHAR(255) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP,
-                is_active BOOLEAN DEFAULT true,
-                metadata JSONB DEFAULT '{}'
-            )
-        """
-        self.conn.execute_query(table_query)
-        self.conn.execute_query("CREATE INDEX IF NOT EXISTS idx_shared_links_token ON shared_links(token)")
-        self.conn.execute_query("CREATE INDEX IF NOT EXISTS idx_shared_links_resource ON shared_links(resource_type, resource_id)")
-        self.conn.execute_query("CREATE INDEX IF NOT EXISTS idx_shared_links_created_by ON shared_links(created_by)")
-
     def create_shared_link(self, link_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Create shared link for resource"""
-        self._ensure_shared_links_table()
         query = """
             INSERT INTO shared_links 
             (id, token, resource_type, resource_id, permission, created_by, expires_at, metadata)
@@ -1925,7 +2987,6 @@ class PostgresDatabase:
     
     def get_shared_link_by_token(self, token: str) -> Optional[Dict[str, Any]]:
         """Get shared link by token"""
-        self._ensure_shared_links_table()
         query = """
             SELECT * FROM shared_links 
             WHERE token = %s AND is_active = true
@@ -1936,7 +2997,6 @@ class PostgresDatabase:
     
     def get_shared_links_by_resource(self, resource_type: str, resource_id: str = None) -> List[Dict[str, Any]]:
         """Get all shared links for a resource"""
-        self._ensure_shared_links_table()
         if resource_id:
             query = "SELECT * FROM shared_links WHERE resource_type = %s AND resource_id = %s AND is_active = true ORDER BY created_at DESC"
             return self.conn.fetch_all(query, (resource_type, resource_id))
@@ -1946,7 +3006,6 @@ class PostgresDatabase:
     
     def update_shared_link(self, link_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Update shared link"""
-        self._ensure_shared_links_table()
         set_clauses = []
         params = []
         
@@ -1970,7 +3029,6 @@ class PostgresDatabase:
     
     def delete_shared_link(self, link_id: str) -> bool:
         """Delete shared link"""
-        self._ensure_shared_links_table()
         query = "DELETE FROM shared_links WHERE id = %s"
         return self.conn.execute_query(query, (link_id,))
 
@@ -2028,6 +3086,277 @@ class PostgresDatabase:
         query = "DELETE FROM direct_access WHERE id = %s"
         return self.conn.execute_query(query, (access_id,))
     
+    # ==================== ANALYTICS ====================
+    def upsert_analytics_rows(self, rows: List[Dict[str, Any]]) -> Optional[int]:
+        """Upsert daily UTM term statistics keyed by (date, utm_term) in one statement.
+
+        Rows that did not change are skipped. Returns the number of written
+        rows, or None if the write failed.
+        """
+        # ON CONFLICT can touch a row only once per statement: last row wins
+        unique = {(row['date'], row['utm_term']): row for row in rows}
+        if not unique:
+            return 0
+        with self.conn.transaction() as tx:
+            written = self.conn.fetch_all("""
+                INSERT INTO analytics_utm_daily
+                    (date, utm_term, visits, users, pageviews, bounce_rate, product_id, feed_id)
+                SELECT t.date, t.utm_term, t.visits, t.users, t.pageviews, t.bounce_rate, t.product_id, t.feed_id
+                FROM jsonb_to_recordset(%s::jsonb) AS t(
+                    date date, utm_term text, visits integer, users integer, pageviews integer,
+                    bounce_rate numeric, product_id text, feed_id text
+                )
+                ON CONFLICT (date, utm_term) DO UPDATE SET
+                    visits = EXCLUDED.visits,
+                    users = EXCLUDED.users,
+                    pageviews = EXCLUDED.pageviews,
+                    bounce_rate = EXCLUDED.bounce_rate,
+                    product_id = EXCLUDED.product_id,
+                    feed_id = EXCLUDED.feed_id,
+                    updated_at = NOW()
+                WHERE (analytics_utm_daily.visits, analytics_utm_daily.users, analytics_utm_daily.pageviews,
+                       analytics_utm_daily.bounce_rate, analytics_utm_daily.product_id, analytics_utm_daily.feed_id)
+                    IS DISTINCT FROM
+                      (EXCLUDED.visits, EXCLUDED.users, EXCLUDED.pageviews,
+                       EXCLUDED.bounce_rate, EXCLUDED.product_id, EXCLUDED.feed_id)
+                RETURNING 1 AS written
+            """, (Json(list(unique.values())),))
+        if not tx.committed:
+            print(f"❌ Analytics upsert of {len(unique)} rows rolled back")
+            return None
+        return len(written)
+
+    def get_analytics_last_date(self) -> Optional[date]:
+        """Latest day already loaded from Metrica (start point of incremental sync)"""
+        row = self.conn.fetch_one("SELECT MAX(date) AS last_date FROM analytics_utm_daily")
+        return row['last_date'] if row else None
+
+    def get_analytics(self, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Daily UTM term statistics filtered by feedId/productId/dateFrom/dateTo"""
+        filters = filters or {}
+        conditions = []
+        params: List[Any] = []
+        for key, clause in (('feedId', 'feed_id = %s'), ('productId', 'product_id = %s'),
+                            ('dateFrom', 'date >= %s'), ('dateTo', 'date <= %s')):
+            if filters.get(key):
+                conditions.append(clause)
+                params.append(filters[key])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.conn.fetch_all(
+            f"SELECT * FROM analytics_utm_daily {where} ORDER BY date DESC, visits DESC",
+            tuple(params) if params else None
+        )
+        return [
+            {
+                'utm_term': row['utm_term'],
+                'date': row['date'].isoformat(),
+                'visits': row['visits'],
+                'users': row['users'],
+                'pageviews': row['pageviews'],
+                'bounceRate': float(row['bounce_rate'] or 0),
+                'productId': row['product_id'],
+                'feedId': row['feed_id'],
+                'createdAt': row['created_at'].isoformat() if row.get('created_at') else None,
+                'updatedAt': row['updated_at'].isoformat() if row.get('updated_at') else None,
+            }
+            for row in rows
+        ]
+
+    def clear_analytics(self) -> bool:
+        """Delete all loaded Metrica statistics (next sync starts from scratch)"""
+        return self.conn.execute_query("TRUNCATE analytics_utm_daily")
+
+    # ==================== DIRECT PARSER ====================
+    def get_direct_ads(
+        self,
+        query: Optional[str] = None,
+        platform: Optional[str] = None,
+        domain: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0
+    ) -> Dict[str, Any]:
+        """Filtered page of ads, newest first, with the total match count.
+
+        ``query`` is a case-insensitive substring, ``platform`` a
+        case-insensitive exact match and ``domain`` the advertiser host.
+        """
+        conditions = []
+        params: List[Any] = []
+        if query:
+            conditions.append("query ILIKE %s")
+            params.append(_like_pattern(query))
+        if platform:
+            conditions.append("lower(platform) = lower(%s)")
+            params.append(platform)
+        if domain:
+            host = urlparse(domain).netloc if '://' in domain else domain
+            conditions.append("domain = %s")
+            params.append(host.strip().lower())
+        if date_from:
+            conditions.append('"timestamp" >= %s')
+            params.append(date_from)
+        if date_to:
+            conditions.append('"timestamp" <= %s')
+            params.append(date_to)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        total = self.conn.fetch_one(f"SELECT COUNT(*) AS total FROM direct_ads {where}", tuple(params))
+        rows = self.conn.fetch_all(
+            f'SELECT * FROM direct_ads {where} ORDER BY "timestamp" DESC, id LIMIT %s OFFSET %s',
+            tuple(params + [limit, offset])
+        )
+        return {
+            'ads': [_hydrate_direct_ad(row) for row in rows],
+            'total': total['total'] if total else 0,
+        }
+
+    def add_direct_ads(self, ads: List[Dict[str, Any]], task_id: Optional[str] = None,
+                       session_id: Optional[str] = None) -> Optional[List[Dict[str, Any]]]:
+        """Bulk-insert ads in one statement, skipping URLs that are already stored.
+
+        Returns the inserted ads, or None if the insert failed.
+        """
+        rows = [_direct_ad_row(ad, task_id, session_id) for ad in ads]
+        if not rows:
+            return []
+        with self.conn.transaction() as tx:
+            inserted = self.conn.fetch_all("""
+                INSERT INTO direct_ads
+                (id, platform, type, query, title, description, url, display_url, domain,
+                 position, is_premium, sitelinks, extensions, extra, session_id, task_id, "timestamp")
+                SELECT t.id, t.platform, t.type, t.query, t.title, t.description, t.url, t.display_url,
+                       t.domain, t.position, t.is_premium, t.sitelinks, t.extensions, t.extra,
+                       t.session_id, t.task_id, t."timestamp"
+                FROM jsonb_to_recordset(%s::jsonb) AS t(
+                    id text, platform text, type text, query text, title text, description text,
+                    url text, display_url text, domain text, position integer, is_premium boolean,
+                    sitelinks jsonb, extensions jsonb, extra jsonb, session_id text, task_id text,
+                    "timestamp" timestamp
+                )
+                ON CONFLICT (url) WHERE url <> '' DO NOTHING
+                RETURNING *
+            """, (Json(rows),))
+        if not tx.committed:
+            print(f"❌ Direct ads insert of {len(rows)} rows rolled back")
+            return None
+        return [_hydrate_direct_ad(row) for row in inserted]
+
+    def delete_direct_ad(self, ad_id: str) -> bool:
+        return self.conn.execute_query("DELETE FROM direct_ads WHERE id = %s", (ad_id,))
+
+    def delete_direct_ads(self, query: Optional[str] = None, date_before: Optional[str] = None) -> int:
+        """Delete ads for a query, older than a date, or all of them; returns the count"""
+        if query:
+            where, params = "WHERE lower(query) = lower(%s)", (query,)
+        elif date_before:
+            where, params = 'WHERE "timestamp" < %s', (date_before,)
+        else:
+            where, params = "", ()
+        result = self.conn.fetch_one(
+            f"WITH deleted AS (DELETE FROM direct_ads {where} RETURNING 1) SELECT COUNT(*) AS deleted FROM deleted",
+            params
+        )
+        return result['deleted'] if result else 0
+
+    def count_direct_ads(self) -> int:
+        result = self.conn.fetch_one("SELECT COUNT(*) AS total FROM direct_ads")
+        return result['total'] if result else 0
+
+    def get_direct_ads_stats(self) -> Dict[str, Any]:
+        """Totals, advertiser domains and top queries computed in SQL"""
+        totals = self.conn.fetch_one("""
+            SELECT
+                (SELECT COUNT(*) FROM direct_ads) AS total_ads,
+                (SELECT COUNT(*) FROM direct_searches) AS total_searches,
+                (SELECT COUNT(DISTINCT domain) FROM direct_ads WHERE domain <> '') AS unique_domains,
+                (SELECT MAX("timestamp") FROM direct_ads) AS last_update
+        """) or {}
+        domains = self.conn.fetch_all(
+            "SELECT DISTINCT domain FROM direct_ads WHERE domain <> '' LIMIT 50"
+        )
+        top_queries = self.conn.fetch_all("""
+            SELECT query, COUNT(*) AS count FROM direct_ads
+            GROUP BY query ORDER BY count DESC LIMIT 10
+        """)
+        last_update = totals.get('last_update')
+        return {
+            'total_ads': totals.get('total_ads', 0),
+            'total_searches': totals.get('total_searches', 0),
+            'unique_domains': totals.get('unique_domains', 0),
+            'domains_list': [row['domain'] for row in domains],
+            'top_queries': [[row['query'], row['count']] for row in top_queries],
+            'last_update': last_update.strftime(DIRECT_AD_TIMESTAMP_FORMAT) if last_update else None,
+        }
+
+    def get_direct_ad_domains(self) -> List[Dict[str, Any]]:
+        """Advertiser domains with ad count, queries and up to three sample titles"""
+        return self.conn.fetch_all("""
+            SELECT domain,
+                   COUNT(*) AS count,
+                   array_agg(DISTINCT query) AS queries,
+                   (array_agg(title ORDER BY "timestamp" DESC))[1:3] AS titles
+            FROM direct_ads
+            WHERE domain <> ''
+            GROUP BY domain
+            ORDER BY count DESC
+        """)
+
+    def get_direct_searches(self) -> List[Dict[str, Any]]:
+        rows = self.conn.fetch_all("SELECT * FROM direct_searches ORDER BY last_searched DESC")
+        return [_hydrate_direct_search(row) for row in rows]
+
+    def save_direct_search(self, search: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Record a finished search, keyed by query (repeat searches bump searchCount)"""
+        searched_at = _parse_timestamp(search.get('timestamp')) or datetime.now()
+        row = self.conn.fetch_one("""
+            INSERT INTO direct_searches
+            (id, query, pages_parsed, ads_found, status, search_count, last_searched)
+            VALUES (%s, %s, %s, %s, %s, 1, %s)
+            ON CONFLICT (query) DO UPDATE SET
+                pages_parsed = EXCLUDED.pages_parsed,
+                ads_found = EXCLUDED.ads_found,
+                status = EXCLUDED.status,
+                search_count = direct_searches.search_count + 1,
+                last_searched = EXCLUDED.last_searched
+            RETURNING *
+        """, (
+            str(uuid.uuid4()),
+            search.get('query', ''),
+            search.get('pages_parsed', 0),
+            search.get('ads_found', 0),
+            search.get('status', 'completed'),
+            searched_at,
+        ))
+        return _hydrate_direct_search(row) if row else None
+
+    def touch_direct_searches(self, queries: List[str]) -> bool:
+        """Bump search history for queries sent to the parser agent"""
+        # A query may appear once per statement for ON CONFLICT DO UPDATE
+        unique_queries = list(dict.fromkeys(queries))
+        if not unique_queries:
+            return True
+        return self.conn.execute_query("""
+            INSERT INTO direct_searches (id, query, search_count, last_searched)
+            SELECT t.id, t.query, 1, NOW()
+            FROM unnest(%s::text[], %s::text[]) AS t(id, query)
+            ON CONFLICT (query) DO UPDATE SET
+                search_count = direct_searches.search_count + 1,
+                last_searched = NOW()
+        """, ([str(uuid.uuid4()) for _ in unique_queries], unique_queries))
+
+    def set_direct_search_results(self, results_by_query: Dict[str, int]) -> bool:
+        """Set resultsCount for several queries in one statement"""
+        if not results_by_query:
+            return True
+        rows = [{'query': q, 'count': n} for q, n in results_by_query.items()]
+        return self.conn.execute_query("""
+            UPDATE direct_searches s SET results_count = t.count
+            FROM jsonb_to_recordset(%s::jsonb) AS t(query text, count integer)
+            WHERE s.query = t.query
+        """, (Json(rows),))
+
     # Telegram Auth Codes
     def add_telegram_auth_code(self, code: str, data: Dict[str, Any]) -> None:
         """Добавить код авторизации Telegram"""
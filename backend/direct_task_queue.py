@@ -0,0 +1,339 @@
+"""
+Очередь задач Direct Parser для удаленных агентов.
+
+Задача из веб-интерфейса делится на шарды - по одному на поисковый запрос,
+поэтому большую задачу разбирают несколько агентов параллельно. Агент
+забирает шард атомарно (``FOR UPDATE SKIP LOCKED``) под аренду на
+DIRECT_TASK_LEASE_SECONDS; heartbeat и обновления статуса продлевают аренду.
+Если агент пропал, аренда истекает и шард достается следующему агенту;
+после DIRECT_TASK_MAX_ATTEMPTS неудачных аренд шард помечается failed.
+
+Состояние хранится в PostgreSQL (migrations/008_direct_parser_task_queue.sql)
+и переживает перезапуск сервера. Ожидающие long-poll запросы агентов
+просыпаются сразу при появлении задач в этом процессе, а задачи из других
+воркеров и истекшие аренды подхватываются повторной попыткой раз в
+DIRECT_TASK_POLL_INTERVAL секунд.
+"""
+import asyncio
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+DIRECT_TASK_LEASE_SECONDS = int(os.getenv("DIRECT_TASK_LEASE_SECONDS", "120"))
+DIRECT_TASK_MAX_ATTEMPTS = int(os.getenv("DIRECT_TASK_MAX_ATTEMPTS", "3"))
+DIRECT_TASK_POLL_INTERVAL = float(os.getenv("DIRECT_TASK_POLL_INTERVAL", "2"))
+# Агент считается онлайн, если heartbeat был не позже
+DIRECT_AGENT_ONLINE_SECONDS = 30
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _task_status(total: int, completed: int, failed: int, running: int) -> str:
+    if total and completed + failed == total:
+        return "failed" if completed == 0 else "completed"
+    if running or completed or failed:
+        return "running"
+    return "pending"
+
+
+class _TaskWaiters:
+    """Long-poll запросы агентов, ожидающие задачу (в рамках процесса)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    def add(self):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        return waiter
+
+    def remove(self, waiter):
+        with self._lock:
+            self._waiters.discard(waiter)
+
+    def notify(self):
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Event loop ожидающего уже закрыт
+                pass
+
+
+class DirectTaskQueue:
+    """Персистентная очередь задач парсинга с арендой шардов"""
+
+    def __init__(self, conn, lease_seconds: int = DIRECT_TASK_LEASE_SECONDS,
+                 max_attempts: int = DIRECT_TASK_MAX_ATTEMPTS):
+        self.conn = conn
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._waiters = _TaskWaiters()
+
+    # ---------- Задачи (веб-интерфейс) ----------
+
+    def create_task(self, queries: List[str], max_pages: int = 2, headless: bool = False) -> Optional[Dict[str, Any]]:
+        """Создать задачу и по шарду на каждый уникальный запрос"""
+        queries = [q for q in dict.fromkeys(q.strip() for q in queries) if q]
+        task_id = uuid.uuid4().hex[:8]
+        with self.conn.transaction() as tx:
+            self.conn.execute_query(
+                "INSERT INTO direct_parser_tasks (id, queries, max_pages, headless) VALUES (%s, %s::jsonb, %s, %s)",
+                (task_id, json.dumps(queries, ensure_ascii=False), max_pages, headless)
+            )
+            self.conn.execute_query("""
+                INSERT INTO direct_parser_task_shards (id, task_id, position, query, message)
+                SELECT %s || '-' || t.position, %s, t.position, t.query, 'Ожидает агента'
+                FROM unnest(%s::text[]) WITH ORDINALITY AS t(query, position)
+            """, (task_id, task_id, queries))
+        if not tx.committed:
+            return None
+        self._waiters.notify()
+        return self.get_task(task_id)
+
+    def _task_rows(self, task_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        where = "WHERE t.id = %s" if task_id else ""
+        return self.conn.fetch_all(f"""
+            SELECT t.*,
+                   COUNT(s.id) AS shards_total,
+                   COUNT(s.id) FILTER (WHERE s.status = 'completed') AS shards_completed,
+                   COUNT(s.id) FILTER (WHERE s.status = 'failed') AS shards_failed,
+                   COUNT(s.id) FILTER (WHERE s.status = 'leased' AND s.lease_expires_at > NOW()) AS shards_running,
+                   COALESCE(SUM(s.results_count), 0) AS results_count,
+                   MAX(s.updated_at) AS updated_at,
+                   MAX(s.updated_at) FILTER (WHERE s.status IN ('completed', 'failed')) AS finished_at
+            FROM direct_parser_tasks t
+            LEFT JOIN direct_parser_task_shards s ON s.task_id = t.id
+            {where}
+            GROUP BY t.id
+            ORDER BY t.created_at DESC
+        """, (task_id,) if task_id else None)
+
+    @staticmethod
+    def _hydrate_task(row: Dict[str, Any]) -> Dict[str, Any]:
+        total = row["shards_total"]
+        done = row["shards_completed"] + row["shards_failed"]
+        status = _task_status(total, row["shards_completed"], row["shards_failed"], row["shards_running"])
+        if status == "pending":
+            message = "Ожидает агента"
+        elif status == "running":
+            message = f"Выполнено запросов {done}/{total}"
+        else:
+            message = f"Готово: {row['results_count']} объявлений"
+            if row["shards_failed"]:
+                message += f", ошибок: {row['shards_failed']}"
+        return {
+            "id": row["id"],
+            "queries": row["queries"],
+            "max_pages": row["max_pages"],
+            "headless": row["headless"],
+            "status": status,
+            "message": message,
+            "progress": int(done * 100 / total) if total else 0,
+            "shardsTotal": total,
+            "shardsCompleted": row["shards_completed"],
+            "shardsFailed": row["shards_failed"],
+            "shardsRunning": row["shards_running"],
+            "resultsCount": row["results_count"],
+            "created_at": _iso(row["created_at"]),
+            "updated_at": _iso(row["updated_at"]),
+            "completed_at": _iso(row["finished_at"]) if status in ("completed", "failed") else None,
+        }
+
+    def list_tasks(self) -> List[Dict[str, Any]]:
+        return [self._hydrate_task(row) for row in self._task_rows()]
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._task_rows(task_id)
+        if not rows:
+            return None
+        task = self._hydrate_task(rows[0])
+        task["shards"] = [
+            {
+                "id": shard["id"],
+                "query": shard["query"],
+                "status": shard["status"],
+                "agent_id": shard["agent_id"],
+                "attempts": shard["attempts"],
+                "message": shard["message"],
+                "progress": shard["progress"],
+                "resultsCount": shard["results_count"],
+                "lease_expires_at": _iso(shard["lease_expires_at"]),
+                "updated_at": _iso(shard["updated_at"]),
+            }
+            for shard in self.conn.fetch_all(
+                "SELECT * FROM direct_parser_task_shards WHERE task_id = %s ORDER BY position", (task_id,)
+            )
+        ]
+        return task
+
+    def delete_task(self, task_id: str) -> bool:
+        deleted = self.conn.fetch_one("DELETE FROM direct_parser_tasks WHERE id = %s RETURNING id", (task_id,))
+        return deleted is not None
+
+    # ---------- Агенты ----------
+
+    def claim(self, agent_id: str) -> Optional[Dict[str, Any]]:
+        """Атомарно взять следующий свободный шард (или шард с истекшей арендой)"""
+        # Шарды, которые агенты роняли слишком часто, больше не выдаем
+        self.conn.execute_query("""
+            UPDATE direct_parser_task_shards
+            SET status = 'failed', agent_id = NULL, lease_expires_at = NULL,
+                message = 'Агент не ответил: исчерпаны попытки', updated_at = NOW()
+            WHERE status = 'leased' AND lease_expires_at < NOW() AND attempts >= %s
+        """, (self.max_attempts,))
+        shard = self.conn.fetch_one("""
+            UPDATE direct_parser_task_shards s
+            SET status = 'leased', agent_id = %s,
+                lease_expires_at = NOW() + make_interval(secs => %s),
+                attempts = s.attempts + 1, message = 'Назначена агенту', progress = 0, updated_at = NOW()
+            FROM direct_parser_tasks t
+            WHERE t.id = s.task_id AND s.id = (
+                SELECT id FROM direct_parser_task_shards
+                WHERE status = 'pending' OR (status = 'leased' AND lease_expires_at < NOW())
+                ORDER BY created_at, position
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING s.id, s.task_id, s.query, s.attempts, t.max_pages, t.headless
+        """, (agent_id, self.lease_seconds))
+        if not shard:
+            return None
+        # Формат задачи, который понимает direct_agent.py: один запрос на шард
+        return {
+            "id": shard["id"],
+            "taskId": shard["task_id"],
+            "queries": [shard["query"]],
+            "max_pages": shard["max_pages"],
+            "headless": shard["headless"],
+            "attempt": shard["attempts"],
+            "lease_seconds": self.lease_seconds,
+            "status": "assigned",
+            "message": "Назначена агенту",
+        }
+
+    async def claim_wait(self, agent_id: str, wait_seconds: float) -> Optional[Dict[str, Any]]:
+        """Long-poll: взять шард, дождавшись его появления не дольше wait_seconds"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait_seconds
+        waiter = self._waiters.add()
+        try:
+            while True:
+                waiter[1].clear()
+                shard = await asyncio.to_thread(self.claim, agent_id)
+                remaining = deadline - loop.time()
+                if shard or remaining <= 0:
+                    return shard
+                try:
+                    await asyncio.wait_for(waiter[1].wait(), timeout=min(remaining, DIRECT_TASK_POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiters.remove(waiter)
+
+    def heartbeat(self, agent_id: str) -> int:
+        """Отметить агента онлайн и продлить аренду его шардов; возвращает число шардов"""
+        self.conn.execute_query("""
+            INSERT INTO direct_parser_agents (agent_id, last_seen) VALUES (%s, NOW())
+            ON CONFLICT (agent_id) DO UPDATE SET last_seen = NOW()
+        """, (agent_id,))
+        extended = self.conn.fetch_all("""
+            UPDATE direct_parser_task_shards
+            SET lease_expires_at = NOW() + make_interval(secs => %s)
+            WHERE agent_id = %s AND status = 'leased'
+            RETURNING id
+        """, (self.lease_seconds, agent_id))
+        return len(extended)
+
+    def update_shard(self, shard_id: str, agent_id: str, status: str, message: str = "",
+                     progress: Optional[int] = None) -> bool:
+        """Статус от агента, который держит действующую аренду. failed - вернуть
+        шард в очередь (пока есть попытки), иначе обновить сообщение (и progress,
+        если передан) и продлить аренду. Результаты фиксирует complete_shard.
+        False - аренды нет (шард чужой, истек или уже завершен)."""
+        if status == "failed":
+            shard = self.conn.fetch_one("""
+                UPDATE direct_parser_task_shards
+                SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END,
+                    agent_id = NULL, lease_expires_at = NULL, message = %s, updated_at = NOW()
+                WHERE id = %s AND status = 'leased' AND agent_id = %s AND lease_expires_at > NOW()
+                RETURNING status
+            """, (self.max_attempts, message, shard_id, agent_id))
+            if shard and shard["status"] == "pending":
+                self._waiters.notify()
+        else:
+            if progress is not None:
+                progress = max(0, min(progress, 100))
+            shard = self.conn.fetch_one("""
+                UPDATE direct_parser_task_shards
+                SET message = %s, progress = COALESCE(%s, progress), updated_at = NOW(),
+                    lease_expires_at = NOW() + make_interval(secs => %s)
+                WHERE id = %s AND status = 'leased' AND agent_id = %s AND lease_expires_at > NOW()
+                RETURNING id
+            """, (message, progress, self.lease_seconds, shard_id, agent_id))
+        return shard is not None
+
+    def complete_shard(self, shard_id: str, agent_id: str, results_count: int) -> bool:
+        """Зафиксировать результаты шарда.
+
+        Только агент, который держит действующую аренду: если аренда истекла и
+        шард уже отдан другому агенту, запоздавший агент его не перезапишет.
+        False - аренды нет (шард чужой, истек или уже завершен).
+        """
+        return self.conn.fetch_one("""
+            UPDATE direct_parser_task_shards
+            SET status = 'completed', results_count = %s, progress = 100, lease_expires_at = NULL,
+                message = %s, updated_at = NOW()
+            WHERE id = %s AND status = 'leased' AND agent_id = %s AND lease_expires_at > NOW()
+            RETURNING id
+        """, (results_count, f"Готово: {results_count} объявлений", shard_id, agent_id)) is not None
+
+    def get_shard(self, shard_id: str) -> Optional[Dict[str, Any]]:
+        """Шард по ID: {id, task_id, query, status, agent_id}"""
+        return self.conn.fetch_one(
+            "SELECT id, task_id, query, status, agent_id FROM direct_parser_task_shards WHERE id = %s",
+            (shard_id,)
+        )
+
+    def shard_exists(self, shard_id: str) -> bool:
+        return self.get_shard(shard_id) is not None
+
+    def agents_status(self) -> Dict[str, Any]:
+        agents = self.conn.fetch_all("""
+            SELECT a.agent_id, a.last_seen,
+                   EXTRACT(EPOCH FROM NOW() - a.last_seen)::int AS seconds_ago,
+                   COUNT(s.id) AS leased_shards
+            FROM direct_parser_agents a
+            LEFT JOIN direct_parser_task_shards s
+                ON s.agent_id = a.agent_id AND s.status = 'leased' AND s.lease_expires_at > NOW()
+            WHERE a.last_seen > NOW() - INTERVAL '1 day'
+            GROUP BY a.agent_id, a.last_seen
+            ORDER BY a.last_seen DESC
+        """)
+        running = self.conn.fetch_one("""
+            SELECT COUNT(DISTINCT task_id) AS running FROM direct_parser_task_shards
+            WHERE status = 'leased' AND lease_expires_at > NOW()
+        """)
+        return {
+            "agents": [
+                {
+                    "agent_id": a["agent_id"],
+                    "last_seen": a["last_seen"].strftime("%Y-%m-%d %H:%M:%S"),
+                    "seconds_ago": a["seconds_ago"],
+                    "online": a["seconds_ago"] < DIRECT_AGENT_ONLINE_SECONDS,
+                    "leased_shards": a["leased_shards"],
+                }
+                for a in agents
+            ],
+            "running_tasks": running["running"] if running else 0,
+        }
+
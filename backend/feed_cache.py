@@ -0,0 +1,95 @@
+"""
+Кэш готовых XML фидов.
+
+Ключ кэша (он же ETag) вычисляется из версий всего, что влияет на
+содержимое фида: настроек фида, отпечатка товаров, шаблона, настроек
+магазина и каталогов. Пока ничего из этого не менялось, краулеры
+Яндекса/VK получают 304 или готовое тело без повторной генерации.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+FEED_CACHE_MAX_BYTES = int(os.getenv("FEED_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def make_feed_etag(*parts: Any) -> str:
+    """ETag по содержимому: хэш от версий всех входных данных фида"""
+    raw = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return '"' + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверка заголовка If-None-Match (список тегов, W/-префикс, *)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+class FeedCache:
+    """LRU-кэш тел фидов, ограниченный суммарным размером"""
+
+    def __init__(self, max_bytes: int = FEED_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "stored": 0, "evicted": 0}
+
+    def get(self, etag: str) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(etag)
+            if body is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(etag)
+            self.stats["hits"] += 1
+            return body
+
+    def put(self, etag: str, body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(etag, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[etag] = body
+            self._size += len(body)
+            self.stats["stored"] += 1
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.stats["evicted"] += 1
+
+    def stream(self, etag: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Отдавать части фида клиенту и сохранить тело, если генерация завершилась"""
+        parts = []
+        size = 0
+        for chunk in chunks:
+            if size <= self.max_bytes:
+                parts.append(chunk)
+                size += len(chunk)
+            yield chunk
+        if size <= self.max_bytes:
+            self.put(etag, b"".join(parts))
+
+    def note_not_modified(self):
+        with self._lock:
+            self.stats["not_modified"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes}
+
+
+# Глобальный экземпляр
+feed_cache = FeedCache()
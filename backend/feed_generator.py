@@ -4,16 +4,19 @@
 """
 
 import xml.etree.ElementTree as ET
-import xml.dom.minidom as minidom
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Iterator, Optional
+
+
+# Размер порции, которой потоковый генератор отдаёт XML
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 def generate_yml_feed(
     products: List[Dict[str, Any]],
     collections: List[Dict[str, Any]] = None,
     settings: Dict[str, Any] = None
-) -> str:
+) -> bytes:
     """
     Генерация YML фида согласно требованиям Яндекса
     
@@ -23,7 +26,32 @@ def generate_yml_feed(
         settings: Настройки магазина
     
     Returns:
-        str: XML строка в формате YML
+        bytes: XML в формате YML (utf-8)
+    """
+    return b''.join(iter_yml_feed(products, collections, settings))
+
+
+def iter_yml_feed(
+    products: Iterable[Dict[str, Any]],
+    collections: List[Dict[str, Any]] = None,
+    settings: Dict[str, Any] = None,
+    category_names: Optional[List[str]] = None
+) -> Iterator[bytes]:
+    """
+    Потоковая генерация YML фида.
+    
+    Каждый <offer> строится и сериализуется отдельно, поэтому в памяти нет
+    ни полного дерева, ни его копий - товары можно читать курсором из БД.
+    
+    Args:
+        products: Товары (итератор читается один раз)
+        collections: Список каталогов (опционально)
+        settings: Настройки магазина
+        category_names: Категории, известные заранее (например, источники фида).
+            Если не заданы - собираются из товаров, и products читается целиком.
+    
+    Yields:
+        bytes: Части XML документа (utf-8)
     """
     if settings is None:
         settings = {}
@@ -31,36 +59,58 @@ def generate_yml_feed(
     if collections is None:
         collections = []
     
-    # Корневой элемент
-    root = ET.Element('yml_catalog')
-    root.set('date', datetime.now().strftime('%Y-%m-%d %H:%M'))
+    if category_names is None:
+        products = list(products)
+        category_names = [p.get('categoryName') for p in products]
     
-    shop = ET.SubElement(root, 'shop')
-    
-    # Информация о магазине
-    _add_shop_info(shop, settings)
-    
-    # Валюты
-    _add_currencies(shop, settings)
-    
-    # Категории - собираем уникальные категории из товаров
-    category_mapping = _add_categories(shop, products, settings)
-    
-    # Товарные предложения (offers)
-    offers = ET.SubElement(shop, 'offers')
-    for product in products:
-        _add_offer(offers, product, settings, category_mapping)
-    
-    # Каталоги (collections) - если есть
-    if collections:
-        _add_collections(shop, collections)
-    
-    # Форматируем XML
-    xml_str = ET.tostring(root, encoding='utf-8')
-    dom = minidom.parseString(xml_str)
-    pretty_xml = dom.toprettyxml(indent='  ', encoding='utf-8')
-    
-    return pretty_xml
+    def parts() -> Iterator[str]:
+        yield '<?xml version="1.0" encoding="utf-8"?>\n'
+        yield f'<yml_catalog date="{datetime.now().strftime("%Y-%m-%d %H:%M")}">\n  <shop>\n'
+        
+        # Информация о магазине, валюты, категории
+        head = ET.Element('shop')
+        _add_shop_info(head, settings)
+        _add_currencies(head, settings)
+        category_mapping = _add_categories(head, category_names, settings)
+        for element in head:
+            yield _serialize(element, level=2)
+        
+        # Товарные предложения (offers) - по одному
+        yield '    <offers>\n'
+        offers = ET.Element('offers')
+        for product in products:
+            _add_offer(offers, product, settings, category_mapping)
+            offer = offers[0]
+            offers.remove(offer)
+            yield _serialize(offer, level=3)
+        yield '    </offers>\n'
+        
+        # Каталоги (collections) - если есть
+        if collections:
+            tail = ET.Element('shop')
+            _add_collections(tail, collections)
+            yield _serialize(tail[0], level=2)
+        
+        yield '  </shop>\n</yml_catalog>\n'
+    
+    # Склеиваем мелкие части в порции, чтобы не отправлять каждый offer отдельно
+    buffer: List[str] = []
+    size = 0
+    for part in parts():
+        buffer.append(part)
+        size += len(part)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def _serialize(element: ET.Element, level: int) -> str:
+    """Сериализация элемента с отступами (как у toprettyxml)"""
+    ET.indent(element, space='  ', level=level)
+    element.tail = None
+    return '  ' * level + ET.tostring(element, encoding='unicode') + '\n'
 
 
 def _add_shop_info(shop: ET.Element, settings: Dict[str, Any]):
@@ -83,16 +133,15 @@ def _add_currencies(shop: ET.Element, settings: Dict[str, Any]):
     currency.set('rate', '1')
 
 
-def _add_categories(shop: ET.Element, products: List[Dict[str, Any]], settings: Dict[str, Any]):
+def _add_categories(shop: ET.Element, category_names: Iterable[Optional[str]], settings: Dict[str, Any]):
     """Добавление категорий - динамически из товаров и настроек"""
     categories = ET.SubElement(shop, 'categories')
     
-    # Собираем уникальные категории из товаров
+    # Собираем уникальные категории товаров
     unique_categories = {}
     category_id_counter = 1
     
-    for product in products:
-        category_name = product.get('categoryName')
+    for category_name in category_names:
         if category_name and category_name not in unique_categories:
             unique_categories[category_name] = str(category_id_counter)
             category_id_counter += 1
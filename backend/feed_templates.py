@@ -0,0 +1,409 @@
+"""
+Рендеринг фидов по кастомным шаблонам (Mustache, VK/Google и др.)
+
+Шаблон компилируется один раз и кэшируется по id и updated_at. Секция
+``{{#offers}}`` (или ``{{#entries}}``) выделяется из шаблона и рендерится
+по одному товару, поэтому фид отдаётся частями и без списка словарей
+offer_data на каждый товар: поля и их алиасы вычисляются при обращении.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from feed_generator import STREAM_CHUNK_SIZE, generate_yml_feed
+
+TEMPLATE_CACHE_SIZE = 64
+OFFER_SECTIONS = ('offers', 'entries')
+DEFAULT_CATEGORY = 'Туры'
+
+_SECTION_OPEN_RE = re.compile(r'{{\s*#\s*(offers|entries)\s*}}')
+_SECTION_TAG_RE = re.compile(r'{{\s*([#^/])\s*([^}\s]+)\s*}}')
+_BLOCK_RE_CACHE: Dict[str, 're.Pattern'] = {}
+
+
+def _site_name(settings: Dict[str, Any]) -> str:
+    return settings.get('siteName', 'Вокруг света')
+
+
+def _old_price(product: Dict[str, Any]) -> Optional[str]:
+    return str(product.get('oldPrice')) if product.get('oldPrice') else None
+
+
+def _is_active(product: Dict[str, Any]) -> bool:
+    return bool(product.get('active', True))
+
+
+class OfferView:
+    """Товар в контексте шаблона.
+
+    Поля и алиасы для VK/Google форматов вычисляются при обращении из
+    общей таблицы, а не копируются в словарь на каждый товар.
+    """
+
+    __slots__ = ('_product', '_feed')
+
+    FIELDS: Dict[str, Callable[[Dict[str, Any], 'FeedContext'], Any]] = {
+        'id': lambda p, f: p.get('id', ''),
+        'url': lambda p, f: p.get('url', ''),
+        'price': lambda p, f: str(p.get('price', '0')),
+        'oldPrice': lambda p, f: _old_price(p),
+        'oldprice': lambda p, f: _old_price(p),
+        'categoryId': lambda p, f: f.category_ids.get(p.get('categoryName', DEFAULT_CATEGORY), 1),
+        'picture': lambda p, f: p.get('image', ''),
+        'image': lambda p, f: p.get('image', ''),
+        'name': lambda p, f: p.get('name', ''),
+        'route': lambda p, f: p.get('route', ''),
+        'description': lambda p, f: p.get('description') or p.get('route', ''),
+        'vendor': lambda p, f: p.get('vendor', _site_name(f.settings)),
+        'model': lambda p, f: p.get('model', p.get('name', '')),
+        'days': lambda p, f: p.get('days', ''),
+        'available': lambda p, f: 'true' if _is_active(p) else 'false',
+        # Алиасы для VK/Google формата
+        'title': lambda p, f: p.get('name', ''),
+        'link': lambda p, f: p.get('url', ''),
+        'image_link': lambda p, f: p.get('image', ''),
+        'condition': lambda p, f: 'new',
+        'availability': lambda p, f: 'in stock' if _is_active(p) else 'out of stock',
+        'brand': lambda p, f: p.get('vendor', _site_name(f.settings)),
+        'product_type': lambda p, f: p.get('categoryName', DEFAULT_CATEGORY),
+        'currency': lambda p, f: f.settings.get('defaultCurrency', 'RUB'),
+    }
+
+    def __init__(self, product: Dict[str, Any], feed: 'FeedContext'):
+        self._product = product
+        self._feed = feed
+
+    def __getattr__(self, key: str):
+        getter = OfferView.FIELDS.get(key)
+        if getter is None:
+            raise AttributeError(key)
+        return getter(self._product, self._feed)
+
+
+class OfferList:
+    """Ленивый список offers: представления создаются при обходе"""
+
+    def __init__(self, feed: 'FeedContext'):
+        self._feed = feed
+
+    def __iter__(self):
+        for product in self._feed.products:
+            yield OfferView(product, self._feed)
+
+    def __len__(self):
+        return len(self._feed.products)
+
+
+class FeedContext:
+    """Общие для всех товаров данные фида"""
+
+    def __init__(self, products: List[Dict[str, Any]], settings: Dict[str, Any]):
+        self.products = products
+        self.settings = settings
+        self.categories: List[Dict[str, Any]] = []
+        self.category_ids: Dict[str, int] = {}
+        for product in products:
+            cat_name = product.get('categoryName', DEFAULT_CATEGORY)
+            if cat_name not in self.category_ids:
+                self.category_ids[cat_name] = len(self.categories) + 1
+                self.categories.append({'id': self.category_ids[cat_name], 'name': cat_name})
+        # Если категорий нет, добавляем дефолтную
+        if not self.categories:
+            self.categories.append({'id': 1, 'name': DEFAULT_CATEGORY})
+            self.category_ids[DEFAULT_CATEGORY] = 1
+
+    def template_data(self) -> Dict[str, Any]:
+        offers = OfferList(self)
+        return {
+            'shop_name': _site_name(self.settings),
+            'company': self.settings.get('companyName', 'Туристическая компания "Вокруг света"'),
+            'url': self.settings.get('siteUrl', 'https://vs-travel.ru'),
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M'),
+            'currency': self.settings.get('defaultCurrency', 'RUB'),
+            'categories': self.categories,
+            'offers': offers,
+            # entries - алиас offers для VK/Google шаблонов
+            'entries': offers,
+        }
+
+
+def _standalone_bounds(source: str, start: int, end: int) -> Tuple[int, int]:
+    """Границы тега с учётом правила standalone-строки Mustache.
+
+    Если тег стоит на строке один, строка удаляется целиком - как это
+    делает pystache при рендеринге всего шаблона.
+    """
+    line_start = source.rfind('\n', 0, start) + 1
+    line_end = source.find('\n', end)
+    line_end = len(source) if line_end == -1 else line_end + 1
+    if source[line_start:start].strip() == '' and source[end:line_end].strip() == '':
+        return line_start, line_end
+    return start, end
+
+
+def _sections_balanced(source: str) -> bool:
+    """Все секции в фрагменте открыты и закрыты внутри него самого"""
+    stack: List[str] = []
+    for match in _SECTION_TAG_RE.finditer(source):
+        kind, name = match.groups()
+        if kind != '/':
+            stack.append(name)
+        elif not stack or stack.pop() != name:
+            return False
+    return not stack
+
+
+def split_offer_section(source: str) -> Optional[Tuple[str, str, str]]:
+    """Разбить шаблон на (голова, шаблон одного offer, хвост).
+
+    None - если секцию нельзя безопасно выделить (нет секции, смена
+    разделителей, имя секции используется ещё где-то, секция вложена
+    в другую - например ``{{#shop}}...{{#offers}}...{{/offers}}{{/shop}}``).
+    """
+    if '{{=' in source:
+        return None
+    match = _SECTION_OPEN_RE.search(source)
+    if not match:
+        return None
+    name = match.group(1)
+    close = re.compile(r'{{\s*/\s*' + name + r'\s*}}').search(source, match.end())
+    if not close:
+        return None
+    head_end, item_start = _standalone_bounds(source, match.start(), match.end())
+    item_end, tail_start = _standalone_bounds(source, close.start(), close.end())
+    head, item, tail = source[:head_end], source[item_start:item_end], source[tail_start:]
+    mention = re.compile(r'{{\s*[#^&{]?\s*(' + '|'.join(OFFER_SECTIONS) + r')\b')
+    if mention.search(head) or mention.search(tail) or mention.search(item):
+        return None
+    if not all(_sections_balanced(part) for part in (head, item, tail)):
+        return None
+    return head, item, tail
+
+
+class CompiledTemplate:
+    """Скомпилированный шаблон фида"""
+
+    def __init__(self, source: str, parse: Optional[Callable[[str], Any]]):
+        self.source = source
+        parts = split_offer_section(source)
+        self.split = parts is not None
+        self.full = self.head = self.item = self.tail = None
+        if parse is None:
+            return
+        if self.split:
+            try:
+                self.head, self.item, self.tail = (parse(part) for part in parts)
+                return
+            except Exception as e:
+                # Части не разбираются по отдельности - рендерим шаблон целиком
+                print(f"Custom template: offers section not split ({e})")
+                self.split = False
+                self.head = self.item = self.tail = None
+        self.full = parse(source)
+
+
+class TemplateRenderer:
+    """Кэш скомпилированных шаблонов и потоковый рендеринг"""
+
+    def __init__(self, cache_size: int = TEMPLATE_CACHE_SIZE):
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[Tuple[Any, ...], CompiledTemplate]' = OrderedDict()
+        self._cache_size = cache_size
+        self._renderer = None
+        self._parse = None
+        self._pystache_checked = False
+        self.stats = {'compiled': 0, 'hits': 0}
+
+    def _load_pystache(self):
+        if self._pystache_checked:
+            return
+        self._pystache_checked = True
+        try:
+            import pystache
+            # Отключаем HTML escaping для XML
+            self._renderer = pystache.Renderer(escape=lambda u: u)
+            self._parse = pystache.parse
+        except ImportError:
+            print("Warning: pystache not installed, falling back to manual template rendering")
+
+    def compile(self, template: Dict[str, Any], source: str) -> CompiledTemplate:
+        """Скомпилированный шаблон из кэша (ключ: id, updated_at, содержимое)"""
+        self._load_pystache()
+        digest = hashlib.sha1(source.encode('utf-8')).hexdigest()
+        key = (template.get('id'), str(template.get('updated_at') or template.get('updatedAt') or ''), digest)
+        with self._lock:
+            compiled = self._cache.get(key)
+            if compiled is not None:
+                self._cache.move_to_end(key)
+                self.stats['hits'] += 1
+                return compiled
+        compiled = CompiledTemplate(source, self._parse)
+        with self._lock:
+            self._cache[key] = compiled
+            self.stats['compiled'] += 1
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return compiled
+
+    def iter_render(self, compiled: CompiledTemplate, feed: FeedContext) -> Iterator[str]:
+        if self._renderer is None:
+            yield from _iter_manual(compiled.source, feed)
+            return
+        data = feed.template_data()
+        if not compiled.split:
+            yield self._renderer.render(compiled.full, data)
+            return
+        yield self._renderer.render(compiled.head, data)
+        for offer in data['offers']:
+            yield self._renderer.render(compiled.item, data, offer)
+        yield self._renderer.render(compiled.tail, data)
+
+
+template_renderer = TemplateRenderer()
+
+
+def iter_custom_template(
+    template: Dict[str, Any],
+    products: List[Dict[str, Any]],
+    collections: List[Dict[str, Any]],
+    settings: Dict[str, Any]
+) -> Iterator[bytes]:
+    """
+    Потоковый рендеринг фида по кастомному шаблону
+
+    Args:
+        template: Шаблон (content: строка или {"template": ...})
+        products: Товары фида
+        collections: Каталоги (для fallback на YML)
+        settings: Настройки магазина
+
+    Yields:
+        bytes: Части фида (utf-8)
+    """
+    # Поддержка обоих форматов: content: {...} и content: "string"
+    template_content = template.get('content', '')
+    if isinstance(template_content, dict):
+        template_content = template_content.get('template', '')
+
+    if not template_content:
+        # Если шаблона нет, fallback на YML
+        yield generate_yml_feed(products, collections, settings)
+        return
+
+    try:
+        compiled = template_renderer.compile(template, template_content)
+    except Exception as e:
+        print(f"Error applying custom template: {e}")
+        import traceback
+        traceback.print_exc()
+        # Fallback на YML
+        yield generate_yml_feed(products, collections, settings)
+        return
+
+    feed = FeedContext(products, settings)
+    buffer: List[str] = []
+    size = 0
+    started = False
+    try:
+        for part in template_renderer.iter_render(compiled, feed):
+            buffer.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK_SIZE:
+                chunk = ''.join(buffer).encode('utf-8')
+                buffer, size = [], 0
+                started = True
+                yield chunk
+    except Exception as e:
+        if started:
+            # Часть фида уже отправлена - ответ обрывается с ошибкой
+            print(f"Error rendering custom template after streaming started: {e}")
+            raise
+        print(f"Error applying custom template: {e}")
+        import traceback
+        traceback.print_exc()
+        # Fallback на YML, пока клиенту ещё ничего не отдано
+        yield generate_yml_feed(products, collections, settings)
+        return
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def render_custom_template(
+    template: Dict[str, Any],
+    products: List[Dict[str, Any]],
+    collections: List[Dict[str, Any]],
+    settings: Dict[str, Any]
+) -> bytes:
+    """Применяет кастомный шаблон к продуктам используя Mustache синтаксис"""
+    return b''.join(iter_custom_template(template, products, collections, settings))
+
+
+def _block_re(name: str) -> 're.Pattern':
+    pattern = _BLOCK_RE_CACHE.get(name)
+    if pattern is None:
+        pattern = re.compile(r'{{#' + name + r'}}(.*?){{/' + name + r'}}', re.DOTALL)
+        _BLOCK_RE_CACHE[name] = pattern
+    return pattern
+
+
+def _manual_offer(product: Dict[str, Any], feed: FeedContext, currency: str) -> str:
+    cat_id = feed.category_ids.get(product.get('categoryName', DEFAULT_CATEGORY), 1)
+    available = 'true' if _is_active(product) else 'false'
+
+    # Формируем oldprice тег если есть
+    oldprice_xml = ""
+    old_price_value = product.get('oldPrice') or product.get('oldprice')
+    if old_price_value:
+        try:
+            old_price_num = float(old_price_value)
+            current_price_num = float(product.get('price', 0))
+            if old_price_num > current_price_num:
+                oldprice_xml = f"\n        <oldprice>{int(old_price_num)}</oldprice>"
+        except (ValueError, TypeError):
+            pass
+
+    return f'''      <offer id="{product.get('id', '')}" available="{available}">
+        <url>{product.get('url', '')}</url>
+        <price>{product.get('price', '0')}</price>{oldprice_xml}
+        <currencyId>{currency}</currencyId>
+        <categoryId>{cat_id}</categoryId>
+        <picture>{product.get('image', '')}</picture>
+        <name>{product.get('name', '')}</name>
+        <description>{product.get('description') or product.get('route', '')}</description>
+      </offer>
+'''
+
+
+def _iter_manual(template_content: str, feed: FeedContext) -> Iterator[str]:
+    """Ручная замена переменных в шаблоне (fallback если нет pystache)"""
+    settings = feed.settings
+    currency = settings.get('defaultCurrency', 'RUB')
+
+    # Заменяем переменные в шаблоне
+    result = template_content
+    result = result.replace('{{shop_name}}', _site_name(settings))
+    result = result.replace('{{company}}', settings.get('companyName', 'Туристическая компания "Вокруг света"'))
+    result = result.replace('{{url}}', settings.get('siteUrl', 'https://vs-travel.ru'))
+    result = result.replace('{{date}}', datetime.now().strftime('%Y-%m-%d %H:%M'))
+    result = result.replace('{{currency}}', currency)
+
+    # {{#categories}}...{{/categories}}
+    categories_block = _block_re('categories').search(result)
+    if categories_block:
+        categories_xml = ''.join(
+            f'      <category id="{cat["id"]}">{cat["name"]}</category>\n' for cat in feed.categories
+        )
+        result = result.replace(categories_block.group(0), categories_xml)
+
+    # {{#offers}}...{{/offers}} - offers отдаются по одному
+    offers_block = _block_re('offers').search(result)
+    if not offers_block:
+        yield result
+        return
+    yield result[:offers_block.start()]
+    for product in feed.products:
+        yield _manual_offer(product, feed, currency)
+    yield result[offers_block.end():]
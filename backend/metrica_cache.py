@@ -0,0 +1,138 @@
+"""
+Кэш ответов Яндекс.Метрики для дашборда аналитики.
+
+Каждый просмотр ``/api/analytics/metrica`` и ``/api/analytics/campaigns``
+раньше делал полный запрос к API Метрики (limit=100000, accuracy=full), и
+одновременные зрители повторяли один и тот же медленный запрос. Теперь:
+
+- ответ хранится METRICA_CACHE_TTL секунд по ключу (счетчик, запрос,
+  период, цели, utm_term);
+- одинаковые запросы, пришедшие во время загрузки, ждут её результат
+  (single-flight), а не идут в Метрику сами;
+- устаревший ответ (до METRICA_CACHE_STALE_TTL) отдается сразу, а свежий
+  загружается в фоне (stale-while-revalidate).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+METRICA_CACHE_TTL = float(os.getenv("METRICA_CACHE_TTL", "300"))
+METRICA_CACHE_STALE_TTL = float(os.getenv("METRICA_CACHE_STALE_TTL", "3600"))
+METRICA_CACHE_MAX_ENTRIES = int(os.getenv("METRICA_CACHE_MAX_ENTRIES", "256"))
+# Сколько последних загрузок из Метрики помнит /api/analytics/history
+METRICA_HISTORY_SIZE = 100
+
+HIT = "HIT"
+MISS = "MISS"
+STALE = "STALE"
+
+
+class _Flight:
+    """Загрузка, выполняющаяся сейчас: остальные запросы ждут её результат"""
+
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class MetricaResponseCache:
+    """TTL-кэш с single-flight и stale-while-revalidate"""
+
+    def __init__(self, ttl: float = METRICA_CACHE_TTL, stale_ttl: float = METRICA_CACHE_STALE_TTL,
+                 max_entries: int = METRICA_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.stale_ttl = max(stale_ttl, ttl)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (значение, время загрузки)
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=METRICA_HISTORY_SIZE)
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "coalesced": 0, "fetches": 0, "errors": 0}
+
+    def get(self, key: Hashable, fetch: Callable[[], Any],
+            history: Optional[Dict[str, Any]] = None) -> Tuple[Any, str]:
+        """
+        Значение по ключу, при необходимости загруженное через fetch()
+
+        Args:
+            history: Описание запроса для истории загрузок (пишется только при
+                реальном обращении к Метрике, а не при каждом просмотре)
+
+        Returns:
+            (значение, HIT | MISS | STALE)
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                age = now - fetched_at
+                if age < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return value, HIT
+                if age < self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self.stats["stale"] += 1
+                    if key not in self._flights:
+                        flight = self._flights[key] = _Flight()
+                        threading.Thread(
+                            target=self._run_flight, args=(key, flight, fetch, history), daemon=True
+                        ).start()
+                    return value, STALE
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if leader:
+            self._run_flight(key, flight, fetch, history)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value, MISS
+
+    def _run_flight(self, key: Hashable, flight: _Flight, fetch: Callable[[], Any],
+                    history: Optional[Dict[str, Any]]):
+        try:
+            flight.value = fetch()
+        except BaseException as e:
+            flight.error = e
+        with self._lock:
+            self._flights.pop(key, None)
+            if flight.error is None:
+                self.stats["fetches"] += 1
+                self._entries[key] = (flight.value, time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                if history is not None:
+                    self._history.append({**history, "data": flight.value})
+            else:
+                # Устаревшее значение (если было) остается до конца stale-окна
+                self.stats["errors"] += 1
+        flight.done.set()
+
+    def history(self) -> List[Dict[str, Any]]:
+        """Последние загрузки из Метрики (старые первыми)"""
+        with self._lock:
+            return list(self._history)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Глобальный экземпляр
+metrica_cache = MetricaResponseCache()
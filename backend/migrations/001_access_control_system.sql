@@ -20,8 +20,8 @@ CREATE TABLE IF NOT EXISTS departments (
     FOREIGN KEY (parent_department_id) REFERENCES departments(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_departments_head ON departments(head_user_id);
-CREATE INDEX idx_departments_parent ON departments(parent_department_id);
+CREATE INDEX IF NOT EXISTS idx_departments_head ON departments(head_user_id);
+CREATE INDEX IF NOT EXISTS idx_departments_parent ON departments(parent_department_id);
 
 -- Таблица должностей
 CREATE TABLE IF NOT EXISTS positions (
@@ -40,8 +40,8 @@ CREATE TABLE IF NOT EXISTS positions (
     UNIQUE(name, department_id)
 );
 
-CREATE INDEX idx_positions_department ON positions(department_id);
-CREATE INDEX idx_positions_level ON positions(level);
+CREATE INDEX IF NOT EXISTS idx_positions_department ON positions(department_id);
+CREATE INDEX IF NOT EXISTS idx_positions_level ON positions(level);
 
 -- Обновление таблицы users для связи с отделами и должностями
 ALTER TABLE users ADD COLUMN IF NOT EXISTS department_id VARCHAR(255) REFERENCES departments(id) ON DELETE SET NULL;
@@ -69,8 +69,8 @@ CREATE TABLE IF NOT EXISTS calendar_lists (
     FOREIGN KEY (owner_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
-CREATE INDEX idx_calendar_lists_owner ON calendar_lists(owner_id);
-CREATE INDEX idx_calendar_lists_personal ON calendar_lists(is_personal);
+CREATE INDEX IF NOT EXISTS idx_calendar_lists_owner ON calendar_lists(owner_id);
+CREATE INDEX IF NOT EXISTS idx_calendar_lists_personal ON calendar_lists(is_personal);
 
 -- Права доступа к спискам календаря
 CREATE TABLE IF NOT EXISTS calendar_list_permissions (
@@ -88,9 +88,9 @@ CREATE TABLE IF NOT EXISTS calendar_list_permissions (
     CHECK ((user_id IS NOT NULL AND department_id IS NULL) OR (user_id IS NULL AND department_id IS NOT NULL))
 );
 
-CREATE INDEX idx_calendar_permissions_list ON calendar_list_permissions(list_id);
-CREATE INDEX idx_calendar_permissions_user ON calendar_list_permissions(user_id);
-CREATE INDEX idx_calendar_permissions_dept ON calendar_list_permissions(department_id);
+CREATE INDEX IF NOT EXISTS idx_calendar_permissions_list ON calendar_list_permissions(list_id);
+CREATE INDEX IF NOT EXISTS idx_calendar_permissions_user ON calendar_list_permissions(user_id);
+CREATE INDEX IF NOT EXISTS idx_calendar_permissions_dept ON calendar_list_permissions(department_id);
 
 -- Обновление таблицы events для связи со списками
 ALTER TABLE events ADD COLUMN IF NOT EXISTS calendar_list_id VARCHAR(255) REFERENCES calendar_lists(id) ON DELETE CASCADE;
@@ -118,10 +118,10 @@ CREATE TABLE IF NOT EXISTS task_permissions (
     CHECK ((task_id IS NOT NULL AND column_id IS NULL) OR (task_id IS NULL AND column_id IS NOT NULL))
 );
 
-CREATE INDEX idx_task_permissions_task ON task_permissions(task_id);
-CREATE INDEX idx_task_permissions_column ON task_permissions(column_id);
-CREATE INDEX idx_task_permissions_user ON task_permissions(user_id);
-CREATE INDEX idx_task_permissions_dept ON task_permissions(department_id);
+CREATE INDEX IF NOT EXISTS idx_task_permissions_task ON task_permissions(task_id);
+CREATE INDEX IF NOT EXISTS idx_task_permissions_column ON task_permissions(column_id);
+CREATE INDEX IF NOT EXISTS idx_task_permissions_user ON task_permissions(user_id);
+CREATE INDEX IF NOT EXISTS idx_task_permissions_dept ON task_permissions(department_id);
 
 -- ============================================================================
 -- ЧАСТЬ 4: ПРАВА ДОСТУПА К КОНТЕНТ-ПЛАНАМ
@@ -148,10 +148,10 @@ CREATE TABLE IF NOT EXISTS content_plan_permissions (
     )
 );
 
-CREATE INDEX idx_content_plan_permissions_plan ON content_plan_permissions(plan_id);
-CREATE INDEX idx_content_plan_permissions_user ON content_plan_permissions(user_id);
-CREATE INDEX idx_content_plan_permissions_dept ON content_plan_permissions(department_id);
-CREATE INDEX idx_content_plan_permissions_position ON content_plan_permissions(position_type);
+CREATE INDEX IF NOT EXISTS idx_content_plan_permissions_plan ON content_plan_permissions(plan_id);
+CREATE INDEX IF NOT EXISTS idx_content_plan_permissions_user ON content_plan_permissions(user_id);
+CREATE INDEX IF NOT EXISTS idx_content_plan_permissions_dept ON content_plan_permissions(department_id);
+CREATE INDEX IF NOT EXISTS idx_content_plan_permissions_position ON content_plan_permissions(position_type);
 
 -- ============================================================================
 -- ЧАСТЬ 5: БАЗА ССЫЛОК ПО ОТДЕЛАМ
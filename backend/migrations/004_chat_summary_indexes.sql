@@ -0,0 +1,11 @@
+-- Indexes for the single-query chat list (GET /api/chats)
+-- Migration: 004_chat_summary_indexes
+-- Created: 2026-10-18
+
+-- Last message / unread count per chat: index scan over live messages only
+CREATE INDEX IF NOT EXISTS idx_messages_chat_live_created
+    ON messages(chat_id, created_at, id)
+    WHERE is_deleted = false;
+
+-- Linked task lookup for task discussion chats
+CREATE INDEX IF NOT EXISTS idx_chats_todo_id ON chats(todo_id);
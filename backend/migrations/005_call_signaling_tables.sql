@@ -0,0 +1,31 @@
+-- Call signaling state for CALL_STATE_BACKEND=postgres
+-- Migration: 005_call_signaling_tables
+-- Created: 2026-10-18
+
+-- Signals, sessions and group calls live for seconds: UNLOGGED skips WAL,
+-- losing them on a crash only drops calls that are ringing right now.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS call_signal_queue (
+    id BIGSERIAL PRIMARY KEY,
+    to_user_id VARCHAR(255) NOT NULL,
+    scope VARCHAR(16) NOT NULL DEFAULT 'p2p',
+    signal JSONB NOT NULL,
+    created_at_ms BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_call_signal_queue_user ON call_signal_queue(to_user_id, id);
+CREATE INDEX IF NOT EXISTS idx_call_signal_queue_created ON call_signal_queue(created_at_ms);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS call_sessions (
+    session_key VARCHAR(512) PRIMARY KEY,
+    data JSONB NOT NULL,
+    last_activity_ms BIGINT NOT NULL
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS call_group_calls (
+    call_id VARCHAR(255) PRIMARY KEY,
+    chat_id VARCHAR(255),
+    data JSONB NOT NULL,
+    participant_count INTEGER NOT NULL DEFAULT 0,
+    started_at_ms BIGINT NOT NULL
+);
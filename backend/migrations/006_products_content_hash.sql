@@ -0,0 +1,7 @@
+-- Content hash for diff-based product sync
+-- Migration: 006_products_content_hash
+-- Created: 2026-10-18
+
+-- sync_products only rewrites rows whose parsed content changed.
+-- Existing rows start with NULL and are rewritten once on the next sync.
+ALTER TABLE products ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
@@ -0,0 +1,45 @@
+-- Direct Parser ads and search history (previously kept in the JSON database)
+-- Migration: 007_direct_parser_tables
+-- Created: 2026-10-18
+
+CREATE TABLE IF NOT EXISTS direct_ads (
+    id VARCHAR(255) PRIMARY KEY,
+    platform VARCHAR(100) NOT NULL DEFAULT '',
+    type VARCHAR(100) NOT NULL DEFAULT '',
+    query TEXT NOT NULL DEFAULT '',
+    title TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    url TEXT NOT NULL DEFAULT '',
+    display_url TEXT NOT NULL DEFAULT '',
+    domain VARCHAR(255) NOT NULL DEFAULT '',
+    position INTEGER,
+    is_premium BOOLEAN NOT NULL DEFAULT false,
+    sitelinks JSONB NOT NULL DEFAULT '[]',
+    extensions JSONB NOT NULL DEFAULT '{}',
+    extra JSONB NOT NULL DEFAULT '{}',
+    session_id VARCHAR(255),
+    task_id VARCHAR(255),
+    "timestamp" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- One row per ad URL: ingest is INSERT ... ON CONFLICT DO NOTHING
+CREATE UNIQUE INDEX IF NOT EXISTS idx_direct_ads_url ON direct_ads(url) WHERE url <> '';
+CREATE INDEX IF NOT EXISTS idx_direct_ads_timestamp ON direct_ads("timestamp" DESC);
+CREATE INDEX IF NOT EXISTS idx_direct_ads_query ON direct_ads(lower(query), "timestamp" DESC);
+CREATE INDEX IF NOT EXISTS idx_direct_ads_domain ON direct_ads(domain, "timestamp" DESC);
+CREATE INDEX IF NOT EXISTS idx_direct_ads_platform ON direct_ads(lower(platform), "timestamp" DESC);
+
+CREATE TABLE IF NOT EXISTS direct_searches (
+    id VARCHAR(255) PRIMARY KEY,
+    query TEXT NOT NULL UNIQUE,
+    pages_parsed INTEGER NOT NULL DEFAULT 0,
+    ads_found INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(50) NOT NULL DEFAULT 'completed',
+    search_count INTEGER NOT NULL DEFAULT 0,
+    results_count INTEGER NOT NULL DEFAULT 0,
+    last_searched TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_direct_searches_last_searched ON direct_searches(last_searched DESC);
@@ -0,0 +1,43 @@
+-- Durable task queue for remote Direct Parser agents
+-- Migration: 008_direct_parser_task_queue
+-- Created: 2026-10-18
+
+-- A task is split into one shard per query. Agents claim shards with
+-- FOR UPDATE SKIP LOCKED and hold them under a lease; heartbeats extend the
+-- lease, and a shard whose lease expired is handed to the next agent.
+
+CREATE TABLE IF NOT EXISTS direct_parser_tasks (
+    id VARCHAR(64) PRIMARY KEY,
+    queries JSONB NOT NULL DEFAULT '[]',
+    max_pages INTEGER NOT NULL DEFAULT 2,
+    headless BOOLEAN NOT NULL DEFAULT false,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS direct_parser_task_shards (
+    id VARCHAR(80) PRIMARY KEY,
+    task_id VARCHAR(64) NOT NULL REFERENCES direct_parser_tasks(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    query TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    agent_id VARCHAR(255),
+    lease_expires_at TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    progress INTEGER NOT NULL DEFAULT 0,
+    results_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_direct_parser_task_shards_task ON direct_parser_task_shards(task_id, position);
+-- Claim scans only claimable shards
+CREATE INDEX IF NOT EXISTS idx_direct_parser_task_shards_claim
+    ON direct_parser_task_shards(status, lease_expires_at, created_at)
+    WHERE status IN ('pending', 'leased');
+CREATE INDEX IF NOT EXISTS idx_direct_parser_task_shards_agent ON direct_parser_task_shards(agent_id) WHERE status = 'leased';
+
+CREATE TABLE IF NOT EXISTS direct_parser_agents (
+    agent_id VARCHAR(255) PRIMARY KEY,
+    last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,33 @@
+-- Per-user last activity for online indicators
+-- Migration: 009_user_presence
+-- Created: 2026-10-18
+
+-- Replaces the MAX(created_at) aggregate over all messages that every
+-- /api/users and /api/users/statuses request used to run. Each forward move
+-- of last_activity takes a new version, which drives ETags and since= deltas.
+
+CREATE SEQUENCE IF NOT EXISTS user_presence_version_seq;
+
+CREATE TABLE IF NOT EXISTS user_presence (
+    user_id VARCHAR(255) PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    last_activity TIMESTAMPTZ NOT NULL,
+    version BIGINT NOT NULL DEFAULT nextval('user_presence_version_seq')
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_presence_version ON user_presence(version);
+CREATE INDEX IF NOT EXISTS idx_user_presence_last_activity ON user_presence(last_activity);
+
+-- Backfill from message history and users.last_seen (stored as UTC)
+INSERT INTO user_presence (user_id, last_activity)
+SELECT author_id, MAX(created_at) AT TIME ZONE 'UTC'
+FROM messages
+WHERE author_id IS NOT NULL
+GROUP BY author_id
+ON CONFLICT (user_id) DO NOTHING;
+
+INSERT INTO user_presence (user_id, last_activity)
+SELECT id, last_seen AT TIME ZONE 'UTC'
+FROM users
+WHERE last_seen IS NOT NULL
+ON CONFLICT (user_id) DO UPDATE
+SET last_activity = GREATEST(user_presence.last_activity, EXCLUDED.last_activity);
@@ -0,0 +1,23 @@
+-- Daily Yandex Metrica statistics per UTM term
+-- Migration: 010_analytics_utm_daily
+-- Created: 2026-10-18
+
+-- Filled by POST /api/analytics/sync in bulk upserts keyed by (date, utm_term).
+-- product_id/feed_id are resolved at ingest time from the product id found in utm_term.
+
+CREATE TABLE IF NOT EXISTS analytics_utm_daily (
+    date DATE NOT NULL,
+    utm_term TEXT NOT NULL,
+    visits INTEGER NOT NULL DEFAULT 0,
+    users INTEGER NOT NULL DEFAULT 0,
+    pageviews INTEGER NOT NULL DEFAULT 0,
+    bounce_rate NUMERIC(6, 2) NOT NULL DEFAULT 0,
+    product_id VARCHAR(255),
+    feed_id VARCHAR(255),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (date, utm_term)
+);
+
+CREATE INDEX IF NOT EXISTS idx_analytics_utm_daily_product ON analytics_utm_daily(product_id, date) WHERE product_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_analytics_utm_daily_feed ON analytics_utm_daily(feed_id, date) WHERE feed_id IS NOT NULL;
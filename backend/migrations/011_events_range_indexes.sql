@@ -0,0 +1,17 @@
+-- Indexes for calendar range queries (GET /api/events, /api/calendar-events)
+-- Migration: 011_events_range_indexes
+-- Created: 2026-10-18
+
+-- Events and calendar events share the table and differ by metadata->>'entity'.
+-- Month views read one entity within a start_date window, newest first.
+CREATE INDEX IF NOT EXISTS idx_events_entity_start
+    ON events ((COALESCE(metadata->>'entity', 'event')), start_date DESC);
+
+-- Multi-day events that started before the window but end inside it
+CREATE INDEX IF NOT EXISTS idx_events_end_date ON events(end_date);
+
+-- Containment lookups: tag filter and participant visibility (@>)
+CREATE INDEX IF NOT EXISTS idx_events_tags
+    ON events USING GIN ((metadata->'tags') jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_events_participants
+    ON events USING GIN ((metadata->'participants') jsonb_path_ops);
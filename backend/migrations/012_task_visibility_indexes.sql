@@ -0,0 +1,22 @@
+-- Indexes for permission-aware task and todo list queries
+-- Migration: 012_task_visibility_indexes
+-- Created: 2026-10-18
+
+-- get_tasks / get_todo_lists pass the viewer (or the whole department of a
+-- department head) as array parameters: assigned_by_id = ANY(...),
+-- author_id = ANY(...), assigned_to = ANY(...), assigned_to_ids ?| ARRAY[...].
+-- Each branch is served by its own index and combined with a bitmap OR.
+
+-- jsonb_ops (not jsonb_path_ops): ? and ?| need key/element existence support
+CREATE INDEX IF NOT EXISTS idx_tasks_assigned_to_ids ON tasks USING GIN (assigned_to_ids);
+CREATE INDEX IF NOT EXISTS idx_tasks_assigned_by_id ON tasks(assigned_by_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_author_id ON tasks(author_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_assigned_to ON tasks(assigned_to);
+CREATE INDEX IF NOT EXISTS idx_tasks_list_id ON tasks(list_id);
+
+-- Department membership lookup for department heads
+CREATE INDEX IF NOT EXISTS idx_users_department ON users(department);
+
+-- Lists created by the viewer or their department
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS creator_id VARCHAR(255);
+CREATE INDEX IF NOT EXISTS idx_todo_lists_creator_id ON todo_lists(creator_id);
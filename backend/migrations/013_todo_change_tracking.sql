@@ -0,0 +1,65 @@
+-- Change tracking for the todo board (GET /api/todos?since=)
+-- Migration: 013_todo_change_tracking
+-- Created: 2026-10-18
+
+-- Every insert/update of a task, list or category takes the next value of
+-- todo_change_seq; deletes leave a tombstone with their own version. A client
+-- holding version N asks for rows and tombstones with version > N.
+-- Triggers keep this correct for every write path, not only the API helpers.
+
+CREATE SEQUENCE IF NOT EXISTS todo_change_seq;
+
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('todo_change_seq');
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('todo_change_seq');
+ALTER TABLE todo_categories ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('todo_change_seq');
+
+CREATE INDEX IF NOT EXISTS idx_tasks_version ON tasks(version);
+CREATE INDEX IF NOT EXISTS idx_todo_lists_version ON todo_lists(version);
+CREATE INDEX IF NOT EXISTS idx_todo_categories_version ON todo_categories(version);
+
+CREATE TABLE IF NOT EXISTS todo_tombstones (
+    kind VARCHAR(20) NOT NULL,          -- task | list | category
+    id VARCHAR(255) NOT NULL,
+    version BIGINT NOT NULL DEFAULT nextval('todo_change_seq'),
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_todo_tombstones_version ON todo_tombstones(version);
+
+CREATE OR REPLACE FUNCTION todo_bump_version() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.version := nextval('todo_change_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION todo_record_tombstone() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO todo_tombstones (kind, id) VALUES (TG_ARGV[0], OLD.id)
+    ON CONFLICT (kind, id) DO UPDATE
+    SET version = nextval('todo_change_seq'), deleted_at = CURRENT_TIMESTAMP;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tasks_bump_version ON tasks;
+CREATE TRIGGER tasks_bump_version BEFORE UPDATE ON tasks
+    FOR EACH ROW EXECUTE FUNCTION todo_bump_version();
+DROP TRIGGER IF EXISTS tasks_tombstone ON tasks;
+CREATE TRIGGER tasks_tombstone AFTER DELETE ON tasks
+    FOR EACH ROW EXECUTE FUNCTION todo_record_tombstone('task');
+
+DROP TRIGGER IF EXISTS todo_lists_bump_version ON todo_lists;
+CREATE TRIGGER todo_lists_bump_version BEFORE UPDATE ON todo_lists
+    FOR EACH ROW EXECUTE FUNCTION todo_bump_version();
+DROP TRIGGER IF EXISTS todo_lists_tombstone ON todo_lists;
+CREATE TRIGGER todo_lists_tombstone AFTER DELETE ON todo_lists
+    FOR EACH ROW EXECUTE FUNCTION todo_record_tombstone('list');
+
+DROP TRIGGER IF EXISTS todo_categories_bump_version ON todo_categories;
+CREATE TRIGGER todo_categories_bump_version BEFORE UPDATE ON todo_categories
+    FOR EACH ROW EXECUTE FUNCTION todo_bump_version();
+DROP TRIGGER IF EXISTS todo_categories_tombstone ON todo_categories;
+CREATE TRIGGER todo_categories_tombstone AFTER DELETE ON todo_categories
+    FOR EACH ROW EXECUTE FUNCTION todo_record_tombstone('category');
@@ -0,0 +1,41 @@
+-- Per-user chat read markers
+-- Migration: 014_chat_read_state
+-- Created: 2026-10-18
+
+-- Replaces chats.read_messages_by_user (one JSONB map rewritten on every
+-- message and mark-read). Each marker is its own row, moved forward with a
+-- single upsert, so concurrent readers of a group chat cannot overwrite each
+-- other. last_read_at/last_read_message_id compare directly with
+-- messages(created_at, id), so unread counts use idx_messages_chat_live_created.
+-- chats.read_messages_by_user is kept for older code but no longer written.
+
+CREATE TABLE IF NOT EXISTS chat_read_state (
+    chat_id VARCHAR(255) NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+    user_id VARCHAR(255) NOT NULL,
+    last_read_message_id VARCHAR(255),  -- NULL: read up to last_read_at
+    last_read_at TIMESTAMP NOT NULL,    -- created_at of the read message (UTC)
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_read_state_user ON chat_read_state(user_id);
+
+-- Backfill: message-id markers
+INSERT INTO chat_read_state (chat_id, user_id, last_read_message_id, last_read_at)
+SELECT c.id, r.key, m.id, m.created_at
+FROM chats c
+CROSS JOIN LATERAL jsonb_each_text(
+    CASE WHEN jsonb_typeof(c.read_messages_by_user) = 'object' THEN c.read_messages_by_user ELSE '{}'::jsonb END
+) AS r(key, value)
+JOIN messages m ON m.id = r.value AND m.chat_id = c.id
+ON CONFLICT (chat_id, user_id) DO NOTHING;
+
+-- Backfill: timestamp markers (ISO strings written by mark-read without a message id)
+INSERT INTO chat_read_state (chat_id, user_id, last_read_message_id, last_read_at)
+SELECT c.id, r.key, NULL, r.value::timestamptz AT TIME ZONE 'UTC'
+FROM chats c
+CROSS JOIN LATERAL jsonb_each_text(
+    CASE WHEN jsonb_typeof(c.read_messages_by_user) = 'object' THEN c.read_messages_by_user ELSE '{}'::jsonb END
+) AS r(key, value)
+WHERE r.value ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}[T ][0-9]{2}:[0-9]{2}'
+ON CONFLICT (chat_id, user_id) DO NOTHING;
@@ -0,0 +1,124 @@
+-- Columns and tables previously created at runtime or by one-off scripts
+-- Migration: 015_runtime_schema_baseline
+-- Created: 2026-10-18
+
+-- Collects the DDL that used to run on request paths
+-- (_ensure_chats_columns, the todo_lists ALTERs in add/update_todo_list,
+-- _ensure_shared_links_table) and in the ad-hoc add_*.sql / add_*.py /
+-- migrate_*_columns.py scripts. Applied once by schema_migrations.py;
+-- every statement is idempotent so databases patched by hand are fine.
+
+-- chats (was _ensure_chats_columns, add_chat_todo_id.sql)
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS pinned_by_user JSONB DEFAULT '{}'::jsonb;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS pinned_order_by_user JSONB DEFAULT '{}'::jsonb;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS archived_by_user JSONB DEFAULT '{}'::jsonb;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS discussion_status VARCHAR(50);
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS avatar TEXT;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS todo_id VARCHAR(255);
+CREATE INDEX IF NOT EXISTS idx_chats_todo_id ON chats(todo_id);
+
+-- todo_lists (was add_todo_list / update_todo_list, add_archived_column.sql)
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS creator_id VARCHAR(255);
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_executor_id VARCHAR(255);
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_customer_id VARCHAR(255);
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_add_to_calendar BOOLEAN DEFAULT FALSE;
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS stages_enabled BOOLEAN DEFAULT FALSE;
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS allowed_users TEXT[] DEFAULT ARRAY[]::TEXT[];
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS allowed_departments TEXT[] DEFAULT ARRAY[]::TEXT[];
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS archived BOOLEAN DEFAULT false;
+CREATE INDEX IF NOT EXISTS idx_todo_lists_archived ON todo_lists(archived);
+
+-- tasks (migrate_tasks_columns.py, add_assignee_response.py,
+-- add_task_status_review_column.sql)
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS list_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS assigned_to_ids JSONB DEFAULT '[]';
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS metadata JSONB DEFAULT '{}'::jsonb;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS category_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS archived BOOLEAN DEFAULT false;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS assignee_response TEXT;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS calendar_event_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS calendar_list_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS tags JSONB DEFAULT '[]';
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS is_completed BOOLEAN DEFAULT false;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS add_to_calendar BOOLEAN DEFAULT false;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS task_order INTEGER DEFAULT 0;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS author_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS assigned_by_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS assigned_to VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS review_comment TEXT;
+CREATE INDEX IF NOT EXISTS idx_tasks_list_id ON tasks(list_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_category_id ON tasks(category_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_archived ON tasks(archived);
+CREATE INDEX IF NOT EXISTS idx_tasks_is_completed ON tasks(is_completed);
+CREATE INDEX IF NOT EXISTS idx_tasks_author_id ON tasks(author_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_assigned_by_id ON tasks(assigned_by_id);
+
+-- users (add_columns.sql, migrations/add_department_head.sql,
+-- migrations/add_navigation_settings.sql)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_id VARCHAR(255);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_username VARCHAR(255);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS is_department_head BOOLEAN DEFAULT false;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT true;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS visible_tabs JSONB DEFAULT '{"messages": true, "tasks": true, "calendar": true, "contacts": true, "links": true}';
+ALTER TABLE users ADD COLUMN IF NOT EXISTS tools_order JSONB DEFAULT '[]';
+CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
+
+-- links (add_missing_tables.py)
+ALTER TABLE links ADD COLUMN IF NOT EXISTS department VARCHAR(255);
+
+-- messages (add_columns.sql)
+CREATE INDEX IF NOT EXISTS idx_messages_notif_type ON messages(chat_id, notification_type);
+CREATE INDEX IF NOT EXISTS idx_messages_call_metadata ON messages(chat_id, ((metadata->>'callId'))) WHERE notification_type = 'call';
+
+-- shared_links (was _ensure_shared_links_table, run_shared_links_migration.py;
+-- created_by has no FK, see fix_shared_links_constraint.sql)
+CREATE TABLE IF NOT EXISTS shared_links (
+    id VARCHAR(255) PRIMARY KEY,
+    token VARCHAR(255) UNIQUE NOT NULL,
+    resource_type VARCHAR(50) NOT NULL,
+    resource_id VARCHAR(255),
+    permission VARCHAR(50) NOT NULL DEFAULT 'viewer',
+    created_by VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP,
+    is_active BOOLEAN DEFAULT true,
+    metadata JSONB DEFAULT '{}'
+);
+
+CREATE INDEX IF NOT EXISTS idx_shared_links_token ON shared_links(token);
+CREATE INDEX IF NOT EXISTS idx_shared_links_resource ON shared_links(resource_type, resource_id);
+CREATE INDEX IF NOT EXISTS idx_shared_links_created_by ON shared_links(created_by);
+ALTER TABLE shared_links DROP CONSTRAINT IF EXISTS shared_links_created_by_fkey;
+
+-- direct_access (add_direct_access_table.sql)
+CREATE TABLE IF NOT EXISTS direct_access (
+    id VARCHAR(255) PRIMARY KEY,
+    resource_type VARCHAR(100) NOT NULL,
+    resource_id VARCHAR(255) NOT NULL,
+    user_ids TEXT[] DEFAULT '{}',
+    department_ids TEXT[] DEFAULT '{}',
+    permission VARCHAR(50) DEFAULT 'viewer',
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_direct_access_resource ON direct_access(resource_type, resource_id);
+CREATE INDEX IF NOT EXISTS idx_direct_access_user_ids ON direct_access USING GIN(user_ids);
+CREATE INDEX IF NOT EXISTS idx_direct_access_department_ids ON direct_access USING GIN(department_ids);
+
+-- calculator_history (migrations/add_calculator_history.sql)
+CREATE TABLE IF NOT EXISTS calculator_history (
+    user_id VARCHAR(255) PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    history JSONB DEFAULT '[]',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- telegram_auth_codes (migrations/add_telegram_auth_codes.sql)
+CREATE TABLE IF NOT EXISTS telegram_auth_codes (
+    code VARCHAR(50) PRIMARY KEY,
+    authenticated BOOLEAN DEFAULT FALSE,
+    user_data JSONB,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_telegram_auth_codes_created_at ON telegram_auth_codes(created_at);
@@ -0,0 +1,42 @@
+-- Commit-order-safe cursors for todo and presence deltas
+-- Migration: 016_commit_safe_change_cursors
+-- Created: 2026-10-18
+
+-- Sequence values are handed out at nextval(), not at commit: a transaction
+-- holding version 41 can commit after a reader has already returned 42 as
+-- its cursor, and "version > cursor" then skips that change for good.
+-- Each changed row now also records the id of the transaction that wrote it.
+-- The cursor is pg_snapshot_xmin(pg_current_snapshot()) read before the
+-- rows: every transaction below it has finished, so "change_xid >= cursor"
+-- includes everything that was still in flight. Rows from transactions that
+-- were already visible may be sent again; deltas are applied as upserts.
+
+CREATE OR REPLACE FUNCTION todo_bump_version() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.version := nextval('todo_change_seq');
+    NEW.change_xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION todo_record_tombstone() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO todo_tombstones (kind, id) VALUES (TG_ARGV[0], OLD.id)
+    ON CONFLICT (kind, id) DO UPDATE
+    SET version = nextval('todo_change_seq'), change_xid = pg_current_xact_id(),
+        deleted_at = CURRENT_TIMESTAMP;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE todo_categories ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE todo_tombstones ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE user_presence ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+
+CREATE INDEX IF NOT EXISTS idx_tasks_change_xid ON tasks(change_xid);
+CREATE INDEX IF NOT EXISTS idx_todo_lists_change_xid ON todo_lists(change_xid);
+CREATE INDEX IF NOT EXISTS idx_todo_categories_change_xid ON todo_categories(change_xid);
+CREATE INDEX IF NOT EXISTS idx_todo_tombstones_change_xid ON todo_tombstones(change_xid);
+CREATE INDEX IF NOT EXISTS idx_user_presence_change_xid ON user_presence(change_xid);
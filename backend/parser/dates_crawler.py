@@ -0,0 +1,211 @@
+"""
+Параллельный обход страниц туров для парсинга дат отправления
+
+- Ограничение параллельности (пул потоков) и частоты запросов на хост
+- Условные запросы (ETag / Last-Modified) с кэшем ответов на диске:
+  страницы, которые не менялись, не перепарсиваются и не пишутся в БД
+- Прогресс обхода отдаётся через callback
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+import requests
+
+from parser.tour_dates_parser import TourDatesParser
+
+DATES_CRAWL_CONCURRENCY = int(os.getenv('DATES_CRAWL_CONCURRENCY', '8'))
+DATES_CRAWL_HOST_RPS = float(os.getenv('DATES_CRAWL_HOST_RPS', '4'))
+DATES_CRAWL_CACHE_DIR = Path(os.getenv(
+    'DATES_CRAWL_CACHE_DIR',
+    str((Path(__file__).resolve().parent.parent.parent / 'runtime-data' / 'http-cache' / 'tour-dates').resolve())
+))
+
+# Статусы результата по одной странице
+CHANGED = 'changed'
+UNCHANGED = 'unchanged'
+EMPTY = 'empty'
+ERROR = 'error'
+SKIPPED = 'skipped'
+
+
+class HostRateLimiter:
+    """Не чаще ``rate`` запросов в секунду на один хост"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot: Dict[str, float] = {}
+
+    def wait(self, host: str):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ResponseCache:
+    """Кэш ответов на диске: валидаторы, хэш тела и разобранные даты"""
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, url: str) -> Path:
+        return self.cache_dir / (hashlib.sha1(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self._path(url).read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, url: str, entry: Dict[str, Any]):
+        path = self._path(url)
+        temp_path = path.with_suffix('.tmp')
+        temp_path.write_text(json.dumps(entry, ensure_ascii=False), encoding='utf-8')
+        temp_path.replace(path)
+
+
+class DatesCrawler:
+    """Параллельный краулер дат отправления туров"""
+
+    def __init__(
+        self,
+        concurrency: int = DATES_CRAWL_CONCURRENCY,
+        host_rps: float = DATES_CRAWL_HOST_RPS,
+        cache_dir: Path = DATES_CRAWL_CACHE_DIR
+    ):
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = HostRateLimiter(host_rps)
+        self.cache = ResponseCache(cache_dir)
+        self.parser = TourDatesParser()
+        self.logger = logging.getLogger(__name__)
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        """Отдельная сессия на поток (keep-alive без гонок)"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.parser.session.headers)
+            self._local.session = session
+        return session
+
+    def fetch_dates(self, product: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Загрузить и разобрать даты одного тура
+
+        Returns:
+            {'productId', 'url', 'status', 'dates', 'cacheEntry'}
+        """
+        url = product.get('url')
+        result = {'productId': product.get('id'), 'url': url, 'status': SKIPPED, 'dates': [], 'cacheEntry': None}
+        if not url:
+            return result
+
+        cached = self.cache.get(url)
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('lastModified'):
+                headers['If-Modified-Since'] = cached['lastModified']
+
+        try:
+            self.rate_limiter.wait(urlparse(url).netloc)
+            response = self._session().get(url, headers=headers, timeout=30)
+        except Exception as e:
+            self.logger.error(f"Ошибка загрузки {url}: {str(e)}")
+            result['status'] = ERROR
+            return result
+
+        if response.status_code == 304 and cached:
+            result.update(status=UNCHANGED, dates=cached.get('dates', []))
+            return result
+        if response.status_code != 200:
+            self.logger.error(f"Ошибка HTTP {response.status_code}: {url}")
+            result['status'] = ERROR
+            return result
+
+        body_hash = hashlib.sha256(response.content).hexdigest()
+        if cached and cached.get('bodyHash') == body_hash:
+            # Сервер без валидаторов, но страница та же
+            result.update(status=UNCHANGED, dates=cached.get('dates', []))
+            return result
+
+        dates = self.parser.parse_dates_html(response.text, url)
+        result.update(
+            status=CHANGED if dates else EMPTY,
+            dates=dates,
+            cacheEntry={
+                'etag': response.headers.get('ETag'),
+                'lastModified': response.headers.get('Last-Modified'),
+                'bodyHash': body_hash,
+                'dates': dates,
+                'fetchedAt': time.time(),
+            }
+        )
+        return result
+
+    def crawl(
+        self,
+        products: List[Dict[str, Any]],
+        on_progress: Optional[Callable[[int, int, Dict[str, int]], None]] = None,
+        should_stop: Optional[Callable[[], bool]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Обойти страницы туров параллельно
+
+        Args:
+            products: Товары (нужны id и url)
+            on_progress: callback(done, total, counts) после каждой страницы
+            should_stop: Проверка запроса на остановку
+
+        Returns:
+            Результаты fetch_dates по всем обработанным товарам
+        """
+        total = len(products)
+        counts = {CHANGED: 0, UNCHANGED: 0, EMPTY: 0, ERROR: 0, SKIPPED: 0}
+        results: List[Dict[str, Any]] = []
+        lock = threading.Lock()
+
+        def run(product: Dict[str, Any]):
+            if should_stop and should_stop():
+                return
+            result = self.fetch_dates(product)
+            with lock:
+                results.append(result)
+                counts[result['status']] += 1
+                done = len(results)
+                snapshot = dict(counts)
+            if on_progress:
+                on_progress(done, total, snapshot)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='dates-crawl') as executor:
+            for future in [executor.submit(run, product) for product in products]:
+                future.result()
+
+        return results
+
+    def commit_cache(self, results: List[Dict[str, Any]]):
+        """Сохранить кэш ответов (после успешной записи дат в БД)"""
+        for result in results:
+            if result.get('cacheEntry') and result.get('url'):
+                try:
+                    self.cache.put(result['url'], result['cacheEntry'])
+                except OSError as e:
+                    self.logger.warning(f"Не удалось записать кэш для {result['url']}: {str(e)}")
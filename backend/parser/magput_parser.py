@@ -2,6 +2,7 @@
 Парсер для Magput.ru
 Использует POST-запросы к API для получения списка туров
 """
+import asyncio
 import requests
 import logging
 from typing import List, Dict, Optional
@@ -84,63 +85,14 @@ class MagputParser:
         Returns:
             Список туров
         """
+        from parser.magput_pipeline import MagputIngestion
+        
         try:
             self.logger.info(f"Начало парсинга Magput (тип: {'однодневные' if sub_type == '10' else 'многодневные'})")
             
-            tours = []
-            page = 1
-            total_count = None
-            items_per_page = 30
-            
-            while True:
-                payload = self.get_default_payload(sub_type)
-                payload["CurrentPage"] = page
-                
-                self.logger.info(f"Запрос страницы {page}...")
-                
-                response = self.session.post(
-                    self.api_url,
-                    json=payload,
-                    timeout=60
-                )
-                
-                if response.status_code != 200:
-                    self.logger.error(f"Ошибка HTTP {response.status_code}")
-                    break
-                
-                data = response.json()
-                
-                if total_count is None:
-                    total_count = data.get("count", 0)
-                    items_per_page = data.get("itemsPerPage", 30)
-                    total_pages = (total_count + items_per_page - 1) // items_per_page
-                    self.logger.info(f"Всего туров: {total_count}, страниц: {total_pages}")
-                
-                programs = data.get("programs", [])
-                
-                if not programs:
-                    self.logger.info(f"Страница {page} пустая")
-                    break
-                
-                for program in programs:
-                    try:
-                        tour_data = self.parse_program(program, sub_type)
-                        if tour_data:
-                            tours.append(tour_data)
-                    except Exception as e:
-                        self.logger.error(f"Ошибка парсинга {program.get('id')}: {str(e)}")
-                        continue
-                
-                self.logger.info(f"Обработано {len(tours)}/{total_count} туров")
-                
-                # Проверка завершения
-                if max_pages and page >= max_pages:
-                    break
-                
-                if len(programs) < items_per_page or page >= total_pages:
-                    break
-                
-                page += 1
+            # Страницы загружаются параллельно асинхронным конвейером
+            ingestion = MagputIngestion(sub_type=sub_type, max_pages=max_pages)
+            tours = asyncio.run(ingestion.collect())
             
             self.logger.info(f"Парсинг завершен. Получено {len(tours)} туров")
             return tours
@@ -0,0 +1,243 @@
+"""
+Асинхронный конвейер загрузки туров Magput
+
+- Страницы поиска загружаются параллельно (не больше MAGPUT_FETCH_CONCURRENCY
+  запросов одновременно) с повторами при сетевых ошибках
+- Разобранные туры передаются писателю постранично, по мере загрузки,
+  а не одним списком в конце
+- Записанные страницы сохраняются в чекпоинт; после сбоя повторный запуск
+  досылает писателю уже готовые страницы из чекпоинта и загружает только
+  недостающие
+"""
+
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import aiohttp
+
+from parser.magput_parser import MagputParser
+
+MAGPUT_FETCH_CONCURRENCY = int(os.getenv('MAGPUT_FETCH_CONCURRENCY', '6'))
+MAGPUT_PAGE_RETRIES = int(os.getenv('MAGPUT_PAGE_RETRIES', '3'))
+MAGPUT_CHECKPOINT_MAX_AGE = int(os.getenv('MAGPUT_CHECKPOINT_MAX_AGE', str(6 * 3600)))
+MAGPUT_CHECKPOINT_DIR = Path(os.getenv(
+    'MAGPUT_CHECKPOINT_DIR',
+    str((Path(__file__).resolve().parent.parent.parent / 'runtime-data' / 'magput-ingest').resolve())
+))
+
+logger = logging.getLogger(__name__)
+
+
+class PageCheckpoint:
+    """Чекпоинт записанных страниц: meta.json + page_NNNN.json с сырыми программами"""
+
+    def __init__(self, key: str, base_dir: Path = MAGPUT_CHECKPOINT_DIR, max_age: int = MAGPUT_CHECKPOINT_MAX_AGE):
+        self.dir = base_dir / key
+        self.max_age = max_age
+
+    def open(self, sub_type: str, count: int, items_per_page: int) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Открыть чекпоинт для текущего прогона
+
+        Returns:
+            Сохраненные страницы {номер: программы}, если чекпоинт относится
+            к той же выборке и не устарел; иначе чекпоинт сбрасывается
+        """
+        meta = {'subType': sub_type, 'count': count, 'itemsPerPage': items_per_page}
+        try:
+            saved = json.loads((self.dir / 'meta.json').read_text(encoding='utf-8'))
+        except (FileNotFoundError, ValueError):
+            saved = None
+
+        if saved and all(saved.get(k) == v for k, v in meta.items()) \
+                and time.time() - saved.get('createdAt', 0) < self.max_age:
+            pages = {}
+            for path in self.dir.glob('page_*.json'):
+                try:
+                    pages[int(path.stem[5:])] = json.loads(path.read_text(encoding='utf-8'))
+                except (ValueError, OSError):
+                    continue
+            return pages
+
+        self.clear()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        (self.dir / 'meta.json').write_text(json.dumps({**meta, 'createdAt': time.time()}), encoding='utf-8')
+        return {}
+
+    def save_page(self, page: int, programs: List[Dict[str, Any]]):
+        path = self.dir / f'page_{page:04d}.json'
+        temp_path = path.with_suffix('.tmp')
+        temp_path.write_text(json.dumps(programs, ensure_ascii=False), encoding='utf-8')
+        temp_path.replace(path)
+
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class MagputIngestion:
+    """Параллельная загрузка выдачи Magput с постраничной передачей писателю"""
+
+    def __init__(
+        self,
+        sub_type: str = "11",
+        concurrency: int = MAGPUT_FETCH_CONCURRENCY,
+        checkpoint_key: Optional[str] = None,
+        max_pages: Optional[int] = None
+    ):
+        self.sub_type = sub_type
+        self.concurrency = max(1, concurrency)
+        self.max_pages = max_pages
+        self.parser = MagputParser()
+        self.checkpoint = PageCheckpoint(checkpoint_key) if checkpoint_key else None
+
+    def _headers(self) -> Dict[str, str]:
+        headers = dict(self.parser.session.headers)
+        # brotli/zstd в aiohttp без доп. пакетов не распаковываются
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        return headers
+
+    async def _fetch_page(self, session: aiohttp.ClientSession, page: int) -> Dict[str, Any]:
+        """Загрузить одну страницу выдачи с повторами"""
+        payload = self.parser.get_default_payload(self.sub_type)
+        payload["CurrentPage"] = page
+
+        for attempt in range(1, MAGPUT_PAGE_RETRIES + 1):
+            try:
+                async with session.post(self.parser.api_url, json=payload) as response:
+                    if response.status == 200:
+                        return await response.json(content_type=None)
+                    error = f"HTTP {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            logger.warning(f"Страница {page}: попытка {attempt}/{MAGPUT_PAGE_RETRIES} неудачна ({error})")
+            if attempt < MAGPUT_PAGE_RETRIES:
+                await asyncio.sleep(2 ** attempt)
+
+        raise Exception(f"Не удалось загрузить страницу {page} Magput: {error}")
+
+    def _parse_programs(self, programs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        tours = []
+        for program in programs:
+            tour = self.parser.parse_program(program, self.sub_type)
+            if tour:
+                tours.append(tour)
+        return tours
+
+    async def run(
+        self,
+        on_page: Callable[[int, List[Dict[str, Any]]], None],
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+        should_stop: Optional[Callable[[], bool]] = None
+    ) -> Dict[str, Any]:
+        """
+        Загрузить все страницы и передать туры писателю
+
+        Args:
+            on_page: Писатель, вызывается в отдельном потоке строго по одной
+                странице за раз: on_page(номер_страницы, туры)
+            on_progress: callback(stats) после каждой записанной страницы
+            should_stop: Проверка запроса на остановку
+
+        Returns:
+            {'count', 'pages', 'pagesWritten', 'pagesResumed', 'tours', 'stopped'}
+        """
+        stats = {'count': 0, 'pages': 0, 'pagesWritten': 0, 'pagesResumed': 0, 'tours': 0, 'stopped': False}
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        def deliver(page: int, programs: List[Dict[str, Any]], resumed: bool):
+            tours = self._parse_programs(programs)
+            on_page(page, tours)
+            if self.checkpoint and not resumed:
+                self.checkpoint.save_page(page, programs)
+            return len(tours)
+
+        async def writer():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                page, programs, resumed = item
+                stats['tours'] += await asyncio.to_thread(deliver, page, programs, resumed)
+                stats['pagesWritten'] += 1
+                if resumed:
+                    stats['pagesResumed'] += 1
+                if on_progress:
+                    on_progress(dict(stats))
+
+        timeout = aiohttp.ClientTimeout(total=60)
+        async with aiohttp.ClientSession(headers=self._headers(), timeout=timeout) as session:
+            first = await self._fetch_page(session, 1)
+            count = first.get("count", 0)
+            items_per_page = first.get("itemsPerPage") or 30
+            total_pages = max(1, (count + items_per_page - 1) // items_per_page)
+            if self.max_pages:
+                total_pages = min(total_pages, self.max_pages)
+            stats.update(count=count, pages=total_pages)
+            logger.info(f"Magput SubType {self.sub_type}: туров {count}, страниц {total_pages}")
+
+            saved = await asyncio.to_thread(self.checkpoint.open, self.sub_type, count, items_per_page) \
+                if self.checkpoint else {}
+            if saved:
+                logger.info(f"Продолжение с чекпоинта: готово страниц {len(saved)}/{total_pages}")
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def fetch(page: int):
+                async with semaphore:
+                    if should_stop and should_stop():
+                        stats['stopped'] = True
+                        return
+                    data = await self._fetch_page(session, page)
+                await queue.put((page, data.get("programs", []), False))
+
+            async def produce():
+                await queue.put((1, first.get("programs", []), False))
+                for page in sorted(saved):
+                    if 1 < page <= total_pages:
+                        await queue.put((page, saved[page], True))
+                tasks = [
+                    asyncio.create_task(fetch(page))
+                    for page in range(2, total_pages + 1) if page not in saved
+                ]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+
+            writer_task = asyncio.create_task(writer())
+            producer_task = asyncio.create_task(produce())
+            await asyncio.wait({writer_task, producer_task}, return_when=asyncio.FIRST_COMPLETED)
+
+            if writer_task.done():
+                # Писатель завершается только с ошибкой: дальнейшая загрузка бессмысленна
+                producer_task.cancel()
+                await asyncio.gather(producer_task, return_exceptions=True)
+                writer_task.result()
+
+            # Дописываем уже загруженные страницы (они попадут в чекпоинт), затем
+            # пробрасываем ошибку загрузки, если она была
+            await queue.put(None)
+            await writer_task
+            producer_task.result()
+
+        if self.checkpoint and not stats['stopped']:
+            await asyncio.to_thread(self.checkpoint.clear)
+        logger.info(
+            f"Magput SubType {self.sub_type}: записано страниц {stats['pagesWritten']} "
+            f"(из чекпоинта {stats['pagesResumed']}), туров {stats['tours']}"
+        )
+        return stats
+
+    async def collect(self) -> List[Dict[str, Any]]:
+        """Загрузить все туры в список (без писателя)"""
+        pages: Dict[int, List[Dict[str, Any]]] = {}
+        await self.run(lambda page, tours: pages.__setitem__(page, tours))
+        return [tour for page in sorted(pages) for tour in pages[page]]
@@ -51,7 +51,25 @@ class TourDatesParser:
                 self.logger.error(f"Ошибка HTTP {response.status_code}")
                 return []
             
-            soup = BeautifulSoup(response.text, 'lxml')
+            return self.parse_dates_html(response.text, tour_url)
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка парсинга дат тура: {str(e)}", exc_info=True)
+            return []
+    
+    def parse_dates_html(self, html: str, tour_url: str = '') -> List[Dict]:
+        """
+        Извлекает даты отправления из HTML страницы тура
+        
+        Args:
+            html: HTML страницы тура
+            tour_url: URL страницы (для отладочного файла)
+        
+        Returns:
+            Список дат в формате parse_tour_dates
+        """
+        try:
+            soup = BeautifulSoup(html, 'lxml')
             dates = []
             
             # Ищем список с датами: <ul class="dates-rows">
@@ -68,7 +86,7 @@ class TourDatesParser:
                 tour_id = tour_url.split('=')[-1] if '=' in tour_url else 'unknown'
                 debug_file = f"debug_dates_{tour_id}.html"
                 with open(debug_file, 'w', encoding='utf-8') as f:
-                    f.write(response.text)
+                    f.write(html)
                 self.logger.info(f"HTML сохранен в {debug_file} для анализа")
                 return []
             
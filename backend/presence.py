@@ -0,0 +1,123 @@
+"""
+Присутствие пользователей (онлайн-индикаторы).
+
+Раньше каждый запрос ``/api/users`` и ``/api/users/statuses`` считал
+``MAX(created_at)`` по всей таблице ``messages``, и стоимость опроса росла
+вместе с историей сообщений. Теперь последняя активность хранится в таблице
+``user_presence`` (строка на пользователя) и обновляется при отправке
+сообщения и ``POST /api/users/{id}/status``.
+
+Каждое продвижение активности записывает id своей транзакции (change_xid).
+Курсор ``x<xmin снимка>.<время сервера, мс>`` позволяет отдавать только
+изменения: строки, записанные транзакциями не старше курсора, плюс
+пользователей, которые с тех пор ушли в оффлайн по таймауту. Номер из
+последовательности для курсора не годится: он выдается до COMMIT, и поздно
+закоммиченное изменение с меньшим номером было бы пропущено.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+# Порог "онлайн" для /api/users/statuses, сек
+PRESENCE_ONLINE_SECONDS = 180
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def make_cursor(xmin: int, at: datetime) -> str:
+    return f"x{xmin}.{int(at.timestamp() * 1000)}"
+
+
+def parse_cursor(cursor: Optional[str]) -> Optional[Tuple[int, datetime]]:
+    """Курсор из ``make_cursor``; None, если он не задан, поврежден или старого формата"""
+    if not cursor or not cursor.startswith("x"):
+        return None
+    try:
+        xmin, millis = cursor[1:].split(".", 1)
+        return int(xmin), datetime.fromtimestamp(int(millis) / 1000, tz=timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        return None
+
+
+class PresenceStore:
+    """Последняя активность пользователей в таблице user_presence"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def touch(self, user_id: str, at: datetime) -> bool:
+        """Продвинуть активность пользователя; время назад не откатывается"""
+        if not user_id or at is None:
+            return False
+        return self.conn.execute_query("""
+            INSERT INTO user_presence (user_id, last_activity) VALUES (%s, %s)
+            ON CONFLICT (user_id) DO UPDATE
+            SET last_activity = EXCLUDED.last_activity,
+                version = nextval('user_presence_version_seq'),
+                change_xid = pg_current_xact_id()
+            WHERE user_presence.last_activity < EXCLUDED.last_activity
+        """, (str(user_id), _utc(at)))
+
+    def activity_map(self) -> Dict[str, datetime]:
+        """{user_id: последняя активность} - O(пользователей)"""
+        rows = self.conn.fetch_all("SELECT user_id, last_activity FROM user_presence")
+        return {str(row["user_id"]): _utc(row["last_activity"]) for row in rows or []}
+
+    def last_activity(self, user_id: str) -> Optional[datetime]:
+        row = self.conn.fetch_one(
+            "SELECT last_activity FROM user_presence WHERE user_id = %s", (str(user_id),)
+        )
+        return _utc(row["last_activity"]) if row else None
+
+    def statuses(self, since: Optional[str] = None,
+                 online_seconds: int = PRESENCE_ONLINE_SECONDS) -> Tuple[List[Dict[str, Any]], str]:
+        """
+        Статусы пользователей
+
+        Args:
+            since: Курсор прошлого ответа - вернуть только изменения
+
+        Returns:
+            ([{id, isOnline, lastSeen}], курсор для следующего запроса)
+        """
+        now = datetime.now(timezone.utc)
+        threshold = timedelta(seconds=online_seconds)
+        # Курсор читается до строк: все транзакции ниже xmin уже завершены
+        state = self.conn.fetch_one(
+            "SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS xmin"
+        )
+        cursor = make_cursor(int(state["xmin"]) if state else 0, now)
+
+        parsed = parse_cursor(since)
+        if parsed is None:
+            rows = self.conn.fetch_all("""
+                SELECT u.id, p.last_activity, u.last_seen
+                FROM users u
+                LEFT JOIN user_presence p ON p.user_id = u.id
+            """)
+        else:
+            since_xmin, since_at = parsed
+            # Изменившие активность + те, кто с прошлого запроса ушел в оффлайн
+            rows = self.conn.fetch_all("""
+                SELECT u.id, p.last_activity, u.last_seen
+                FROM user_presence p
+                JOIN users u ON u.id = p.user_id
+                WHERE p.change_xid >= %s::text::xid8
+                   OR (p.last_activity > %s AND p.last_activity <= %s)
+            """, (since_xmin, since_at - threshold, now - threshold))
+
+        statuses = []
+        for row in rows or []:
+            candidates = [dt for dt in (_utc(row.get("last_activity")), _utc(row.get("last_seen"))) if dt]
+            last_seen = max(candidates) if candidates else None
+            statuses.append({
+                "id": row["id"],
+                "isOnline": bool(last_seen and now - last_seen < threshold),
+                "lastSeen": last_seen.isoformat() if last_seen else None,
+            })
+        return statuses, cursor
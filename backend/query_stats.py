@@ -0,0 +1,393 @@
+"""
+Статистика SQL-запросов PostgreSQL: где тратится время запроса к API.
+
+PostgresConnection сообщает сюда о каждом fetch_all/fetch_one/execute_query/
+execute_batch, а middleware log_requests открывает область одного HTTP-запроса:
+
+- запросы группируются по отпечатку SQL (литералы и параметры заменены на ?,
+  списки ``IN (?, ?, ...)`` и многострочные VALUES свернуты), для каждого
+  отпечатка - число вызовов, ошибок и гистограмма длительности;
+- для каждого маршрута (``GET /api/chats``) - число запросов к API,
+  гистограмма числа SQL-запросов на один запрос к API и время в БД;
+- отпечаток, выполненный в одном запросе к API DB_REPEATED_QUERY_THRESHOLD
+  раз и больше, отмечается у маршрута как повторяющийся (признак N+1);
+- запросы дольше DB_SLOW_QUERY_MS и ошибки попадают в журнал последних
+  записей; параметры сохраняются для доли DB_SLOW_QUERY_PARAM_SAMPLE из них
+  (по умолчанию 0), а у запросов с паролями и токенами всегда скрываются.
+
+Данные отдает GET /api/database/queries (JSON или формат Prometheus).
+"""
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+DB_QUERY_STATS = os.getenv("DB_QUERY_STATS", "true").strip().lower() in ("1", "true", "yes")
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+DB_SLOW_QUERY_LOG_SIZE = int(os.getenv("DB_SLOW_QUERY_LOG_SIZE", "200"))
+DB_SLOW_QUERY_PARAM_SAMPLE = float(os.getenv("DB_SLOW_QUERY_PARAM_SAMPLE", "0"))
+DB_REPEATED_QUERY_THRESHOLD = int(os.getenv("DB_REPEATED_QUERY_THRESHOLD", "10"))
+DB_QUERY_STATS_MAX_FINGERPRINTS = int(os.getenv("DB_QUERY_STATS_MAX_FINGERPRINTS", "500"))
+
+# Границы корзин гистограмм: длительность SQL-запроса (сек) и число SQL-запросов на запрос к API
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Отпечаток для запросов сверх DB_QUERY_STATS_MAX_FINGERPRINTS
+OTHER_FINGERPRINT = "<other>"
+# Маршрут запросов к API, не совпавших ни с одним обработчиком
+UNMATCHED_ROUTE = "<unmatched>"
+REDACTED = "<redacted>"
+SQL_PREVIEW_LENGTH = 300
+PARAM_PREVIEW_LENGTH = 100
+MAX_SAMPLED_PARAMS = 20
+ERROR_LOG_SIZE = 100
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%(?:\(\w+\))?s")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_ROWS = re.compile(r"(\(\s*\?\+?\s*\))(?:\s*,\s*\(\s*\?\+?\s*\))+")
+_SPACES = re.compile(r"\s+")
+# Параметры таких запросов не попадают в журнал
+_SENSITIVE = re.compile(r"password|passwd|token|secret|auth_code|api_key", re.I)
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(sql: str) -> str:
+    """SQL без литералов, параметров и лишних пробелов (одинаков для всех вызовов запроса)"""
+    text = _COMMENT.sub(" ", sql)
+    text = _STRING.sub("?", text)
+    text = _PLACEHOLDER.sub("?", text)
+    text = _NUMBER.sub("?", text)
+    text = _PLACEHOLDER_LIST.sub("(?+)", text)
+    text = _VALUES_ROWS.sub(r"\1, ...", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def query_id(fp: str) -> str:
+    return hashlib.sha1(fp.encode("utf-8")).hexdigest()[:12]
+
+
+class _Histogram:
+    __slots__ = ("bounds", "buckets", "count", "total", "max")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        # Последняя корзина - +Inf
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль q (оценка)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(le, накопленное число) для формата Prometheus"""
+        result = []
+        seen = 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            le = f"{self.bounds[index]:g}" if index < len(self.bounds) else "+Inf"
+            result.append((le, seen))
+        return result
+
+
+class _QueryEntry:
+    __slots__ = ("fingerprint", "id", "duration", "errors")
+
+    def __init__(self, fp: str):
+        self.fingerprint = fp
+        self.id = query_id(fp)
+        self.duration = _Histogram(DURATION_BUCKETS)
+        self.errors = 0
+
+
+class _RouteEntry:
+    __slots__ = ("route", "queries", "db_time", "repeated")
+
+    def __init__(self, route: str):
+        self.route = route
+        self.queries = _Histogram(QUERY_COUNT_BUCKETS)
+        self.db_time = _Histogram(DURATION_BUCKETS)
+        # отпечаток -> наибольшее число повторов в одном запросе к API
+        self.repeated: Dict[str, int] = {}
+
+
+class RequestQueries:
+    """SQL-запросы одного запроса к API"""
+
+    __slots__ = ("route", "count", "db_time", "by_fingerprint")
+
+    def __init__(self, route: str = UNMATCHED_ROUTE):
+        self.route = route
+        self.count = 0
+        self.db_time = 0.0
+        self.by_fingerprint: Dict[str, int] = {}
+
+
+_current_request: ContextVar[Optional[RequestQueries]] = ContextVar("db_request_queries", default=None)
+
+
+class QueryStats:
+    """Гистограммы по отпечаткам SQL и маршрутам, журнал медленных запросов и ошибок"""
+
+    def __init__(self, enabled: bool = DB_QUERY_STATS, slow_ms: float = DB_SLOW_QUERY_MS,
+                 slow_log_size: int = DB_SLOW_QUERY_LOG_SIZE, param_sample: float = DB_SLOW_QUERY_PARAM_SAMPLE,
+                 repeated_threshold: int = DB_REPEATED_QUERY_THRESHOLD,
+                 max_fingerprints: int = DB_QUERY_STATS_MAX_FINGERPRINTS):
+        self.enabled = enabled
+        self.slow_seconds = slow_ms / 1000.0
+        self.param_sample = param_sample
+        self.repeated_threshold = max(2, repeated_threshold)
+        self.max_fingerprints = max_fingerprints
+        self._lock = threading.Lock()
+        self._queries: Dict[str, _QueryEntry] = {}
+        self._routes: Dict[str, _RouteEntry] = {}
+        self._slow: Deque[Dict[str, Any]] = deque(maxlen=slow_log_size)
+        self._errors: Deque[Dict[str, Any]] = deque(maxlen=ERROR_LOG_SIZE)
+        self._started_at = time.time()
+
+    # ---------- Сбор ----------
+
+    def record(self, sql: str, params: Any, duration: float, error: Optional[BaseException] = None):
+        """Учесть выполненный SQL-запрос (вызывается из PostgresConnection)"""
+        if not self.enabled:
+            return
+        fp = fingerprint(sql)
+        request = _current_request.get()
+        if request is not None:
+            request.count += 1
+            request.db_time += duration
+            request.by_fingerprint[fp] = request.by_fingerprint.get(fp, 0) + 1
+
+        slow = duration >= self.slow_seconds
+        with self._lock:
+            entry = self._queries.get(fp)
+            if entry is None:
+                if len(self._queries) >= self.max_fingerprints:
+                    fp = OTHER_FINGERPRINT
+                entry = self._queries.get(fp)
+                if entry is None:
+                    entry = self._queries[fp] = _QueryEntry(fp)
+            entry.duration.observe(duration)
+            if error is not None:
+                entry.errors += 1
+            if slow or error is not None:
+                record = {
+                    "at": datetime.now(timezone.utc).isoformat(),
+                    "queryId": entry.id,
+                    "query": fp[:SQL_PREVIEW_LENGTH],
+                    "durationMs": round(duration * 1000, 2),
+                    "route": request.route if request is not None else None,
+                    "params": self._sample_params(fp, params),
+                    **_error_fields(fp, error),
+                }
+                (self._errors if error is not None else self._slow).append(record)
+
+        if slow:
+            where = f" [{request.route}]" if request is not None else ""
+            print(f"🐢 Slow query {duration * 1000:.1f} ms{where}: {fp[:200]}")
+
+    def _sample_params(self, fp: str, params: Any) -> Optional[List[str]]:
+        if not params or self.param_sample <= 0 or random.random() >= self.param_sample:
+            return None
+        if isinstance(params, dict):
+            params = list(params.values())
+        params = list(params)[:MAX_SAMPLED_PARAMS]
+        if _SENSITIVE.search(fp):
+            return [REDACTED] * len(params)
+        return [repr(getattr(value, "obj", value))[:PARAM_PREVIEW_LENGTH] for value in params]
+
+    @contextmanager
+    def request_scope(self, route: str = UNMATCHED_ROUTE):
+        """Область одного запроса к API: считает его SQL-запросы и время в БД.
+
+        Маршрут можно уточнить после роутинга (``scope.route = ...``), он
+        читается при выходе из области.
+        """
+        request = RequestQueries(route)
+        token = _current_request.set(request)
+        try:
+            yield request
+        finally:
+            _current_request.reset(token)
+            if self.enabled and request.count:
+                self._finish_request(request)
+
+    def _finish_request(self, request: RequestQueries):
+        repeated = [(fp, count) for fp, count in request.by_fingerprint.items()
+                    if count >= self.repeated_threshold]
+        new_repeated = []
+        with self._lock:
+            route = self._routes.get(request.route)
+            if route is None:
+                route = self._routes[request.route] = _RouteEntry(request.route)
+            route.queries.observe(request.count)
+            route.db_time.observe(request.db_time)
+            for fp, count in repeated:
+                previous = route.repeated.get(fp)
+                if previous is None:
+                    new_repeated.append((fp, count))
+                if previous is None or count > previous:
+                    route.repeated[fp] = count
+        for fp, count in new_repeated:
+            print(f"⚠️ {request.route}: запрос выполнен {count} раз за один вызов (N+1?): {fp[:200]}")
+
+    def current_request(self) -> Optional[RequestQueries]:
+        return _current_request.get()
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self._routes.clear()
+            self._slow.clear()
+            self._errors.clear()
+            self._started_at = time.time()
+
+    # ---------- Выдача ----------
+
+    def snapshot(self, limit: int = 50, include_params: bool = False) -> Dict[str, Any]:
+        """Самые затратные отпечатки и маршруты, журнал медленных запросов и ошибок
+
+        Args:
+            include_params: Отдавать сохраненные параметры и полный текст
+                ошибок (только администратору)
+        """
+        with self._lock:
+            queries = sorted(self._queries.values(), key=lambda e: e.duration.total, reverse=True)[:limit]
+            routes = sorted(self._routes.values(), key=lambda r: r.db_time.total, reverse=True)[:limit]
+            return {
+                "enabled": self.enabled,
+                "since": datetime.fromtimestamp(self._started_at, timezone.utc).isoformat(),
+                "slowQueryMs": self.slow_seconds * 1000,
+                "repeatedQueryThreshold": self.repeated_threshold,
+                "queries": [
+                    {
+                        "queryId": e.id,
+                        "query": e.fingerprint[:SQL_PREVIEW_LENGTH],
+                        "calls": e.duration.count,
+                        "errors": e.errors,
+                        "totalMs": round(e.duration.total * 1000, 2),
+                        "meanMs": round(e.duration.total / e.duration.count * 1000, 2) if e.duration.count else 0,
+                        "p95Ms": round(e.duration.quantile(0.95) * 1000, 2),
+                        "maxMs": round(e.duration.max * 1000, 2),
+                    }
+                    for e in queries
+                ],
+                "routes": [
+                    {
+                        "route": r.route,
+                        "requests": r.queries.count,
+                        "queriesPerRequest": round(r.queries.total / r.queries.count, 2) if r.queries.count else 0,
+                        "maxQueriesPerRequest": int(r.queries.max),
+                        "dbMsPerRequest": round(r.db_time.total / r.queries.count * 1000, 2) if r.queries.count else 0,
+                        "p95DbMs": round(r.db_time.quantile(0.95) * 1000, 2),
+                        "repeatedQueries": [
+                            {"queryId": query_id(fp), "query": fp[:SQL_PREVIEW_LENGTH], "maxPerRequest": count}
+                            for fp, count in sorted(r.repeated.items(), key=lambda item: item[1], reverse=True)
+                        ],
+                    }
+                    for r in routes
+                ],
+                "slowQueries": [_log_entry(r, include_params) for r in reversed(self._slow)][:limit],
+                "errors": [_log_entry(r, include_params) for r in reversed(self._errors)][:limit],
+            }
+
+    def prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        lines = [
+            "# HELP db_query_duration_seconds SQL query duration by normalized query",
+            "# TYPE db_query_duration_seconds histogram",
+        ]
+        with self._lock:
+            queries = list(self._queries.values())
+            routes = list(self._routes.values())
+            for e in queries:
+                labels = f'query_id="{e.id}",query="{_label(e.fingerprint[:120])}"'
+                for le, count in e.duration.cumulative():
+                    lines.append(f'db_query_duration_seconds_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f"db_query_duration_seconds_sum{{{labels}}} {e.duration.total:.6f}")
+                lines.append(f"db_query_duration_seconds_count{{{labels}}} {e.duration.count}")
+
+            lines.append("# HELP db_query_errors_total Failed SQL queries by normalized query")
+            lines.append("# TYPE db_query_errors_total counter")
+            for e in queries:
+                lines.append(f'db_query_errors_total{{query_id="{e.id}"}} {e.errors}')
+
+            lines.append("# HELP db_request_queries SQL queries per API request")
+            lines.append("# TYPE db_request_queries histogram")
+            for r in routes:
+                labels = f'route="{_label(r.route)}"'
+                for le, count in r.queries.cumulative():
+                    lines.append(f'db_request_queries_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f"db_request_queries_sum{{{labels}}} {int(r.queries.total)}")
+                lines.append(f"db_request_queries_count{{{labels}}} {r.queries.count}")
+
+            lines.append("# HELP db_request_duration_seconds Time spent in SQL per API request")
+            lines.append("# TYPE db_request_duration_seconds histogram")
+            for r in routes:
+                labels = f'route="{_label(r.route)}"'
+                for le, count in r.db_time.cumulative():
+                    lines.append(f'db_request_duration_seconds_bucket{{{labels},le="{le}"}} {count}')
+                lines.append(f"db_request_duration_seconds_sum{{{labels}}} {r.db_time.total:.6f}")
+                lines.append(f"db_request_duration_seconds_count{{{labels}}} {r.db_time.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _error_fields(fp: str, error: Optional[BaseException]) -> Dict[str, Any]:
+    """SQLSTATE и первая строка ошибки; полный текст (DETAIL: Key (email)=(...)
+    содержит значения строки) - отдельно, только для администратора"""
+    if error is None:
+        return {"error": None, "sqlstate": None, "errorDetail": None}
+    text = str(error).strip()
+    return {
+        "error": text.split("\n", 1)[0][:SQL_PREVIEW_LENGTH],
+        "sqlstate": getattr(error, "sqlstate", None),
+        "errorDetail": REDACTED if _SENSITIVE.search(fp) else text,
+    }
+
+
+def _log_entry(record: Dict[str, Any], include_params: bool) -> Dict[str, Any]:
+    if include_params:
+        return record
+    if record.get("params") is None and record.get("errorDetail") is None:
+        return record
+    return {**record, "params": None, "errorDetail": None}
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+# Глобальный экземпляр
+query_stats = QueryStats()
@@ -0,0 +1,275 @@
+"""
+Realtime-шлюз: push-доставка событий (сообщения, прочтения, присутствие)
+подписчикам по SSE вместо постоянного опроса API.
+
+Обработчики публикуют события через ``realtime_bus.publish(...)``. Каждое
+событие адресовано списку пользователей (или всем, если список не задан).
+Шина хранит кольцевой буфер последних событий, чтобы переподключившийся
+клиент мог продолжить с ``Last-Event-ID``.
+
+Fan-out между процессами подключаемый:
+- ``local``    - доставка внутри одного процесса (один воркер uvicorn)
+- ``postgres`` - через LISTEN/NOTIFY, чтобы события видели все воркеры
+
+Выбирается переменной окружения ``REALTIME_FANOUT``.
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set
+
+REALTIME_BUFFER_SIZE = int(os.getenv("REALTIME_BUFFER_SIZE", "2000"))
+REALTIME_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "256"))
+REALTIME_NOTIFY_CHANNEL = "shar_realtime"
+# NOTIFY ограничивает payload 8000 байтами
+NOTIFY_PAYLOAD_LIMIT = 7500
+
+
+def _json_default(value: Any):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+class Subscription:
+    """Подписка одного SSE-соединения пользователя"""
+
+    OVERFLOW = object()
+
+    def __init__(self, user_id: str, loop: asyncio.AbstractEventLoop, queue_size: int):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def offer(self, event: Dict[str, Any]):
+        """Положить событие в очередь (вызывается в event loop подписчика).
+
+        Медленный клиент не должен копить память на сервере: при переполнении
+        очередь очищается, клиент получает ``resync`` и переподключается.
+        """
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(Subscription.OVERFLOW)
+
+
+class LocalFanout:
+    """Доставка событий внутри текущего процесса"""
+
+    def start(self, deliver: Callable[[Dict[str, Any]], None]):
+        self._deliver = deliver
+
+    def publish(self, event: Dict[str, Any]):
+        self._deliver(event)
+
+    def stop(self):
+        pass
+
+
+class PostgresNotifyFanout:
+    """Доставка событий между воркерами через PostgreSQL LISTEN/NOTIFY.
+
+    Событие публикуется только через NOTIFY и доставляется подписчикам при
+    получении (в том числе в процессе-отправителе), поэтому порядок событий
+    одинаков во всех воркерах.
+    """
+
+    def __init__(self, connect_fn: Callable[[], Any], channel: str = REALTIME_NOTIFY_CHANNEL):
+        self._connect = connect_fn
+        self.channel = channel
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._publish_conn = None
+        self._publish_lock = threading.Lock()
+
+    def start(self, deliver: Callable[[Dict[str, Any]], None]):
+        self._deliver = deliver
+        self._thread = threading.Thread(target=self._listen_loop, name="realtime-listen", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def publish(self, event: Dict[str, Any]):
+        payload = json.dumps(event, ensure_ascii=False, default=_json_default)
+        if len(payload.encode("utf-8")) > NOTIFY_PAYLOAD_LIMIT:
+            # Слишком большое событие: отправляем только идентификаторы,
+            # клиент дочитает данные обычным запросом
+            slim = dict(event)
+            slim["data"] = {k: v for k, v in (event.get("data") or {}).items() if k.endswith("Id") or k == "id"}
+            slim["truncated"] = True
+            payload = json.dumps(slim, ensure_ascii=False, default=_json_default)
+        with self._publish_lock:
+            try:
+                if self._publish_conn is None or self._publish_conn.closed:
+                    self._publish_conn = self._connect()
+                with self._publish_conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+            except Exception as e:
+                print(f"[Realtime] ❌ NOTIFY failed: {e}")
+                self._publish_conn = None
+
+    def _listen_loop(self):
+        import select
+
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                print(f"[Realtime] LISTEN {self.channel}")
+                while not self._stop.is_set():
+                    if hasattr(conn, "notifies") and callable(conn.notifies):
+                        # psycopg3
+                        for notify in conn.notifies(timeout=5.0):
+                            self._handle(notify.payload)
+                    else:
+                        # psycopg2
+                        if select.select([conn], [], [], 5.0) == ([], [], []):
+                            continue
+                        conn.poll()
+                        while conn.notifies:
+                            self._handle(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"[Realtime] ⚠️ LISTEN connection lost: {e}")
+                time.sleep(2)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _handle(self, payload: str):
+        try:
+            self._deliver(json.loads(payload))
+        except Exception as e:
+            print(f"[Realtime] ⚠️ Bad event payload: {e}")
+
+
+class RealtimeBus:
+    """Шина realtime-событий с подписками по пользователям"""
+
+    def __init__(self, fanout=None, buffer_size: int = REALTIME_BUFFER_SIZE, queue_size: int = REALTIME_QUEUE_SIZE):
+        self._lock = threading.Lock()
+        self._buffer: Deque[Dict[str, Any]] = deque(maxlen=buffer_size)
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._queue_size = queue_size
+        self._counter = itertools.count(1)
+        # Уникальный префикс процесса: id событий уникальны между воркерами
+        self._origin = uuid.uuid4().hex[:8]
+        self._fanout = fanout or LocalFanout()
+        self._fanout.start(self._deliver)
+        # Счетчики меняются из разных потоков - только под self._lock
+        self.stats = {"published": 0, "delivered": 0, "overflows": 0}
+
+    def set_fanout(self, fanout):
+        """Подменить механизм fan-out (например, на LISTEN/NOTIFY)"""
+        self._fanout.stop()
+        self._fanout = fanout
+        self._fanout.start(self._deliver)
+
+    def publish(self, event_type: str, data: Dict[str, Any], user_ids: Optional[Iterable[str]] = None):
+        """Опубликовать событие.
+
+        Args:
+            event_type: Тип события (message.created, chat.read, presence.updated, ...)
+            data: Полезная нагрузка (JSON-сериализуемая)
+            user_ids: Получатели; None - все подключенные пользователи
+        """
+        event = {
+            "id": f"{int(time.time() * 1000)}-{self._origin}-{next(self._counter)}",
+            "type": event_type,
+            "data": data,
+            "users": sorted({str(uid) for uid in user_ids if uid}) if user_ids is not None else None,
+            "ts": time.time(),
+        }
+        with self._lock:
+            self.stats["published"] += 1
+        try:
+            self._fanout.publish(event)
+        except Exception as e:
+            print(f"[Realtime] ❌ Failed to publish {event_type}: {e}")
+
+    def _deliver(self, event: Dict[str, Any]):
+        """Записать событие в буфер и раздать подписчикам (из любого потока)"""
+        recipients = event.get("users")
+        with self._lock:
+            self._buffer.append(event)
+            if recipients is None:
+                targets: List[Subscription] = [s for subs in self._subscriptions.values() for s in subs]
+            else:
+                targets = [s for uid in recipients for s in self._subscriptions.get(uid, ())]
+            self.stats["delivered"] += len(targets)
+        for subscription in targets:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # Event loop подписчика уже закрыт
+                pass
+
+    def subscribe(self, user_id: str, last_event_id: Optional[str] = None):
+        """Подписать пользователя; возвращает (подписка, пропущенные события, нужен_resync)"""
+        subscription = Subscription(str(user_id), asyncio.get_running_loop(), self._queue_size)
+        with self._lock:
+            self._subscriptions.setdefault(subscription.user_id, set()).add(subscription)
+            backlog: List[Dict[str, Any]] = []
+            needs_resync = False
+            if last_event_id:
+                buffered = list(self._buffer)
+                position = next((i for i, ev in enumerate(buffered) if ev["id"] == last_event_id), None)
+                if position is None:
+                    # Клиент отстал больше, чем хранит буфер - пусть перечитает состояние
+                    needs_resync = True
+                else:
+                    backlog = [
+                        ev for ev in buffered[position + 1:]
+                        if ev.get("users") is None or subscription.user_id in ev["users"]
+                    ]
+        return subscription, backlog, needs_resync
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subs = self._subscriptions.get(subscription.user_id)
+            if subs is not None:
+                subs.discard(subscription)
+                if not subs:
+                    self._subscriptions.pop(subscription.user_id, None)
+            if subscription.overflowed:
+                self.stats["overflows"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                "fanout": type(self._fanout).__name__,
+                "buffered": len(self._buffer),
+                "subscribers": sum(len(s) for s in self._subscriptions.values()),
+                "users": len(self._subscriptions),
+            }
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Сериализовать событие в формат text/event-stream"""
+    payload = json.dumps(
+        {"type": event["type"], "data": event.get("data"), "ts": event.get("ts")},
+        ensure_ascii=False,
+        default=_json_default,
+    )
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+
+# Глобальный экземпляр
+realtime_bus = RealtimeBus()
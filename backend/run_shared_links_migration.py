@@ -16,11 +16,10 @@ from db_postgres import PostgresConnection
 def main():
     conn = PostgresConnection()
     
-    # Сначала создаем таблицу если ее нет (без FK constraint)
-    print("Ensuring shared_links table exists...")
-    from db_postgres import PostgresDatabase
-    db = PostgresDatabase(conn)
-    db._ensure_shared_links_table()
+    # Таблица создается миграцией 015_runtime_schema_baseline (без FK constraint)
+    print("Applying schema migrations...")
+    from schema_migrations import run_migrations
+    run_migrations(conn)
     print("✓ Table created/verified")
     
     # Теперь удаляем FK constraint если он существует
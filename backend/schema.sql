@@ -35,8 +35,8 @@ CREATE TABLE IF NOT EXISTS users (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE INDEX idx_users_username ON users(username);
-CREATE INDEX idx_users_email ON users(email);
+CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
+CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 
 -- Data Sources table
 CREATE TABLE IF NOT EXISTS data_sources (
@@ -54,7 +54,7 @@ CREATE TABLE IF NOT EXISTS data_sources (
     metadata JSONB DEFAULT '{}'
 );
 
-CREATE INDEX idx_data_sources_type ON data_sources(source_type);
+CREATE INDEX IF NOT EXISTS idx_data_sources_type ON data_sources(source_type);
 
 -- Feeds table
 CREATE TABLE IF NOT EXISTS feeds (
@@ -72,8 +72,8 @@ CREATE TABLE IF NOT EXISTS feeds (
     FOREIGN KEY (source_id) REFERENCES data_sources(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_feeds_slug ON feeds(slug);
-CREATE INDEX idx_feeds_source_id ON feeds(source_id);
+CREATE INDEX IF NOT EXISTS idx_feeds_slug ON feeds(slug);
+CREATE INDEX IF NOT EXISTS idx_feeds_source_id ON feeds(source_id);
 
 -- Products table
 CREATE TABLE IF NOT EXISTS products (
@@ -93,12 +93,13 @@ CREATE TABLE IF NOT EXISTS products (
     dates_updated_at TIMESTAMP,
     metadata JSONB DEFAULT '{}',
     dates JSONB DEFAULT '[]',
+    content_hash VARCHAR(64),
     FOREIGN KEY (source_id) REFERENCES data_sources(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_products_source_id ON products(source_id);
-CREATE INDEX idx_products_hidden ON products(hidden);
-CREATE INDEX idx_products_name ON products(name);
+CREATE INDEX IF NOT EXISTS idx_products_source_id ON products(source_id);
+CREATE INDEX IF NOT EXISTS idx_products_hidden ON products(hidden);
+CREATE INDEX IF NOT EXISTS idx_products_name ON products(name);
 
 -- Templates table
 CREATE TABLE IF NOT EXISTS templates (
@@ -115,8 +116,8 @@ CREATE TABLE IF NOT EXISTS templates (
     FOREIGN KEY (creator_id) REFERENCES users(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_templates_type ON templates(template_type);
-CREATE INDEX idx_templates_creator_id ON templates(creator_id);
+CREATE INDEX IF NOT EXISTS idx_templates_type ON templates(template_type);
+CREATE INDEX IF NOT EXISTS idx_templates_creator_id ON templates(creator_id);
 
 -- Collections table
 CREATE TABLE IF NOT EXISTS collections (
@@ -143,9 +144,9 @@ CREATE TABLE IF NOT EXISTS logs (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_logs_user_id ON logs(user_id);
-CREATE INDEX idx_logs_created_at ON logs(created_at);
-CREATE INDEX idx_logs_entity ON logs(entity_type, entity_id);
+CREATE INDEX IF NOT EXISTS idx_logs_user_id ON logs(user_id);
+CREATE INDEX IF NOT EXISTS idx_logs_created_at ON logs(created_at);
+CREATE INDEX IF NOT EXISTS idx_logs_entity ON logs(entity_type, entity_id);
 
 -- Analytics table
 CREATE TABLE IF NOT EXISTS analytics (
@@ -158,8 +159,8 @@ CREATE TABLE IF NOT EXISTS analytics (
     FOREIGN KEY (source_id) REFERENCES data_sources(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_analytics_source_id ON analytics(source_id);
-CREATE INDEX idx_analytics_created_at ON analytics(created_at);
+CREATE INDEX IF NOT EXISTS idx_analytics_source_id ON analytics(source_id);
+CREATE INDEX IF NOT EXISTS idx_analytics_created_at ON analytics(created_at);
 
 -- Wordstat Searches table
 CREATE TABLE IF NOT EXISTS wordstat_searches (
@@ -173,8 +174,8 @@ CREATE TABLE IF NOT EXISTS wordstat_searches (
     FOREIGN KEY (source_id) REFERENCES data_sources(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_wordstat_searches_query ON wordstat_searches(query);
-CREATE INDEX idx_wordstat_searches_source_id ON wordstat_searches(source_id);
+CREATE INDEX IF NOT EXISTS idx_wordstat_searches_query ON wordstat_searches(query);
+CREATE INDEX IF NOT EXISTS idx_wordstat_searches_source_id ON wordstat_searches(source_id);
 
 -- Wordstat Cache table
 CREATE TABLE IF NOT EXISTS wordstat_cache (
@@ -185,8 +186,8 @@ CREATE TABLE IF NOT EXISTS wordstat_cache (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE INDEX idx_wordstat_cache_key ON wordstat_cache(cache_key);
-CREATE INDEX idx_wordstat_cache_expires ON wordstat_cache(expires_at);
+CREATE INDEX IF NOT EXISTS idx_wordstat_cache_key ON wordstat_cache(cache_key);
+CREATE INDEX IF NOT EXISTS idx_wordstat_cache_expires ON wordstat_cache(expires_at);
 
 -- Tracked Posts table
 CREATE TABLE IF NOT EXISTS tracked_posts (
@@ -200,7 +201,7 @@ CREATE TABLE IF NOT EXISTS tracked_posts (
     FOREIGN KEY (source_id) REFERENCES data_sources(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_tracked_posts_source_id ON tracked_posts(source_id);
+CREATE INDEX IF NOT EXISTS idx_tracked_posts_source_id ON tracked_posts(source_id);
 
 -- Chats table
 CREATE TABLE IF NOT EXISTS chats (
@@ -221,9 +222,10 @@ CREATE TABLE IF NOT EXISTS chats (
     FOREIGN KEY (creator_id) REFERENCES users(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_chats_is_system ON chats(is_system_chat);
-CREATE INDEX idx_chats_is_group ON chats(is_group);
-CREATE INDEX idx_chats_creator_id ON chats(creator_id);
+CREATE INDEX IF NOT EXISTS idx_chats_is_system ON chats(is_system_chat);
+CREATE INDEX IF NOT EXISTS idx_chats_is_group ON chats(is_group);
+CREATE INDEX IF NOT EXISTS idx_chats_creator_id ON chats(creator_id);
+CREATE INDEX IF NOT EXISTS idx_chats_todo_id ON chats(todo_id);
 
 -- Chat Participants table
 CREATE TABLE IF NOT EXISTS chat_participants (
@@ -236,8 +238,8 @@ CREATE TABLE IF NOT EXISTS chat_participants (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
-CREATE INDEX idx_chat_participants_chat_id ON chat_participants(chat_id);
-CREATE INDEX idx_chat_participants_user_id ON chat_participants(user_id);
+CREATE INDEX IF NOT EXISTS idx_chat_participants_chat_id ON chat_participants(chat_id);
+CREATE INDEX IF NOT EXISTS idx_chat_participants_user_id ON chat_participants(user_id);
 
 -- Messages table
 CREATE TABLE IF NOT EXISTS messages (
@@ -265,10 +267,11 @@ CREATE TABLE IF NOT EXISTS messages (
     FOREIGN KEY (reply_to_id) REFERENCES messages(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_messages_chat_id ON messages(chat_id);
-CREATE INDEX idx_messages_author_id ON messages(author_id);
-CREATE INDEX idx_messages_created_at ON messages(created_at);
-CREATE INDEX idx_messages_is_system ON messages(is_system_message);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id);
+CREATE INDEX IF NOT EXISTS idx_messages_author_id ON messages(author_id);
+CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at);
+CREATE INDEX IF NOT EXISTS idx_messages_is_system ON messages(is_system_message);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_live_created ON messages(chat_id, created_at, id) WHERE is_deleted = false;
 
 -- Parsing State table
 CREATE TABLE IF NOT EXISTS parsing_state (
@@ -308,12 +311,12 @@ CREATE TABLE IF NOT EXISTS tasks (
     FOREIGN KEY (list_id) REFERENCES todo_lists(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_tasks_status ON tasks(status);
-CREATE INDEX idx_tasks_assigned_to ON tasks(assigned_to);
-CREATE INDEX idx_tasks_author_id ON tasks(author_id);
-CREATE INDEX idx_tasks_due_date ON tasks(due_date);
-CREATE INDEX idx_tasks_list_id ON tasks(list_id);
-CREATE INDEX idx_tasks_is_completed ON tasks(is_completed);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+CREATE INDEX IF NOT EXISTS idx_tasks_assigned_to ON tasks(assigned_to);
+CREATE INDEX IF NOT EXISTS idx_tasks_author_id ON tasks(author_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks(due_date);
+CREATE INDEX IF NOT EXISTS idx_tasks_list_id ON tasks(list_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_is_completed ON tasks(is_completed);
 CREATE INDEX IF NOT EXISTS idx_tasks_archived ON tasks(archived);
 
 -- Events table
@@ -330,8 +333,8 @@ CREATE TABLE IF NOT EXISTS events (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_events_user_id ON events(user_id);
-CREATE INDEX idx_events_start_date ON events(start_date);
+CREATE INDEX IF NOT EXISTS idx_events_user_id ON events(user_id);
+CREATE INDEX IF NOT EXISTS idx_events_start_date ON events(start_date);
 
 -- Events table
 CREATE TABLE IF NOT EXISTS events (
@@ -350,8 +353,8 @@ CREATE TABLE IF NOT EXISTS events (
     FOREIGN KEY (created_by) REFERENCES users(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_events_created_by ON events(created_by);
-CREATE INDEX idx_events_start_date ON events(start_date);
+CREATE INDEX IF NOT EXISTS idx_events_created_by ON events(created_by);
+CREATE INDEX IF NOT EXISTS idx_events_start_date ON events(start_date);
 
 -- Links table
 CREATE TABLE IF NOT EXISTS links (
@@ -373,9 +376,9 @@ CREATE TABLE IF NOT EXISTS links (
     link_order INTEGER DEFAULT 0
 );
 
-CREATE INDEX idx_links_list_id ON links(list_id);
-CREATE INDEX idx_links_bookmarked ON links(is_bookmarked);
-CREATE INDEX idx_links_department ON links(department);
+CREATE INDEX IF NOT EXISTS idx_links_list_id ON links(list_id);
+CREATE INDEX IF NOT EXISTS idx_links_bookmarked ON links(is_bookmarked);
+CREATE INDEX IF NOT EXISTS idx_links_department ON links(department);
 
 -- Link Lists table
 CREATE TABLE IF NOT EXISTS link_lists (
@@ -393,8 +396,8 @@ CREATE TABLE IF NOT EXISTS link_lists (
     list_order INTEGER DEFAULT 0
 );
 
-CREATE INDEX idx_link_lists_department ON link_lists(department);
-CREATE INDEX idx_link_lists_is_public ON link_lists(is_public);
+CREATE INDEX IF NOT EXISTS idx_link_lists_department ON link_lists(department);
+CREATE INDEX IF NOT EXISTS idx_link_lists_is_public ON link_lists(is_public);
 
 -- Tasks table
 CREATE TABLE IF NOT EXISTS tasks (
@@ -420,10 +423,10 @@ CREATE TABLE IF NOT EXISTS tasks (
     FOREIGN KEY (author_id) REFERENCES users(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_tasks_list_id ON tasks(list_id);
-CREATE INDEX idx_tasks_status ON tasks(status);
-CREATE INDEX idx_tasks_assigned_by_id ON tasks(assigned_by_id);
-CREATE INDEX idx_tasks_author_id ON tasks(author_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_list_id ON tasks(list_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status);
+CREATE INDEX IF NOT EXISTS idx_tasks_assigned_by_id ON tasks(assigned_by_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_author_id ON tasks(author_id);
 
 -- TODO Lists table
 CREATE TABLE IF NOT EXISTS todo_lists (
@@ -472,9 +475,9 @@ CREATE TABLE IF NOT EXISTS content_plans (
     FOREIGN KEY (author_id) REFERENCES users(id) ON DELETE SET NULL
 );
 
-CREATE INDEX idx_content_plans_author_id ON content_plans(author_id);
-CREATE INDEX idx_content_plans_status ON content_plans(status);
-CREATE INDEX idx_content_plans_scheduled_date ON content_plans(scheduled_date);
+CREATE INDEX IF NOT EXISTS idx_content_plans_author_id ON content_plans(author_id);
+CREATE INDEX IF NOT EXISTS idx_content_plans_status ON content_plans(status);
+CREATE INDEX IF NOT EXISTS idx_content_plans_scheduled_date ON content_plans(scheduled_date);
 
 -- Comments/Reactions table (optional, for future use)
 CREATE TABLE IF NOT EXISTS message_reactions (
@@ -488,4 +491,439 @@ CREATE TABLE IF NOT EXISTS message_reactions (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
-CREATE INDEX idx_message_reactions_message_id ON message_reactions(message_id);
+CREATE INDEX IF NOT EXISTS idx_message_reactions_message_id ON message_reactions(message_id);
+
+-- Direct Parser ads and search history
+CREATE TABLE IF NOT EXISTS direct_ads (
+    id VARCHAR(255) PRIMARY KEY,
+    platform VARCHAR(100) NOT NULL DEFAULT '',
+    type VARCHAR(100) NOT NULL DEFAULT '',
+    query TEXT NOT NULL DEFAULT '',
+    title TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    url TEXT NOT NULL DEFAULT '',
+    display_url TEXT NOT NULL DEFAULT '',
+    domain VARCHAR(255) NOT NULL DEFAULT '',
+    position INTEGER,
+    is_premium BOOLEAN NOT NULL DEFAULT false,
+    sitelinks JSONB NOT NULL DEFAULT '[]',
+    extensions JSONB NOT NULL DEFAULT '{}',
+    extra JSONB NOT NULL DEFAULT '{}',
+    session_id VARCHAR(255),
+    task_id VARCHAR(255),
+    "timestamp" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- One row per ad URL: ingest is INSERT ... ON CONFLICT DO NOTHING
+CREATE UNIQUE INDEX IF NOT EXISTS idx_direct_ads_url ON direct_ads(url) WHERE url <> '';
+CREATE INDEX IF NOT EXISTS idx_direct_ads_timestamp ON direct_ads("timestamp" DESC);
+CREATE INDEX IF NOT EXISTS idx_direct_ads_query ON direct_ads(lower(query), "timestamp" DESC);
+CREATE INDEX IF NOT EXISTS idx_direct_ads_domain ON direct_ads(domain, "timestamp" DESC);
+CREATE INDEX IF NOT EXISTS idx_direct_ads_platform ON direct_ads(lower(platform), "timestamp" DESC);
+
+CREATE TABLE IF NOT EXISTS direct_searches (
+    id VARCHAR(255) PRIMARY KEY,
+    query TEXT NOT NULL UNIQUE,
+    pages_parsed INTEGER NOT NULL DEFAULT 0,
+    ads_found INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(50) NOT NULL DEFAULT 'completed',
+    search_count INTEGER NOT NULL DEFAULT 0,
+    results_count INTEGER NOT NULL DEFAULT 0,
+    last_searched TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_direct_searches_last_searched ON direct_searches(last_searched DESC);
+
+-- Direct Parser agent task queue
+-- A task is split into one shard per query. Agents claim shards with
+-- FOR UPDATE SKIP LOCKED and hold them under a lease; heartbeats extend the
+-- lease, and a shard whose lease expired is handed to the next agent.
+
+CREATE TABLE IF NOT EXISTS direct_parser_tasks (
+    id VARCHAR(64) PRIMARY KEY,
+    queries JSONB NOT NULL DEFAULT '[]',
+    max_pages INTEGER NOT NULL DEFAULT 2,
+    headless BOOLEAN NOT NULL DEFAULT false,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS direct_parser_task_shards (
+    id VARCHAR(80) PRIMARY KEY,
+    task_id VARCHAR(64) NOT NULL REFERENCES direct_parser_tasks(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    query TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    agent_id VARCHAR(255),
+    lease_expires_at TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    message TEXT NOT NULL DEFAULT '',
+    progress INTEGER NOT NULL DEFAULT 0,
+    results_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_direct_parser_task_shards_task ON direct_parser_task_shards(task_id, position);
+-- Claim scans only claimable shards
+CREATE INDEX IF NOT EXISTS idx_direct_parser_task_shards_claim
+    ON direct_parser_task_shards(status, lease_expires_at, created_at)
+    WHERE status IN ('pending', 'leased');
+CREATE INDEX IF NOT EXISTS idx_direct_parser_task_shards_agent ON direct_parser_task_shards(agent_id) WHERE status = 'leased';
+
+CREATE TABLE IF NOT EXISTS direct_parser_agents (
+    agent_id VARCHAR(255) PRIMARY KEY,
+    last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- User presence (online indicators)
+-- Replaces the MAX(created_at) aggregate over all messages that every
+-- /api/users and /api/users/statuses request used to run. Each forward move
+-- of last_activity takes a new version, which drives ETags and since= deltas.
+
+CREATE SEQUENCE IF NOT EXISTS user_presence_version_seq;
+
+CREATE TABLE IF NOT EXISTS user_presence (
+    user_id VARCHAR(255) PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    last_activity TIMESTAMPTZ NOT NULL,
+    version BIGINT NOT NULL DEFAULT nextval('user_presence_version_seq')
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_presence_version ON user_presence(version);
+CREATE INDEX IF NOT EXISTS idx_user_presence_last_activity ON user_presence(last_activity);
+
+-- Backfill from message history and users.last_seen (stored as UTC)
+INSERT INTO user_presence (user_id, last_activity)
+SELECT author_id, MAX(created_at) AT TIME ZONE 'UTC'
+FROM messages
+WHERE author_id IS NOT NULL
+GROUP BY author_id
+ON CONFLICT (user_id) DO NOTHING;
+
+INSERT INTO user_presence (user_id, last_activity)
+SELECT id, last_seen AT TIME ZONE 'UTC'
+FROM users
+WHERE last_seen IS NOT NULL
+ON CONFLICT (user_id) DO UPDATE
+SET last_activity = GREATEST(user_presence.last_activity, EXCLUDED.last_activity);
+
+-- Yandex Metrica daily UTM term statistics
+-- Filled by POST /api/analytics/sync in bulk upserts keyed by (date, utm_term).
+-- product_id/feed_id are resolved at ingest time from the product id found in utm_term.
+
+CREATE TABLE IF NOT EXISTS analytics_utm_daily (
+    date DATE NOT NULL,
+    utm_term TEXT NOT NULL,
+    visits INTEGER NOT NULL DEFAULT 0,
+    users INTEGER NOT NULL DEFAULT 0,
+    pageviews INTEGER NOT NULL DEFAULT 0,
+    bounce_rate NUMERIC(6, 2) NOT NULL DEFAULT 0,
+    product_id VARCHAR(255),
+    feed_id VARCHAR(255),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (date, utm_term)
+);
+
+CREATE INDEX IF NOT EXISTS idx_analytics_utm_daily_product ON analytics_utm_daily(product_id, date) WHERE product_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_analytics_utm_daily_feed ON analytics_utm_daily(feed_id, date) WHERE feed_id IS NOT NULL;
+
+-- Calendar events range query indexes
+-- Events and calendar events share the table and differ by metadata->>'entity'.
+-- Month views read one entity within a start_date window, newest first.
+CREATE INDEX IF NOT EXISTS idx_events_entity_start
+    ON events ((COALESCE(metadata->>'entity', 'event')), start_date DESC);
+
+-- Multi-day events that started before the window but end inside it
+CREATE INDEX IF NOT EXISTS idx_events_end_date ON events(end_date);
+
+-- Containment lookups: tag filter and participant visibility (@>)
+CREATE INDEX IF NOT EXISTS idx_events_tags
+    ON events USING GIN ((metadata->'tags') jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_events_participants
+    ON events USING GIN ((metadata->'participants') jsonb_path_ops);
+
+-- Task visibility indexes
+-- get_tasks / get_todo_lists pass the viewer (or the whole department of a
+-- department head) as array parameters: assigned_by_id = ANY(...),
+-- author_id = ANY(...), assigned_to = ANY(...), assigned_to_ids ?| ARRAY[...].
+-- Each branch is served by its own index and combined with a bitmap OR.
+
+-- jsonb_ops (not jsonb_path_ops): ? and ?| need key/element existence support
+CREATE INDEX IF NOT EXISTS idx_tasks_assigned_to_ids ON tasks USING GIN (assigned_to_ids);
+CREATE INDEX IF NOT EXISTS idx_tasks_assigned_by_id ON tasks(assigned_by_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_author_id ON tasks(author_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_assigned_to ON tasks(assigned_to);
+CREATE INDEX IF NOT EXISTS idx_tasks_list_id ON tasks(list_id);
+
+-- Department membership lookup for department heads
+CREATE INDEX IF NOT EXISTS idx_users_department ON users(department);
+
+-- Lists created by the viewer or their department
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS creator_id VARCHAR(255);
+CREATE INDEX IF NOT EXISTS idx_todo_lists_creator_id ON todo_lists(creator_id);
+
+-- Todo board change tracking
+-- Every insert/update of a task, list or category takes the next value of
+-- todo_change_seq; deletes leave a tombstone with their own version. A client
+-- holding version N asks for rows and tombstones with version > N.
+-- Triggers keep this correct for every write path, not only the API helpers.
+
+CREATE SEQUENCE IF NOT EXISTS todo_change_seq;
+
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('todo_change_seq');
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('todo_change_seq');
+ALTER TABLE todo_categories ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT nextval('todo_change_seq');
+
+CREATE INDEX IF NOT EXISTS idx_tasks_version ON tasks(version);
+CREATE INDEX IF NOT EXISTS idx_todo_lists_version ON todo_lists(version);
+CREATE INDEX IF NOT EXISTS idx_todo_categories_version ON todo_categories(version);
+
+CREATE TABLE IF NOT EXISTS todo_tombstones (
+    kind VARCHAR(20) NOT NULL,          -- task | list | category
+    id VARCHAR(255) NOT NULL,
+    version BIGINT NOT NULL DEFAULT nextval('todo_change_seq'),
+    deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_todo_tombstones_version ON todo_tombstones(version);
+
+CREATE OR REPLACE FUNCTION todo_bump_version() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.version := nextval('todo_change_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION todo_record_tombstone() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO todo_tombstones (kind, id) VALUES (TG_ARGV[0], OLD.id)
+    ON CONFLICT (kind, id) DO UPDATE
+    SET version = nextval('todo_change_seq'), deleted_at = CURRENT_TIMESTAMP;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tasks_bump_version ON tasks;
+CREATE TRIGGER tasks_bump_version BEFORE UPDATE ON tasks
+    FOR EACH ROW EXECUTE FUNCTION todo_bump_version();
+DROP TRIGGER IF EXISTS tasks_tombstone ON tasks;
+CREATE TRIGGER tasks_tombstone AFTER DELETE ON tasks
+    FOR EACH ROW EXECUTE FUNCTION todo_record_tombstone('task');
+
+DROP TRIGGER IF EXISTS todo_lists_bump_version ON todo_lists;
+CREATE TRIGGER todo_lists_bump_version BEFORE UPDATE ON todo_lists
+    FOR EACH ROW EXECUTE FUNCTION todo_bump_version();
+DROP TRIGGER IF EXISTS todo_lists_tombstone ON todo_lists;
+CREATE TRIGGER todo_lists_tombstone AFTER DELETE ON todo_lists
+    FOR EACH ROW EXECUTE FUNCTION todo_record_tombstone('list');
+
+DROP TRIGGER IF EXISTS todo_categories_bump_version ON todo_categories;
+CREATE TRIGGER todo_categories_bump_version BEFORE UPDATE ON todo_categories
+    FOR EACH ROW EXECUTE FUNCTION todo_bump_version();
+DROP TRIGGER IF EXISTS todo_categories_tombstone ON todo_categories;
+CREATE TRIGGER todo_categories_tombstone AFTER DELETE ON todo_categories
+    FOR EACH ROW EXECUTE FUNCTION todo_record_tombstone('category');
+
+-- Chat read state
+-- Replaces chats.read_messages_by_user (one JSONB map rewritten on every
+-- message and mark-read). Each marker is its own row, moved forward with a
+-- single upsert, so concurrent readers of a group chat cannot overwrite each
+-- other. last_read_at/last_read_message_id compare directly with
+-- messages(created_at, id), so unread counts use idx_messages_chat_live_created.
+-- chats.read_messages_by_user is kept for older code but no longer written.
+
+CREATE TABLE IF NOT EXISTS chat_read_state (
+    chat_id VARCHAR(255) NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+    user_id VARCHAR(255) NOT NULL,
+    last_read_message_id VARCHAR(255),  -- NULL: read up to last_read_at
+    last_read_at TIMESTAMP NOT NULL,    -- created_at of the read message (UTC)
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_read_state_user ON chat_read_state(user_id);
+
+-- Backfill: message-id markers
+INSERT INTO chat_read_state (chat_id, user_id, last_read_message_id, last_read_at)
+SELECT c.id, r.key, m.id, m.created_at
+FROM chats c
+CROSS JOIN LATERAL jsonb_each_text(
+    CASE WHEN jsonb_typeof(c.read_messages_by_user) = 'object' THEN c.read_messages_by_user ELSE '{}'::jsonb END
+) AS r(key, value)
+JOIN messages m ON m.id = r.value AND m.chat_id = c.id
+ON CONFLICT (chat_id, user_id) DO NOTHING;
+
+-- Backfill: timestamp markers (ISO strings written by mark-read without a message id)
+INSERT INTO chat_read_state (chat_id, user_id, last_read_message_id, last_read_at)
+SELECT c.id, r.key, NULL, r.value::timestamptz AT TIME ZONE 'UTC'
+FROM chats c
+CROSS JOIN LATERAL jsonb_each_text(
+    CASE WHEN jsonb_typeof(c.read_messages_by_user) = 'object' THEN c.read_messages_by_user ELSE '{}'::jsonb END
+) AS r(key, value)
+WHERE r.value ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}[T ][0-9]{2}:[0-9]{2}'
+ON CONFLICT (chat_id, user_id) DO NOTHING;
+
+-- Columns and tables previously created at runtime or by one-off scripts
+-- Collects the DDL that used to run on request paths
+-- (_ensure_chats_columns, the todo_lists ALTERs in add/update_todo_list,
+-- _ensure_shared_links_table) and in the ad-hoc add_*.sql / add_*.py /
+-- migrate_*_columns.py scripts. Applied once by schema_migrations.py;
+-- every statement is idempotent so databases patched by hand are fine.
+
+-- chats (was _ensure_chats_columns, add_chat_todo_id.sql)
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS pinned_by_user JSONB DEFAULT '{}'::jsonb;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS pinned_order_by_user JSONB DEFAULT '{}'::jsonb;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS archived_by_user JSONB DEFAULT '{}'::jsonb;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS discussion_status VARCHAR(50);
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS avatar TEXT;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS todo_id VARCHAR(255);
+CREATE INDEX IF NOT EXISTS idx_chats_todo_id ON chats(todo_id);
+
+-- todo_lists (was add_todo_list / update_todo_list, add_archived_column.sql)
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS creator_id VARCHAR(255);
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_executor_id VARCHAR(255);
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_customer_id VARCHAR(255);
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS default_add_to_calendar BOOLEAN DEFAULT FALSE;
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS stages_enabled BOOLEAN DEFAULT FALSE;
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS allowed_users TEXT[] DEFAULT ARRAY[]::TEXT[];
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS allowed_departments TEXT[] DEFAULT ARRAY[]::TEXT[];
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS archived BOOLEAN DEFAULT false;
+CREATE INDEX IF NOT EXISTS idx_todo_lists_archived ON todo_lists(archived);
+
+-- tasks (migrate_tasks_columns.py, add_assignee_response.py,
+-- add_task_status_review_column.sql)
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS list_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS assigned_to_ids JSONB DEFAULT '[]';
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS metadata JSONB DEFAULT '{}'::jsonb;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS category_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS archived BOOLEAN DEFAULT false;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS assignee_response TEXT;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS calendar_event_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS calendar_list_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS tags JSONB DEFAULT '[]';
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS is_completed BOOLEAN DEFAULT false;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS add_to_calendar BOOLEAN DEFAULT false;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS task_order INTEGER DEFAULT 0;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS author_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS assigned_by_id VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS assigned_to VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS review_comment TEXT;
+CREATE INDEX IF NOT EXISTS idx_tasks_list_id ON tasks(list_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_category_id ON tasks(category_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_archived ON tasks(archived);
+CREATE INDEX IF NOT EXISTS idx_tasks_is_completed ON tasks(is_completed);
+CREATE INDEX IF NOT EXISTS idx_tasks_author_id ON tasks(author_id);
+CREATE INDEX IF NOT EXISTS idx_tasks_assigned_by_id ON tasks(assigned_by_id);
+
+-- users (add_columns.sql, migrations/add_department_head.sql,
+-- migrations/add_navigation_settings.sql)
+ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_id VARCHAR(255);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_username VARCHAR(255);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS is_department_head BOOLEAN DEFAULT false;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN DEFAULT true;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS visible_tabs JSONB DEFAULT '{"messages": true, "tasks": true, "calendar": true, "contacts": true, "links": true}';
+ALTER TABLE users ADD COLUMN IF NOT EXISTS tools_order JSONB DEFAULT '[]';
+CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id);
+
+-- links (add_missing_tables.py)
+ALTER TABLE links ADD COLUMN IF NOT EXISTS department VARCHAR(255);
+
+-- messages (add_columns.sql)
+CREATE INDEX IF NOT EXISTS idx_messages_notif_type ON messages(chat_id, notification_type);
+CREATE INDEX IF NOT EXISTS idx_messages_call_metadata ON messages(chat_id, ((metadata->>'callId'))) WHERE notification_type = 'call';
+
+-- shared_links (was _ensure_shared_links_table, run_shared_links_migration.py;
+-- created_by has no FK, see fix_shared_links_constraint.sql)
+CREATE TABLE IF NOT EXISTS shared_links (
+    id VARCHAR(255) PRIMARY KEY,
+    token VARCHAR(255) UNIQUE NOT NULL,
+    resource_type VARCHAR(50) NOT NULL,
+    resource_id VARCHAR(255),
+    permission VARCHAR(50) NOT NULL DEFAULT 'viewer',
+    created_by VARCHAR(255) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP,
+    is_active BOOLEAN DEFAULT true,
+    metadata JSONB DEFAULT '{}'
+);
+
+CREATE INDEX IF NOT EXISTS idx_shared_links_token ON shared_links(token);
+CREATE INDEX IF NOT EXISTS idx_shared_links_resource ON shared_links(resource_type, resource_id);
+CREATE INDEX IF NOT EXISTS idx_shared_links_created_by ON shared_links(created_by);
+ALTER TABLE shared_links DROP CONSTRAINT IF EXISTS shared_links_created_by_fkey;
+
+-- direct_access (add_direct_access_table.sql)
+CREATE TABLE IF NOT EXISTS direct_access (
+    id VARCHAR(255) PRIMARY KEY,
+    resource_type VARCHAR(100) NOT NULL,
+    resource_id VARCHAR(255) NOT NULL,
+    user_ids TEXT[] DEFAULT '{}',
+    department_ids TEXT[] DEFAULT '{}',
+    permission VARCHAR(50) DEFAULT 'viewer',
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_direct_access_resource ON direct_access(resource_type, resource_id);
+CREATE INDEX IF NOT EXISTS idx_direct_access_user_ids ON direct_access USING GIN(user_ids);
+CREATE INDEX IF NOT EXISTS idx_direct_access_department_ids ON direct_access USING GIN(department_ids);
+
+-- calculator_history (migrations/add_calculator_history.sql)
+CREATE TABLE IF NOT EXISTS calculator_history (
+    user_id VARCHAR(255) PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    history JSONB DEFAULT '[]',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- telegram_auth_codes (migrations/add_telegram_auth_codes.sql)
+CREATE TABLE IF NOT EXISTS telegram_auth_codes (
+    code VARCHAR(50) PRIMARY KEY,
+    authenticated BOOLEAN DEFAULT FALSE,
+    user_data JSONB,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_telegram_auth_codes_created_at ON telegram_auth_codes(created_at);
+
+-- Commit-order-safe cursors for todo and presence deltas
+-- Sequence values are handed out at nextval(), not at commit: a transaction
+-- holding version 41 can commit after a reader has already returned 42 as
+-- its cursor, and "version > cursor" then skips that change for good.
+-- Each changed row now also records the id of the transaction that wrote it.
+-- The cursor is pg_snapshot_xmin(pg_current_snapshot()) read before the
+-- rows: every transaction below it has finished, so "change_xid >= cursor"
+-- includes everything that was still in flight. Rows from transactions that
+-- were already visible may be sent again; deltas are applied as upserts.
+
+CREATE OR REPLACE FUNCTION todo_bump_version() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.version := nextval('todo_change_seq');
+    NEW.change_xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION todo_record_tombstone() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO todo_tombstones (kind, id) VALUES (TG_ARGV[0], OLD.id)
+    ON CONFLICT (kind, id) DO UPDATE
+    SET version = nextval('todo_change_seq'), change_xid = pg_current_xact_id(),
+        deleted_at = CURRENT_TIMESTAMP;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE todo_lists ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE todo_categories ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE todo_tombstones ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+ALTER TABLE user_presence ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+
+CREATE INDEX IF NOT EXISTS idx_tasks_change_xid ON tasks(change_xid);
+CREATE INDEX IF NOT EXISTS idx_todo_lists_change_xid ON todo_lists(change_xid);
+CREATE INDEX IF NOT EXISTS idx_todo_categories_change_xid ON todo_categories(change_xid);
+CREATE INDEX IF NOT EXISTS idx_todo_tombstones_change_xid ON todo_tombstones(change_xid);
+CREATE INDEX IF NOT EXISTS idx_user_presence_change_xid ON user_presence(change_xid);
@@ -0,0 +1,104 @@
+"""
+Применение миграций схемы PostgreSQL при запуске приложения.
+
+Раньше недостающие колонки и таблицы создавались прямо в запросах
+(ALTER TABLE chats ... в get_chats/send_message, CREATE TABLE shared_links
+в каждом обращении к ссылкам) и разовыми скриптами add_*.py / apply_*.
+Теперь вся DDL лежит в migrations/NNN_*.sql и применяется один раз:
+
+- пустая база сначала создается из schema.sql;
+- файлы migrations/NNN_*.sql применяются по порядку номеров, каждый в своей
+  транзакции; примененные версии записываются в schema_migrations;
+- pg_advisory_xact_lock не дает нескольким воркерам применять миграцию
+  одновременно: второй дождется первого и увидит версию уже записанной;
+- измененный после применения файл не применяется повторно, только
+  выводится предупреждение (контрольная сумма в schema_migrations).
+"""
+import hashlib
+import re
+from pathlib import Path
+from typing import List, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent
+SCHEMA_FILE = BASE_DIR / "schema.sql"
+MIGRATIONS_DIR = BASE_DIR / "migrations"
+
+# Ключ pg_advisory_xact_lock для миграций
+LOCK_KEY = 0x4D494752
+# Версия, под которой записывается создание пустой базы из schema.sql
+BASELINE_VERSION = 0
+
+_MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+
+class MigrationRunner:
+    """Применяет schema.sql и migrations/NNN_*.sql и помнит примененные версии"""
+
+    def __init__(self, conn, migrations_dir: Path = MIGRATIONS_DIR, schema_file: Path = SCHEMA_FILE):
+        self.conn = conn
+        self.migrations_dir = Path(migrations_dir)
+        self.schema_file = Path(schema_file)
+
+    def migration_files(self) -> List[Tuple[int, str, Path]]:
+        """(версия, имя, путь) файлов migrations/NNN_*.sql по возрастанию версии"""
+        migrations = []
+        for path in self.migrations_dir.glob("*.sql"):
+            match = _MIGRATION_FILE.match(path.name)
+            if match:
+                migrations.append((int(match.group(1)), path.stem, path))
+        return sorted(migrations)
+
+    def run(self) -> List[str]:
+        """Применить все непримененные миграции; вернуть имена примененных"""
+        with self.conn.transaction():
+            self.conn.execute_query("SELECT pg_advisory_xact_lock(%s)", (LOCK_KEY,))
+            self.conn.execute_query("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(255) NOT NULL,
+                    checksum VARCHAR(64) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+        applied = []
+        if not self.conn.table_exists("users"):
+            if self._apply(BASELINE_VERSION, "schema", self.schema_file):
+                applied.append("schema")
+        for version, name, path in self.migration_files():
+            if self._apply(version, name, path):
+                applied.append(name)
+
+        if applied:
+            print(f"✅ Миграции применены: {', '.join(applied)}")
+        else:
+            print("✅ Схема БД актуальна")
+        return applied
+
+    def _apply(self, version: int, name: str, path: Path) -> bool:
+        """Применить файл, если версия еще не записана; True - применен сейчас"""
+        checksum = hashlib.sha256(path.read_bytes()).hexdigest()
+        with self.conn.transaction() as tx:
+            self.conn.execute_query("SELECT pg_advisory_xact_lock(%s)", (LOCK_KEY,))
+            row = self.conn.fetch_one(
+                "SELECT name, checksum FROM schema_migrations WHERE version = %s", (version,)
+            )
+            if row is not None:
+                if row["checksum"] != checksum:
+                    print(f"⚠️ Миграция {name} изменена после применения, повторно не применяется")
+                return False
+            if not self.conn.execute_sql_file(str(path)):
+                tx.failed = True
+            else:
+                self.conn.execute_query(
+                    "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                    (version, name, checksum)
+                )
+        if not tx.committed:
+            raise RuntimeError(f"Миграция {name} не применена")
+        return True
+
+
+def run_migrations(conn) -> List[str]:
+    """Применить миграции при запуске (conn - PostgresConnection)"""
+    return MigrationRunner(conn).run()
@@ -0,0 +1,310 @@
+"""
+Фоновая отправка сообщений в Telegram.
+
+Раньше запрос к Bot API (таймаут 10 сек) выполнялся прямо в обработчике
+запроса: медленный API Telegram добавлял до 10 секунд, например, к клику по
+реакции. Теперь обработчик только кладет сообщение в очередь, а отправкой
+занимаются фоновые потоки:
+
+- очередь ограничена (TELEGRAM_QUEUE_SIZE): при переполнении новое сообщение
+  отбрасывается, а не копится в памяти;
+- лимиты Telegram: не чаще раза в TELEGRAM_CHAT_INTERVAL сек в личный чат,
+  TELEGRAM_GROUP_INTERVAL сек в группу и не более TELEGRAM_GLOBAL_RATE
+  сообщений в секунду на бота; 429 откладывает чат на retry_after;
+- накопившиеся сообщения одного чата склеиваются в одно (до 4096 символов);
+- сетевые ошибки и 5xx повторяются с экспоненциальной паузой;
+- при остановке приложения close() отправляет накопленное (до таймаута).
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org').rstrip('/')
+TELEGRAM_QUEUE_SIZE = int(os.getenv('TELEGRAM_QUEUE_SIZE', '1000'))
+TELEGRAM_DISPATCH_WORKERS = int(os.getenv('TELEGRAM_DISPATCH_WORKERS', '2'))
+TELEGRAM_MAX_ATTEMPTS = int(os.getenv('TELEGRAM_MAX_ATTEMPTS', '5'))
+TELEGRAM_CHAT_INTERVAL = float(os.getenv('TELEGRAM_CHAT_INTERVAL', '1.0'))
+TELEGRAM_GROUP_INTERVAL = float(os.getenv('TELEGRAM_GROUP_INTERVAL', '3.0'))
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_TIMEOUT = float(os.getenv('TELEGRAM_TIMEOUT', '10'))
+
+# Ограничение Telegram на длину текста сообщения
+MESSAGE_LIMIT = 4096
+BATCH_SEPARATOR = "\n\n"
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 60.0
+
+
+class _Outgoing:
+    __slots__ = ("text", "parse_mode", "attempts")
+
+    def __init__(self, text: str, parse_mode: Optional[str]):
+        self.text = text
+        self.parse_mode = parse_mode
+        self.attempts = 0
+
+
+class _ChatQueue:
+    """Очередь одного чата: сообщения и время, раньше которого слать нельзя"""
+
+    __slots__ = ("bot_token", "chat_id", "messages", "not_before", "in_flight", "scheduled")
+
+    def __init__(self, bot_token: str, chat_id: Any):
+        self.bot_token = bot_token
+        self.chat_id = chat_id
+        self.messages: Deque[_Outgoing] = deque()
+        self.not_before = 0.0
+        self.in_flight = False
+        self.scheduled = False
+
+
+class TelegramDispatcher:
+    """Ограниченная очередь исходящих сообщений с лимитами по чатам и повторами"""
+
+    def __init__(self, api_base: str = TELEGRAM_API_BASE, max_queue: int = TELEGRAM_QUEUE_SIZE,
+                 workers: int = TELEGRAM_DISPATCH_WORKERS, max_attempts: int = TELEGRAM_MAX_ATTEMPTS,
+                 chat_interval: float = TELEGRAM_CHAT_INTERVAL, group_interval: float = TELEGRAM_GROUP_INTERVAL,
+                 global_rate: float = TELEGRAM_GLOBAL_RATE, timeout: float = TELEGRAM_TIMEOUT):
+        self.api_base = api_base.rstrip('/')
+        self.max_queue = max_queue
+        self.workers = max(1, workers)
+        self.max_attempts = max(1, max_attempts)
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.global_interval = 1.0 / global_rate if global_rate > 0 else 0.0
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._chats: Dict[Tuple[str, str], _ChatQueue] = {}
+        # (время готовности, порядковый номер, ключ чата)
+        self._ready: List[Tuple[float, int, Tuple[str, str]]] = []
+        self._seq = itertools.count()
+        self._pending = 0
+        self._busy = 0
+        self._next_global_slot: Dict[str, float] = {}
+        # Чаты с пустой очередью: время, раньше которого в них слать нельзя
+        self._cooldowns: Dict[Tuple[str, str], float] = {}
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+        self._stopped = False
+        self.stats = {"queued": 0, "sent": 0, "batched": 0, "retried": 0, "failed": 0, "dropped": 0}
+
+    # ---------- Публичный API ----------
+
+    def enqueue(self, bot_token: str, chat_id: Any, text: str, parse_mode: Optional[str] = 'HTML') -> bool:
+        """Поставить сообщение в очередь; False - не настроено или буфер переполнен"""
+        if not bot_token or chat_id in (None, '') or not text:
+            return False
+        key = (bot_token, str(chat_id))
+        with self._cond:
+            if self._closed:
+                print("⚠️ Telegram: диспетчер остановлен, сообщение отброшено")
+                return False
+            if self._pending >= self.max_queue:
+                self.stats["dropped"] += 1
+                print(f"⚠️ Telegram: очередь переполнена ({self.max_queue}), сообщение отброшено")
+                return False
+            chat = self._chats.get(key)
+            if chat is None:
+                chat = self._chats[key] = _ChatQueue(bot_token, chat_id)
+                # Интервал чата действует и после того, как его очередь опустела
+                chat.not_before = self._cooldowns.pop(key, 0.0)
+            chat.messages.append(_Outgoing(text, parse_mode))
+            self._pending += 1
+            self.stats["queued"] += 1
+            self._schedule(key, chat)
+            self._ensure_workers()
+            self._cond.notify()
+        return True
+
+    def send(self, bot_token: str, chat_id: Any, text: str, parse_mode: Optional[str] = 'HTML') -> bool:
+        """Синхронная отправка в обход очереди (проверка настроек из интерфейса)"""
+        status, _ = self._post(bot_token, chat_id, text, parse_mode)
+        return status is not None and 200 <= status < 300
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """Дождаться, пока очередь опустеет; False - по таймауту"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def pending(self) -> int:
+        with self._cond:
+            return self._pending
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """Перестать принимать сообщения, отправить накопленные и остановить потоки
+
+        Returns:
+            False, если очередь не опустела за timeout (остаток теряется)
+        """
+        with self._cond:
+            self._closed = True
+        drained = self.flush(timeout)
+        with self._cond:
+            if not drained:
+                print(f"⚠️ Telegram: при остановке не отправлено сообщений: {self._pending}")
+            self._stopped = True
+            self._cond.notify_all()
+        return drained
+
+    # ---------- Планирование ----------
+
+    def _schedule(self, key: Tuple[str, str], chat: _ChatQueue):
+        """Поставить чат в кучу готовности (вызывать под self._cond)"""
+        if chat.messages and not chat.in_flight and not chat.scheduled:
+            chat.scheduled = True
+            heapq.heappush(self._ready, (chat.not_before, next(self._seq), key))
+
+    def _ensure_workers(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(
+                target=self._worker, daemon=True, name=f"telegram-dispatch-{len(self._threads) + 1}"
+            )
+            self._threads.append(thread)
+            thread.start()
+
+    def _take_batch(self) -> Optional[Tuple[_ChatQueue, _Outgoing, int]]:
+        """Следующий готовый чат и склеенная пачка его сообщений (ждет под self._cond)
+
+        None - диспетчер остановлен, поток должен завершиться.
+        """
+        while True:
+            if self._stopped:
+                return None
+            now = time.monotonic()
+            if self._ready and self._ready[0][0] <= now:
+                _, _, key = heapq.heappop(self._ready)
+                chat = self._chats[key]
+                chat.scheduled = False
+                slot = self._next_global_slot.get(chat.bot_token, 0.0)
+                if slot > now:
+                    # Общий лимит бота: чат подождет свой слот
+                    chat.not_before = slot
+                    self._schedule(key, chat)
+                    continue
+                self._next_global_slot[chat.bot_token] = now + self.global_interval
+                chat.in_flight = True
+                return (chat,) + self._merge(chat)
+            timeout = self._ready[0][0] - now if self._ready else None
+            self._cond.wait(timeout)
+
+    def _merge(self, chat: _ChatQueue) -> Tuple[_Outgoing, int]:
+        """Первое сообщение чата плюс следующие за ним с тем же parse_mode, пока влезают"""
+        first = chat.messages.popleft()
+        count = 1
+        if first.attempts == 0:
+            parts = [first.text]
+            length = len(first.text)
+            while chat.messages:
+                nxt = chat.messages[0]
+                if nxt.attempts or nxt.parse_mode != first.parse_mode:
+                    break
+                if length + len(BATCH_SEPARATOR) + len(nxt.text) > MESSAGE_LIMIT:
+                    break
+                chat.messages.popleft()
+                parts.append(nxt.text)
+                length += len(BATCH_SEPARATOR) + len(nxt.text)
+                count += 1
+            if count > 1:
+                merged = _Outgoing(BATCH_SEPARATOR.join(parts), first.parse_mode)
+                self.stats["batched"] += count - 1
+                return merged, count
+        return first, count
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                batch = self._take_batch()
+                if batch is None:
+                    return
+                chat, message, count = batch
+                self._busy += 1
+
+            status, retry_after = self._post(chat.bot_token, chat.chat_id, message.text, message.parse_mode)
+            message.attempts += 1
+
+            with self._cond:
+                self._busy -= 1
+                now = time.monotonic()
+                interval = self.group_interval if str(chat.chat_id).startswith('-') else self.chat_interval
+                retryable = status == 429 or status is None or status >= 500
+                if status is not None and 200 <= status < 300:
+                    self.stats["sent"] += 1
+                    self._pending -= count
+                    chat.not_before = now + interval
+                elif retryable and message.attempts < self.max_attempts:
+                    # Пачка возвращается в начало очереди чата целиком
+                    self.stats["retried"] += 1
+                    self._pending -= count - 1
+                    chat.messages.appendleft(message)
+                    backoff = min(RETRY_BASE_SECONDS * 2 ** (message.attempts - 1), RETRY_MAX_SECONDS)
+                    chat.not_before = now + max(backoff, retry_after or 0, interval)
+                else:
+                    self.stats["failed"] += 1
+                    self._pending -= count
+                    chat.not_before = now + interval
+                    print(f"❌ Telegram: сообщение в {chat.chat_id} не отправлено (статус {status}, попыток {message.attempts})")
+                chat.in_flight = False
+                key = (chat.bot_token, str(chat.chat_id))
+                if chat.messages:
+                    self._schedule(key, chat)
+                else:
+                    self._chats.pop(key, None)
+                    self._remember_cooldown(key, chat.not_before, now)
+                self._cond.notify_all()
+
+    def _remember_cooldown(self, key: Tuple[str, str], not_before: float, now: float):
+        """Сохранить интервал опустевшего чата (вызывать под self._cond)"""
+        if not_before > now:
+            self._cooldowns[key] = not_before
+        if len(self._cooldowns) > self.max_queue:
+            self._cooldowns = {k: t for k, t in self._cooldowns.items() if t > now}
+
+    # ---------- HTTP ----------
+
+    def _post(self, bot_token: str, chat_id: Any, text: str,
+              parse_mode: Optional[str]) -> Tuple[Optional[int], Optional[float]]:
+        """(HTTP-статус или None при сетевой ошибке, retry_after для 429)"""
+        payload: Dict[str, Any] = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+        req = urllib.request.Request(
+            f"{self.api_base}/bot{bot_token}/sendMessage",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.status, None
+        except urllib.error.HTTPError as e:
+            body = e.read().decode("utf-8", "replace")
+            retry_after = None
+            if e.code == 429:
+                try:
+                    retry_after = float(json.loads(body).get('parameters', {}).get('retry_after', 1))
+                except Exception:
+                    retry_after = 1.0
+            print(f"Telegram API error: {e.code} - {body[:200]}")
+            return e.code, retry_after
+        except Exception as e:
+            print(f"Failed to send Telegram message: {e}")
+            return None, None
+
+
+# Глобальный экземпляр
+telegram_dispatcher = TelegramDispatcher()
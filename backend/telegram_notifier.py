@@ -1,6 +1,6 @@
-import requests
 from typing import Optional
 from db_adapter import db
+from telegram_dispatch import telegram_dispatcher
 
 class TelegramNotifier:
     """Отправка уведомлений в Telegram"""
@@ -18,16 +18,17 @@ class TelegramNotifier:
         self.chat_id = settings.get('telegramChatId')
         self.enabled = settings.get('telegramNotifications', False)
     
-    def send_notification(self, message: str, parse_mode: str = 'HTML') -> bool:
+    def send_notification(self, message: str, parse_mode: str = 'HTML', wait: bool = False) -> bool:
         """
         Отправить уведомление в Telegram
         
         Args:
             message: Текст сообщения
             parse_mode: Режим парсинга (HTML, Markdown)
+            wait: Отправить сразу и дождаться ответа API (иначе - фоновая очередь)
         
         Returns:
-            bool: True если отправка успешна
+            bool: True если сообщение отправлено (wait) или поставлено в очередь
         """
         self._load_settings()  # Перезагружаем настройки перед каждой отправкой
         
@@ -35,27 +36,9 @@ class TelegramNotifier:
             print(f"Telegram notifications disabled or not configured")
             return False
         
-        url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
-        
-        payload = {
-            'chat_id': self.chat_id,
-            'text': message,
-            'parse_mode': parse_mode
-        }
-        
-        try:
-            response = requests.post(url, json=payload, timeout=10)
-            
-            if response.status_code == 200:
-                print(f"Telegram notification sent: {message[:50]}...")
-                return True
-            else:
-                print(f"Telegram API error: {response.status_code} - {response.text}")
-                return False
-                
-        except Exception as e:
-            print(f"Failed to send Telegram notification: {str(e)}")
-            return False
+        if wait:
+            return telegram_dispatcher.send(self.bot_token, self.chat_id, message, parse_mode)
+        return telegram_dispatcher.enqueue(self.bot_token, self.chat_id, message, parse_mode)
     
     def notify_log(self, log_type: str, message: str, status: str = 'info'):
         """
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Backend modules are flat (db_postgres.py, schema_migrations.py, ...)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,65 @@
+"""
+Custom feed templates: the {{#offers}} section is split out and streamed per
+product only when it sits at the top level; anything else renders whole, and
+a render error before the first chunk falls back to the default YML feed.
+"""
+import pytest
+
+import feed_templates
+from feed_templates import TemplateRenderer, split_offer_section
+
+PRODUCTS = [
+    {'id': 'p1', 'name': 'Тур 1', 'price': 100, 'url': 'https://example.com/1'},
+    {'id': 'p2', 'name': 'Тур 2', 'price': 200, 'url': 'https://example.com/2'},
+]
+SETTINGS = {'siteName': 'Shop'}
+
+
+def render(source, template_id='t'):
+    template = {'id': template_id, 'updated_at': '1', 'content': source}
+    return b''.join(feed_templates.iter_custom_template(template, PRODUCTS, [], SETTINGS)).decode('utf-8')
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    pytest.importorskip('pystache')
+    fresh = TemplateRenderer()
+    monkeypatch.setattr(feed_templates, 'template_renderer', fresh)
+    return fresh
+
+
+def test_top_level_offers_section_is_split():
+    parts = split_offer_section('<yml>{{#offers}}<o>{{id}}</o>{{/offers}}</yml>')
+    assert parts == ('<yml>', '<o>{{id}}</o>', '</yml>')
+
+
+def test_nested_offers_section_is_not_split():
+    source = '<yml>{{#shop}}<n>{{shop_name}}</n>{{#offers}}<o>{{id}}</o>{{/offers}}{{/shop}}</yml>'
+    assert split_offer_section(source) is None
+
+
+def test_nested_offers_section_renders_whole(renderer):
+    source = '<yml>{{#shop_name}}<n>{{shop_name}}</n>{{#offers}}<o>{{id}}</o>{{/offers}}{{/shop_name}}</yml>'
+    assert render(source) == '<yml><n>Shop</n><o>p1</o><o>p2</o></yml>'
+    assert not renderer.compile({'id': 't', 'updated_at': '1'}, source).split
+
+
+def test_split_render_matches_whole_render(renderer):
+    source = '<yml>\n  <shop>{{shop_name}}</shop>\n  {{#offers}}\n  <o id="{{id}}">{{price}}</o>\n  {{/offers}}\n</yml>\n'
+    compiled = renderer.compile({'id': 't', 'updated_at': '1'}, source)
+    assert compiled.split
+    import pystache
+    expected = pystache.Renderer(escape=lambda u: u).render(
+        source, feed_templates.FeedContext(PRODUCTS, SETTINGS).template_data()
+    )
+    assert render(source) == expected
+
+
+def test_render_error_falls_back_to_yml(renderer, monkeypatch):
+    def broken(compiled, feed):
+        raise RuntimeError('boom')
+        yield  # pragma: no cover
+
+    monkeypatch.setattr(renderer, 'iter_render', broken)
+    body = render('<yml>{{#offers}}<o>{{id}}</o>{{/offers}}</yml>')
+    assert body == feed_templates.generate_yml_feed(PRODUCTS, [], SETTINGS).decode('utf-8')
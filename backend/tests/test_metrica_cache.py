@@ -0,0 +1,178 @@
+"""
+MetricaResponseCache in front of a local fake of the Metrica stat/v1/data
+endpoint: single-flight for concurrent identical requests, HIT within the
+TTL, STALE with one background refresh, and errors shared by all waiters.
+"""
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import metrica_cache
+from metrica_cache import HIT, MISS, STALE, MetricaResponseCache
+
+KEY = ("12345", "utm", "2026-10-01", "2026-10-17")
+
+
+class FakeMetrica:
+    """GET /stat/v1/data: counts calls, answers {"version": N} or `status`"""
+
+    def __init__(self):
+        self.calls = 0
+        self.version = 1
+        self.status = 200
+        # Cleared - requests block until set() (keeps a fetch in flight)
+        self.gate = threading.Event()
+        self.gate.set()
+        self.arrived = threading.Event()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake.calls += 1
+                fake.arrived.set()
+                fake.gate.wait(5)
+                data = json.dumps({"version": fake.version}).encode("utf-8")
+                self.send_response(fake.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/stat/v1/data?ids=12345"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def fetch(self):
+        with urllib.request.urlopen(self.url, timeout=5) as response:
+            return json.loads(response.read())
+
+    def close(self):
+        self.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def metrica():
+    fake = FakeMetrica()
+    yield fake
+    fake.close()
+
+
+class FakeClock:
+    """Stands in for the time module inside metrica_cache"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(metrica_cache, "time", fake)
+    return fake
+
+
+def get_concurrently(cache, fake, count):
+    """Start `count` concurrent cache.get calls; results hold (value, status) or the exception"""
+    results = [None] * count
+
+    def call(index):
+        try:
+            results[index] = cache.get(KEY, fake.fetch)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.01)
+
+
+def test_concurrent_requests_share_one_fetch(metrica):
+    cache = MetricaResponseCache(ttl=60)
+    metrica.gate.clear()
+    threads, results = get_concurrently(cache, metrica, 5)
+    wait_for(lambda: cache.stats["coalesced"] == 4)
+    metrica.gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert metrica.calls == 1
+    assert results == [({"version": 1}, MISS)] * 5
+    assert cache.stats["misses"] == 1 and cache.stats["fetches"] == 1
+
+
+def test_hit_within_ttl(metrica):
+    cache = MetricaResponseCache(ttl=60)
+    assert cache.get(KEY, metrica.fetch) == ({"version": 1}, MISS)
+    metrica.version = 2
+
+    assert cache.get(KEY, metrica.fetch) == ({"version": 1}, HIT)
+    assert metrica.calls == 1
+
+
+def test_stale_value_served_while_one_refresh_runs(metrica, clock):
+    cache = MetricaResponseCache(ttl=60, stale_ttl=600)
+    cache.get(KEY, metrica.fetch)
+    clock.now += 61
+
+    metrica.version = 2
+    metrica.gate.clear()
+    metrica.arrived.clear()
+    # Fetch blocks on the gate, yet every caller gets the old value at once
+    for _ in range(3):
+        assert cache.get(KEY, metrica.fetch) == ({"version": 1}, STALE)
+    assert metrica.arrived.wait(5)
+    metrica.gate.set()
+
+    wait_for(lambda: cache.stats["fetches"] == 2)
+    assert metrica.calls == 2
+    assert cache.get(KEY, metrica.fetch) == ({"version": 2}, HIT)
+
+
+def test_failed_fetch_is_raised_to_every_waiter(metrica):
+    cache = MetricaResponseCache(ttl=60)
+    metrica.status = 500
+    metrica.gate.clear()
+    threads, results = get_concurrently(cache, metrica, 3)
+    wait_for(lambda: cache.stats["coalesced"] == 2)
+    metrica.gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert metrica.calls == 1
+    assert all(isinstance(result, urllib.error.HTTPError) for result in results)
+    assert cache.stats["errors"] == 1
+
+
+def test_failed_refresh_keeps_stale_entry(metrica, clock):
+    cache = MetricaResponseCache(ttl=60, stale_ttl=600)
+    cache.get(KEY, metrica.fetch)
+    clock.now += 61
+
+    metrica.status = 500
+    metrica.version = 2
+    assert cache.get(KEY, metrica.fetch) == ({"version": 1}, STALE)
+    wait_for(lambda: cache.stats["errors"] == 1)
+
+    assert cache.get(KEY, metrica.fetch) == ({"version": 1}, STALE)
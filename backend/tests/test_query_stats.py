@@ -0,0 +1,51 @@
+"""
+Slow-query and error log of query_stats: nothing that can carry row values
+(sampled parameters, the DETAIL part of an error) is returned without
+include_params, and password/token statements are redacted even then.
+"""
+from query_stats import REDACTED, UNMATCHED_ROUTE, QueryStats
+
+
+class UniqueViolation(Exception):
+    sqlstate = "23505"
+
+
+def make_stats():
+    return QueryStats(enabled=True, slow_ms=0, param_sample=1.0)
+
+
+def test_error_detail_only_with_include_params():
+    stats = make_stats()
+    error = UniqueViolation(
+        'duplicate key value violates unique constraint "users_email_key"\n'
+        "DETAIL:  Key (email)=(alice@example.com) already exists."
+    )
+    stats.record("INSERT INTO users (id, email) VALUES (%s, %s)", ("u1", "alice@example.com"), 0.01, error)
+
+    public = stats.snapshot()["errors"][0]
+    assert public["error"] == 'duplicate key value violates unique constraint "users_email_key"'
+    assert public["sqlstate"] == "23505"
+    assert public["errorDetail"] is None and public["params"] is None
+    assert "alice" not in repr(public)
+
+    admin = stats.snapshot(include_params=True)["errors"][0]
+    assert "alice@example.com" in admin["errorDetail"]
+    assert admin["params"] == ["'u1'", "'alice@example.com'"]
+
+
+def test_sensitive_statements_are_redacted_for_admin_too():
+    stats = make_stats()
+    stats.record("UPDATE users SET password = %s WHERE id = %s", ("hunter2", "u1"), 0.01,
+                 UniqueViolation("boom\nDETAIL: (password)=(hunter2)"))
+    admin = stats.snapshot(include_params=True)["errors"][0]
+    assert admin["params"] == [REDACTED, REDACTED]
+    assert admin["errorDetail"] == REDACTED
+
+
+def test_unmatched_requests_share_one_route():
+    stats = make_stats()
+    # Scanner hits on unknown paths: middleware leaves the default route
+    for _ in range(3):
+        with stats.request_scope():
+            stats.record("SELECT 1", None, 0.001)
+    assert [r["route"] for r in stats.snapshot()["routes"]] == [UNMATCHED_ROUTE]
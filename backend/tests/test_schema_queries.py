@@ -0,0 +1,90 @@
+"""
+Queries in db_postgres.py against the real schema.
+
+fetch_all/fetch_one swallow SQL errors and return []/None, so a query that
+names a missing column looks like "no rows" instead of failing. The static
+check compares single-table ORDER BY columns with schema.sql plus the
+numbered migrations; the live check runs the product queries on a scratch
+database when TEST_DB_NAME is set (uses the usual DB_HOST/DB_PORT/DB_USER/
+DB_PASSWORD).
+"""
+import os
+import re
+import uuid
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+_CREATE_TABLE = re.compile(
+    r"CREATE\s+(?:UNLOGGED\s+)?TABLE\s+(?:IF NOT EXISTS\s+)?(\w+)\s*\((.*?)\n\);", re.S | re.I
+)
+_ADD_COLUMN = re.compile(r"ALTER\s+TABLE\s+(\w+)\s+ADD\s+COLUMN\s+(?:IF NOT EXISTS\s+)?(\w+)", re.I)
+_CONSTRAINT_WORDS = {"PRIMARY", "FOREIGN", "UNIQUE", "CONSTRAINT", "CHECK"}
+# One-line query string: SELECT ... FROM table [WHERE ...] ORDER BY column
+_ORDERED_QUERY = re.compile(r'"[^"\n]*\bFROM\s+(\w+)(?:\s+WHERE[^"\n]*?)?\s+ORDER BY\s+(\w+)[^"\n]*"')
+
+
+def schema_columns():
+    """table -> columns defined by schema.sql and migrations/NNN_*.sql"""
+    files = [BACKEND_DIR / "schema.sql"] + sorted((BACKEND_DIR / "migrations").glob("[0-9]*_*.sql"))
+    columns = {}
+    for path in files:
+        sql = re.sub(r"--[^\n]*", "", path.read_text(encoding="utf-8"))
+        for match in _CREATE_TABLE.finditer(sql):
+            table = columns.setdefault(match.group(1).lower(), set())
+            for line in match.group(2).split("\n"):
+                words = line.strip().split()
+                if words and words[0].upper() not in _CONSTRAINT_WORDS:
+                    table.add(words[0].strip('",').lower())
+        for match in _ADD_COLUMN.finditer(sql):
+            columns.setdefault(match.group(1).lower(), set()).add(match.group(2).lower())
+    return columns
+
+
+def test_products_have_no_created_at():
+    # get_product_ids/get_products used to order by this non-existent column
+    columns = schema_columns()
+    assert "added_at" in columns["products"]
+    assert "created_at" not in columns["products"]
+
+
+def test_order_by_columns_exist():
+    columns = schema_columns()
+    source = (BACKEND_DIR / "db_postgres.py").read_text(encoding="utf-8")
+    missing = []
+    for match in _ORDERED_QUERY.finditer(source):
+        table, column = match.group(1).lower(), match.group(2).lower()
+        if table in columns and column not in columns[table]:
+            line = source.count("\n", 0, match.start()) + 1
+            missing.append(f"db_postgres.py:{line}: {table}.{column}")
+    assert not missing, "ORDER BY on missing columns:\n" + "\n".join(missing)
+
+
+@pytest.fixture
+def live_db():
+    name = os.getenv("TEST_DB_NAME")
+    if not name:
+        pytest.skip("TEST_DB_NAME is not set")
+    db_postgres = pytest.importorskip("db_postgres")
+    from schema_migrations import run_migrations
+
+    conn = db_postgres.PostgresConnection(database=name)
+    run_migrations(conn)
+    return conn, db_postgres.PostgresDatabase(conn)
+
+
+def test_product_queries_on_real_schema(live_db):
+    conn, database = live_db
+    older, newer = f"test-{uuid.uuid4()}", f"test-{uuid.uuid4()}"
+    assert conn.execute_query(
+        "INSERT INTO products (id, name, added_at) VALUES (%s, 'older', NOW() - INTERVAL '1 day'), (%s, 'newer', NOW())",
+        (older, newer)
+    )
+    try:
+        ids = database.get_product_ids()
+        assert ids.index(newer) < ids.index(older)
+        assert [p["id"] for p in database.get_products() if p["id"] in (older, newer)] == [newer, older]
+    finally:
+        conn.execute_query("DELETE FROM products WHERE id IN (%s, %s)", (older, newer))
@@ -0,0 +1,164 @@
+"""
+TelegramDispatcher against a local stub of the Bot API sendMessage endpoint:
+batching, 429 retry_after, per-chat interval after a queue empties, draining
+on close() and dropping on a full buffer.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import telegram_dispatch
+from telegram_dispatch import BATCH_SEPARATOR, TelegramDispatcher
+
+
+class StubBotApi:
+    """sendMessage stub: records (time, chat_id, text) and answers via respond()"""
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        # Cleared - requests block until set() (to let messages pile up)
+        self.gate = threading.Event()
+        self.gate.set()
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.gate.wait(5)
+                with stub._lock:
+                    stub.requests.append((time.monotonic(), str(body['chat_id']), body['text']))
+                    status, payload = stub.responses.pop(0) if stub.responses else (200, {'ok': True})
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def texts(self, chat_id=None):
+        return [text for _, chat, text in self.requests if chat_id is None or chat == str(chat_id)]
+
+    def close(self):
+        self.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    api = StubBotApi()
+    yield api
+    api.close()
+
+
+@pytest.fixture
+def make_dispatcher(stub, monkeypatch):
+    monkeypatch.setattr(telegram_dispatch, 'RETRY_BASE_SECONDS', 0.05)
+    created = []
+
+    def make(**kwargs):
+        options = dict(api_base=stub.url, workers=2, chat_interval=0.05, group_interval=0.05,
+                       global_rate=1000, timeout=5)
+        options.update(kwargs)
+        dispatcher = TelegramDispatcher(**options)
+        created.append(dispatcher)
+        return dispatcher
+
+    yield make
+    for dispatcher in created:
+        dispatcher.close(timeout=5)
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.01)
+
+
+def test_queued_messages_of_one_chat_are_batched(stub, make_dispatcher):
+    dispatcher = make_dispatcher()
+    stub.gate.clear()
+    dispatcher.enqueue('T', 1, 'first')
+    wait_for(lambda: dispatcher._busy == 1)
+    for text in ('second', 'third'):
+        dispatcher.enqueue('T', 1, text)
+    stub.gate.set()
+
+    assert dispatcher.flush(5)
+    assert stub.texts(1) == ['first', BATCH_SEPARATOR.join(['second', 'third'])]
+    assert dispatcher.stats['sent'] == 2 and dispatcher.stats['batched'] == 1
+
+
+def test_429_waits_for_retry_after(stub, make_dispatcher):
+    dispatcher = make_dispatcher()
+    stub.responses = [(429, {'ok': False, 'parameters': {'retry_after': 0.5}})]
+    dispatcher.enqueue('T', 1, 'hello')
+
+    assert dispatcher.flush(5)
+    (first, _, _), (second, _, _) = stub.requests
+    assert stub.texts() == ['hello', 'hello']
+    assert second - first >= 0.5
+    assert dispatcher.stats['retried'] == 1 and dispatcher.stats['sent'] == 1
+
+
+def test_5xx_is_retried_then_given_up(stub, make_dispatcher):
+    dispatcher = make_dispatcher(max_attempts=2)
+    stub.responses = [(502, {'ok': False}), (502, {'ok': False})]
+    dispatcher.enqueue('T', 1, 'hello')
+
+    assert dispatcher.flush(5)
+    assert stub.texts() == ['hello', 'hello']
+    assert dispatcher.stats['retried'] == 1 and dispatcher.stats['failed'] == 1
+    assert dispatcher.pending() == 0
+
+
+def test_chat_interval_holds_after_queue_empties(stub, make_dispatcher):
+    dispatcher = make_dispatcher(chat_interval=0.5)
+    dispatcher.enqueue('T', 1, 'first')
+    assert dispatcher.flush(5)
+    dispatcher.enqueue('T', 1, 'second')
+    assert dispatcher.flush(5)
+
+    (first, _, _), (second, _, _) = stub.requests
+    assert second - first >= 0.5
+
+
+def test_close_drains_queue_and_stops_workers(stub, make_dispatcher):
+    dispatcher = make_dispatcher()
+    for chat_id in (1, 2, -3):
+        dispatcher.enqueue('T', chat_id, f'to {chat_id}')
+
+    assert dispatcher.close(timeout=5)
+    assert sorted(stub.texts()) == sorted(['to 1', 'to 2', 'to -3'])
+    assert dispatcher.enqueue('T', 1, 'late') is False
+    for thread in dispatcher._threads:
+        thread.join(2)
+    assert not any(thread.is_alive() for thread in dispatcher._threads)
+
+
+def test_full_buffer_drops_new_messages(stub, make_dispatcher):
+    dispatcher = make_dispatcher(max_queue=2)
+    stub.gate.clear()
+    assert dispatcher.enqueue('T', 1, 'first')
+    wait_for(lambda: dispatcher._busy == 1)
+    assert dispatcher.enqueue('T', 2, 'second')
+    assert dispatcher.enqueue('T', 3, 'third') is False
+    assert dispatcher.stats['dropped'] == 1
+    stub.gate.set()
+
+    assert dispatcher.flush(5)
+    assert sorted(stub.texts()) == ['first', 'second']
@@ -3,7 +3,7 @@
 """
 import requests
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -165,6 +165,52 @@ class YandexMetricaClient:
             logger.error(f"Ошибка запроса конверсий: {e}")
             raise
     
+    def iter_daily_utm_pages(
+        self,
+        date_from: str,
+        date_to: str,
+        page_size: int = 10000
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Статистика по UTM term в разбивке по дням, постранично
+
+        Страницы запрашиваются через offset, пока не будут получены все
+        total_rows строк, так что вызывающий код обрабатывает их по мере загрузки.
+
+        Yields:
+            Списки записей в формате parse_utm_data (utm_term, date, visits, ...)
+        """
+        offset = 1  # offset в API Метрики начинается с 1
+        while True:
+            params = {
+                "id": self.counter_id,
+                "date1": date_from,
+                "date2": date_to,
+                "metrics": "ym:s:visits,ym:s:users,ym:s:pageviews,ym:s:bounceRate",
+                "dimensions": "ym:s:UTMTerm,ym:s:date",
+                "filters": "ym:s:UTMTerm!=null",
+                "sort": "ym:s:date",
+                "limit": page_size,
+                "offset": offset,
+                "accuracy": "full"
+            }
+            try:
+                response = self.session.get(self.BASE_URL, params=params, timeout=60)
+                response.raise_for_status()
+                data = response.json()
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Ошибка запроса к API Метрики: {e}")
+                raise
+
+            rows = data.get("data", [])
+            total = int(data.get("total_rows") or 0)
+            logger.info(f"Метрика {date_from} - {date_to}: строки {offset}-{offset + len(rows) - 1} из {total}")
+            if rows:
+                yield self.parse_utm_data(data)
+            offset += len(rows)
+            if not rows or offset > total:
+                return
+
     def parse_utm_data(self, api_response: Dict[str, Any], selected_goal_ids: List[int] = None) -> List[Dict[str, Any]]:
         """
         Парсинг ответа API в удобный формат
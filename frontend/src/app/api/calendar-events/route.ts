@@ -4,9 +4,11 @@ const BACKEND_BASE_URL = (process.env.BACKEND_URL || process.env.NEXT_PUBLIC_BAC
   .replace(/\/api$/i, '');
 
 // GET - получить все события
-export async function GET() {
+export async function GET(request: NextRequest) {
   try {
-    const response = await fetch(`${BACKEND_BASE_URL}/api/calendar-events`, {
+    const { searchParams } = new URL(request.url);
+    const query = searchParams.toString();
+    const response = await fetch(`${BACKEND_BASE_URL}/api/calendar-events${query ? `?${query}` : ''}`, {
       method: 'GET',
       headers: { 'Content-Type': 'application/json' },
       cache: 'no-store'
@@ -14,6 +14,8 @@ import json
 import csv
 from datetime import datetime
 
+from browser_pool import wait_for_serp, wait_for_ad_blocks, wait_for_next_page, first_serp_item
+
 
 class AdParser:
     def __init__(self, headless=False, status_callback=None):
@@ -81,7 +83,7 @@ class AdParser:
                     if elem.is_displayed():
                         elem.click()
                         print(f"  [DEBUG] Закрыт popup: {selector}")
-                        time.sleep(0.5)
+                        WebDriverWait(self.driver, 1).until(EC.invisibility_of_element(elem))
             except:
                 continue
         
@@ -106,18 +108,16 @@ class AdParser:
             encoded_query = query.replace(' ', '+')
             self.driver.get(f"https://yandex.ru/search/?text={encoded_query}")
             
-            # Ожидание загрузки страницы
-            time.sleep(3)
+            # Ожидание выдачи
+            wait_for_serp(self.driver)
             
             # Закрываем всплывающие окна (расширение Яндекса и т.д.)
             self._close_popups()
-            time.sleep(1)
             
-            # Скроллим для загрузки всех объявлений
+            # Скроллим для загрузки всех объявлений и ждем рекламные блоки
             self.driver.execute_script("window.scrollTo(0, 1000)")
-            time.sleep(1)
+            wait_for_ad_blocks(self.driver)
             self.driver.execute_script("window.scrollTo(0, 0)")
-            time.sleep(1)
             
             # Ещё раз пробуем закрыть popup (могут появиться после скролла)
             self._close_popups()
@@ -138,13 +138,14 @@ class AdParser:
                 if page < max_pages - 1:
                     try:
                         next_button = self.driver.find_element(By.CSS_SELECTOR, "a.Pager-Item_type_next, a[aria-label='Следующая страница'], .pager__item_kind_next a")
+                        old_item = first_serp_item(self.driver)
                         next_button.click()
-                        time.sleep(4)
+                        wait_for_next_page(self.driver, old_item)
                         # Закрываем popup если появятся
                         self._close_popups()
                         # Скролл после перехода
                         self.driver.execute_script("window.scrollTo(0, 500)")
-                        time.sleep(1)
+                        wait_for_ad_blocks(self.driver)
                     except:
                         print("Больше нет страниц для парсинга")
                         break
@@ -172,13 +173,10 @@ class AdParser:
         import re
         
         try:
-            # Ждём загрузки результатов поиска
-            try:
-                WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "li.serp-item, .serp-list"))
-                )
-                time.sleep(2)  # Дополнительное ожидание для рендера
-            except:
+            # Ждём загрузки результатов поиска и рекламных блоков
+            if wait_for_serp(self.driver):
+                wait_for_ad_blocks(self.driver)
+            else:
                 print("  [DEBUG] Таймаут ожидания результатов поиска")
             
             # Получаем все элементы результатов поиска
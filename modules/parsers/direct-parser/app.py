@@ -27,6 +27,11 @@ except ImportError:
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 
+from browser_pool import (
+    BrowserPool, DEFAULT_WORKERS, summarize_timings,
+    wait_for_serp, wait_for_ad_blocks, wait_for_next_page, first_serp_item
+)
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -43,7 +48,9 @@ parsing_status = {
     'progress': 0,
     'message': '',
     'total_ads': 0,
-    'current_query': ''
+    'current_query': '',
+    'timings': [],
+    'timings_summary': {}
 }
 
 results = []
@@ -54,6 +61,7 @@ app_settings = {
     'premium_domains': [],
     'max_pages': 2,
     'headless': False,
+    'workers': DEFAULT_WORKERS,
     'last_queries': []
 }
 
@@ -221,7 +229,9 @@ class YandexAdParser:
                 logger.info("Открытие Яндекс для инициализации сессии...")
                 self.update_status("Открываю Яндекс для инициализации сессии...")
                 self.driver.get("https://yandex.ru")
-                time.sleep(3)
+                WebDriverWait(self.driver, 10).until(
+                    lambda d: d.execute_script("return document.readyState") == "complete"
+                )
                 
                 # Автоматическое закрытие модалки Яндекса о расширении
                 try:
@@ -241,7 +251,6 @@ class YandexAdParser:
                             if close_button.is_displayed():
                                 close_button.click()
                                 logger.info(f"Модальное окно закрыто (селектор: {selector})")
-                                time.sleep(1)
                                 break
                         except:
                             continue
@@ -273,12 +282,11 @@ class YandexAdParser:
             self.update_status(f"Переход на страницу поиска...")
             
             self.driver.get(search_url)
-            time.sleep(3)  # Пауза для загрузки
+            wait_for_serp(self.driver)
             
             # Автоматическое закрытие всплывающих окон
             logger.info("Закрытие всплывающих окон...")
             self.close_popups()
-            time.sleep(2)
             
             # Закрытие модалок на странице поиска (устаревший код - оставляем для совместимости)
             try:
@@ -293,7 +301,6 @@ class YandexAdParser:
                         close_button = self.driver.find_element(By.CSS_SELECTOR, selector)
                         if close_button.is_displayed():
                             close_button.click()
-                            time.sleep(1)
                             break
                     except:
                         continue
@@ -310,7 +317,12 @@ class YandexAdParser:
                 self.update_status(warning_msg)
                 if not self.headless:
                     self.update_status("Ожидание решения капчи... (30 сек)")
-                    time.sleep(30)
+                    # Продолжаем сразу после решения, а не через фиксированные 30 сек
+                    try:
+                        WebDriverWait(self.driver, 30).until(lambda d: "showcaptcha" not in d.current_url)
+                        wait_for_serp(self.driver)
+                    except Exception:
+                        pass
                     # Проверяем, решена ли капча
                     if "showcaptcha" in self.driver.current_url:
                         logger.error("Капча не решена")
@@ -366,14 +378,13 @@ class YandexAdParser:
                         if next_button:
                             logger.info("Переход на следующую страницу")
                             self.driver.execute_script("arguments[0].scrollIntoView();", next_button)
-                            time.sleep(1)
+                            old_item = first_serp_item(self.driver)
                             next_button.click()
-                            time.sleep(3)
+                            wait_for_next_page(self.driver, old_item)
                             
                             # Закрываем попапы после перехода на новую страницу
                             logger.info("Закрытие всплывающих окон на новой странице...")
                             self.close_popups()
-                            time.sleep(2)
                         else:
                             logger.warning("Кнопка следующей страницы не найдена")
                             self.update_status("Больше нет страниц")
@@ -397,8 +408,8 @@ class YandexAdParser:
         try:
             logger.info("Начало поиска рекламных блоков...")
             
-            # Ждем загрузки страницы
-            time.sleep(2)
+            # Ждем рекламные блоки (не дольше нескольких секунд - на странице их может не быть)
+            wait_for_ad_blocks(self.driver)
             
             # Ищем все возможные рекламные блоки
             ad_selectors = [
@@ -1209,50 +1220,68 @@ class YandexAdParser:
             self.update_status("Браузер закрыт")
 
 
-def parse_in_background(queries, max_pages, headless, debug_descriptions=False):
-    """Функция для парсинга в фоновом потоке"""
+def parse_in_background(queries, max_pages, headless, debug_descriptions=False, workers=DEFAULT_WORKERS):
+    """Функция для парсинга в фоновом потоке: запросы делятся между браузерами пула"""
     global parsing_status, results
     
+    workers = max(1, min(workers, len(queries)))
+    
     logger.info("="*60)
     logger.info("НАЧАЛО ФОНОВОГО ПАРСИНГА")
     logger.info(f"Запросов: {len(queries)}")
     logger.info(f"Страниц на запрос: {max_pages}")
     logger.info(f"Headless режим: {headless}")
+    logger.info(f"Браузеров: {workers}")
     logger.info(f"Отладка описаний: {debug_descriptions}")
     logger.info("="*60)
     
     def status_update(message):
         parsing_status['message'] = message
     
+    def query_done(timing, done, total):
+        parsing_status['current_query'] = timing['query']
+        parsing_status['progress'] = int(done / total * 100)
+        parsing_status['total_ads'] += timing['ads']
+        parsing_status['timings'].append(timing)
+    
     parsing_status['is_running'] = True
     parsing_status['progress'] = 0
     parsing_status['total_ads'] = 0
+    parsing_status['timings'] = []
+    parsing_status['timings_summary'] = {}
     
-    parser = YandexAdParser(headless=headless, status_callback=status_update, debug_descriptions=debug_descriptions)
+    pool = BrowserPool(
+        lambda: YandexAdParser(headless=headless, status_callback=status_update, debug_descriptions=debug_descriptions),
+        size=workers
+    )
     
-    if not parser.start_browser():
+    if not pool.start():
+        pool.close()
         parsing_status['is_running'] = False
         parsing_status['message'] = "Ошибка запуска браузера"
         logger.error("Не удалось запустить браузер")
         return
     
     try:
-        total_queries = len(queries)
-        for idx, query in enumerate(queries):
-            logger.info(f"Обработка запроса {idx+1}/{total_queries}: '{query}'")
-            parsing_status['current_query'] = query
-            parsing_status['progress'] = int((idx / total_queries) * 100)
-            
-            parser.parse_yandex_ads(query, max_pages=max_pages)
-            time.sleep(2)
+        started = time.monotonic()
+        results, timings = pool.map_queries(queries, max_pages=max_pages, on_query_done=query_done)
+        summary = summarize_timings(timings)
+        summary['total_seconds'] = round(time.monotonic() - started, 2)
+        summary['workers'] = workers
         
-        results = parser.results
+        parsing_status['timings_summary'] = summary
         parsing_status['total_ads'] = len(results)
         parsing_status['progress'] = 100
-        parsing_status['message'] = f"Парсинг завершен! Найдено {len(results)} объявлений"
+        parsing_status['message'] = (
+            f"Парсинг завершен! Найдено {len(results)} объявлений за {summary['total_seconds']} сек"
+        )
         
         logger.info("="*60)
         logger.info(f"ПАРСИНГ ЗАВЕРШЕН. Всего объявлений: {len(results)}")
+        logger.info(
+            f"Время: {summary['total_seconds']} сек, среднее на запрос {summary['avg_seconds']} сек, "
+            f"максимум {summary['max_seconds']} сек"
+        )
         logger.info("="*60)
         
         # Сохраняем результаты
@@ -1267,7 +1296,7 @@ def parse_in_background(queries, max_pages, headless, debug_descriptions=False):
         parsing_status['message'] = error_msg
         logger.error(error_msg, exc_info=True)
     finally:
-        parser.close()
+        pool.close()
         parsing_status['is_running'] = False
         logger.info("Фоновый парсинг завершен")
 
@@ -1291,12 +1320,13 @@ def start_parsing():
     max_pages = int(data.get('max_pages', 2))
     headless = data.get('headless', True)
     debug_descriptions = data.get('debug_descriptions', False)  # Новый параметр
+    workers = int(data.get('workers', app_settings.get('workers', DEFAULT_WORKERS)))
     
     if not queries:
         return jsonify({'success': False, 'message': 'Необходимо указать хотя бы один запрос'})
     
     # Запускаем парсинг в отдельном потоке
-    thread = threading.Thread(target=parse_in_background, args=(queries, max_pages, headless, debug_descriptions))
+    thread = threading.Thread(target=parse_in_background, args=(queries, max_pages, headless, debug_descriptions, workers))
     thread.daemon = True
     thread.start()
     
@@ -1529,6 +1559,9 @@ def update_settings():
         if 'headless' in data:
             app_settings['headless'] = bool(data['headless'])
         
+        if 'workers' in data:
+            app_settings['workers'] = max(1, int(data['workers']))
+        
         # Сохраняем в файл
         if save_settings():
             logger.info(f"Настройки обновлены: {len(app_settings['premium_domains'])} премиум-доменов")
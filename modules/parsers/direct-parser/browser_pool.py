@@ -0,0 +1,266 @@
+"""
+Пул браузеров для параллельного парсинга Яндекс.Директ
+
+Каждый воркер держит свой "теплый" браузер (Selenium) и переиспользует его
+между запросами, а не запускает Chrome заново на каждую задачу. Запросы
+раскладываются по очередям воркеров; освободившийся воркер забирает запросы
+из хвоста чужой очереди, чтобы медленный запрос (капча) не задерживал остальные.
+
+Пауза между запросами (защита от капчи) соблюдается для каждого воркера
+отдельно - как раньше для единственного браузера. По каждому запросу
+собирается время выполнения.
+
+Использование:
+    pool = BrowserPool(lambda: AdParser(headless=True), size=3)
+    ads, timings = pool.map_queries(queries, max_pages=2)
+    pool.close()
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+logger = logging.getLogger(__name__)
+
+# Минимальная пауза между запросами одного браузера, сек
+QUERY_PACING_SECONDS = 2.0
+DEFAULT_WORKERS = 3
+
+# Выдача Яндекса и рекламные блоки в ней - для явных ожиданий вместо пауз
+SERP_SELECTOR = "li.serp-item, .serp-list"
+AD_BLOCK_SELECTOR = (
+    "li.serp-item [class*='AdvLabel'], li.serp-item[data-cid], "
+    ".Organic_adv, .organic_adv, a[href*='yabs.yandex']"
+)
+
+
+def wait_for_serp(driver, timeout: float = 10) -> bool:
+    """Дождаться выдачи (или страницы капчи); False - по таймауту"""
+    try:
+        WebDriverWait(driver, timeout).until(
+            lambda d: "showcaptcha" in d.current_url or d.find_elements(By.CSS_SELECTOR, SERP_SELECTOR)
+        )
+        return True
+    except TimeoutException:
+        return False
+
+
+def wait_for_ad_blocks(driver, timeout: float = 3) -> bool:
+    """Рекламные блоки догружаются после выдачи - ждем первый, но не дольше timeout"""
+    try:
+        WebDriverWait(driver, timeout).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, AD_BLOCK_SELECTOR))
+        )
+        return True
+    except TimeoutException:
+        return False
+
+
+def wait_for_next_page(driver, old_element, timeout: float = 10) -> bool:
+    """После клика "Следующая" дождаться, что старая выдача сменилась новой"""
+    try:
+        if old_element is not None:
+            WebDriverWait(driver, timeout).until(EC.staleness_of(old_element))
+    except TimeoutException:
+        return False
+    return wait_for_serp(driver, timeout)
+
+
+def first_serp_item(driver):
+    elements = driver.find_elements(By.CSS_SELECTOR, SERP_SELECTOR)
+    return elements[0] if elements else None
+
+
+class BrowserWorker:
+    """Один браузер: ленивый запуск, перезапуск после сбоя, пауза между запросами"""
+
+    def __init__(self, parser_factory: Callable[[], Any], name: str = "worker-1",
+                 pacing: float = QUERY_PACING_SECONDS):
+        self.parser_factory = parser_factory
+        self.name = name
+        self.pacing = pacing
+        self.parser = None
+        self._last_query_at = 0.0
+
+    def _browser_alive(self) -> bool:
+        try:
+            self.parser.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def ensure_browser(self) -> bool:
+        """Запустить браузер, если он еще не запущен или упал"""
+        if self.parser is not None and self._browser_alive():
+            return True
+        self.close()
+        parser = self.parser_factory()
+        if not parser.start_browser():
+            return False
+        self.parser = parser
+        return True
+
+    def parse(self, query: str, max_pages: int = 2) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Распарсить один запрос на этом браузере
+
+        Returns:
+            (объявления, метрика {query, worker, seconds, waited, ads, error})
+        """
+        waited = self._last_query_at + self.pacing - time.monotonic()
+        if waited > 0:
+            time.sleep(waited)
+
+        started = time.monotonic()
+        ads: List[Dict[str, Any]] = []
+        error = None
+        try:
+            if not self.ensure_browser():
+                raise RuntimeError("Не удалось запустить браузер")
+            first = len(self.parser.results)
+            self.parser.parse_yandex_ads(query, max_pages=max_pages)
+            ads = self.parser.results[first:]
+            # Браузер живет долго - не копим результаты прошлых запросов
+            del self.parser.results[:]
+        except Exception as e:
+            error = str(e)
+            logger.error(f"[{self.name}] Ошибка запроса '{query}': {e}")
+        finally:
+            self._last_query_at = time.monotonic()
+
+        timing = {
+            "query": query,
+            "worker": self.name,
+            "seconds": round(self._last_query_at - started, 2),
+            "waited": round(max(waited, 0), 2),
+            "ads": len(ads),
+            "error": error,
+        }
+        logger.info(f"[{self.name}] '{query}': {len(ads)} объявлений за {timing['seconds']} сек")
+        return ads, timing
+
+    def close(self):
+        if self.parser is not None:
+            try:
+                self.parser.close()
+            except Exception:
+                pass
+            self.parser = None
+
+
+class BrowserPool:
+    """N воркеров с теплыми браузерами и очередью запросов у каждого"""
+
+    def __init__(self, parser_factory: Callable[[], Any], size: int = DEFAULT_WORKERS,
+                 pacing: float = QUERY_PACING_SECONDS):
+        self.workers = [
+            BrowserWorker(parser_factory, name=f"worker-{i + 1}", pacing=pacing)
+            for i in range(max(1, size))
+        ]
+
+    def start(self) -> int:
+        """Запустить браузеры параллельно; возвращает число запущенных"""
+        started = []
+
+        def warm(worker: BrowserWorker):
+            if worker.ensure_browser():
+                started.append(worker.name)
+
+        threads = [threading.Thread(target=warm, args=(w,), daemon=True) for w in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(started)
+
+    def map_queries(
+        self,
+        queries: List[str],
+        max_pages: int = 2,
+        on_query_done: Optional[Callable[[Dict[str, Any], int, int], None]] = None,
+        should_stop: Optional[Callable[[], bool]] = None
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Распарсить запросы всеми воркерами
+
+        Args:
+            on_query_done: callback(метрика, выполнено, всего) после каждого запроса;
+                вызывается под общей блокировкой, по одному за раз
+            should_stop: Проверка запроса на остановку
+
+        Returns:
+            (объявления в порядке запросов, метрики по запросам)
+        """
+        queues: List[Deque[Tuple[int, str]]] = [deque() for _ in self.workers]
+        for idx, query in enumerate(queries):
+            queues[idx % len(queues)].append((idx, query))
+
+        lock = threading.Lock()
+        ads_by_query: Dict[int, List[Dict[str, Any]]] = {}
+        timings: List[Dict[str, Any]] = []
+
+        def next_query(own: int) -> Optional[Tuple[int, str]]:
+            with lock:
+                if should_stop and should_stop():
+                    return None
+                if queues[own]:
+                    return queues[own].popleft()
+                # Своя очередь пуста - забираем из хвоста самой длинной чужой
+                donor = max(queues, key=len)
+                return donor.pop() if donor else None
+
+        def run(own: int, worker: BrowserWorker):
+            while True:
+                item = next_query(own)
+                if item is None:
+                    return
+                idx, query = item
+                ads, timing = worker.parse(query, max_pages=max_pages)
+                with lock:
+                    ads_by_query[idx] = ads
+                    timings.append(timing)
+                    # Callback обновляет общий статус (total_ads += ...) из разных
+                    # потоков - вызываем его под той же блокировкой
+                    if on_query_done:
+                        on_query_done(timing, len(timings), len(queries))
+
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=run, args=(i, w), daemon=True, name=w.name)
+            for i, w in enumerate(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.monotonic() - started
+        busy = sum(t["seconds"] for t in timings)
+        logger.info(
+            f"Пул браузеров: {len(timings)} запросов за {elapsed:.1f} сек "
+            f"(суммарно {busy:.1f} сек, воркеров {len(self.workers)})"
+        )
+        ads = [ad for idx in sorted(ads_by_query) for ad in ads_by_query[idx]]
+        return ads, timings
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+def summarize_timings(timings: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Сводка метрик: число запросов, среднее/максимальное время, ошибки"""
+    seconds = [t["seconds"] for t in timings]
+    return {
+        "queries": len(timings),
+        "avg_seconds": round(sum(seconds) / len(seconds), 2) if seconds else 0,
+        "max_seconds": max(seconds) if seconds else 0,
+        "errors": sum(1 for t in timings if t.get("error")),
+    }
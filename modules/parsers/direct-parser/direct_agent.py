@@ -6,17 +6,24 @@ Direct Parser Agent - Локальный агент для парсинга Ян
   python direct_agent.py --api-url https://tools.connecting-server.ru
 
 Агент:
-1. Подключается к API и проверяет наличие задач
+1. Подключается к API и ждет задачу (long-poll, без периодического опроса)
 2. При наличии задачи - запускает парсинг с Selenium
 3. Отправляет результаты обратно в API
 4. Позволяет решать капчу вручную (без headless режима)
+
+Задача на сервере делится на шарды по запросам и выдается агенту в аренду,
+поэтому несколько агентов с разными --agent-id разбирают одну задачу
+параллельно. Heartbeat в фоне продлевает аренду; если агент упал, его шард
+после истечения аренды достанется другому агенту.
 """
 
 import argparse
 import json
 import logging
 import os
+import socket
 import sys
+import threading
 import time
 from datetime import datetime
 from typing import Optional, Dict, List, Any
@@ -39,6 +46,7 @@ if script_dir not in sys.path:
 # Импортируем парсер из существующего файла
 try:
     from ad_parser import AdParser
+    from browser_pool import BrowserPool, BrowserWorker, summarize_timings
 except ImportError as e:
     logger.error(f"Не найден модуль ad_parser. Убедитесь что файл ad_parser.py существует в папке {script_dir}")
     logger.error(f"Детали ошибки: {e}")
@@ -46,16 +54,29 @@ except ImportError as e:
     sys.exit(1)
 
 
+class LeaseLostError(Exception):
+    """Аренда шарда истекла: его уже выполняет другой агент"""
+
+
 class DirectParserAgent:
     """Агент для связи с API и запуска парсинга"""
     
-    def __init__(self, api_url: str, api_key: str = None, poll_interval: int = 10):
+    # Интервал heartbeat (аренда задачи на сервере - 120 сек)
+    HEARTBEAT_INTERVAL = 15
+    # Сколько сервер держит запрос задачи, если очередь пуста
+    LONG_POLL_WAIT = 25
+    
+    def __init__(self, api_url: str, api_key: str = None, poll_interval: int = 10, agent_id: str = None,
+                 workers: int = 1):
         self.api_url = api_url.rstrip('/')
         self.api_key = api_key
         self.poll_interval = poll_interval
+        self.agent_id = agent_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.workers = max(1, workers)
+        self._stop_event = threading.Event()
         self.is_running = False
-        self.current_task_id: Optional[str] = None
-        self.parser: Optional[AdParser] = None
+        # Текущая задача каждого воркера (для статусов из парсера)
+        self.current_tasks: Dict[str, str] = {}
         
         # Заголовки для всех запросов
         self.headers = {}
@@ -87,47 +108,67 @@ class DirectParserAgent:
         try:
             requests.post(
                 f"{self.api_url}/api/direct-parser/agent/heartbeat",
+                params={"agent_id": self.agent_id},
                 headers=self.headers,
                 timeout=5
             )
         except:
             pass  # Не критично если heartbeat не прошел
     
+    def _heartbeat_loop(self):
+        """Фоновый heartbeat: работает и во время парсинга, продлевая аренду задачи"""
+        while not self._stop_event.is_set():
+            self.send_heartbeat()
+            self._stop_event.wait(self.HEARTBEAT_INTERVAL)
+    
     def get_pending_task(self) -> Optional[Dict]:
-        """Получение задачи на выполнение"""
+        """Получение задачи на выполнение (сервер держит запрос до появления задачи)
+
+        Returns:
+            Задача, {} если задач нет, None при ошибке связи
+        """
         try:
             response = requests.get(
                 f"{self.api_url}/api/direct-parser/agent/task",
+                params={"agent_id": self.agent_id, "wait": self.LONG_POLL_WAIT},
                 headers=self.headers,
-                timeout=10
+                timeout=self.LONG_POLL_WAIT + 10
             )
             if response.status_code == 200:
                 task = response.json()
-                if task and task.get('id'):
-                    return task
+                return task if task and task.get('id') else {}
+            logger.debug(f"API вернул код {response.status_code} при получении задачи")
             return None
         except requests.exceptions.RequestException as e:
             logger.debug(f"Ошибка получения задачи: {e}")
             return None
     
-    def update_task_status(self, task_id: str, status: str, message: str = "", progress: int = 0):
-        """Обновление статуса задачи"""
+    def update_task_status(self, task_id: str, status: str, message: str = "", progress: Optional[int] = None) -> bool:
+        """Обновление статуса задачи (progress=None - прогресс не меняется)
+
+        Returns:
+            False, если аренда шарда потеряна (сервер ответил 409)
+        """
+        payload = {"status": status, "message": message}
+        if progress is not None:
+            payload["progress"] = progress
         try:
-            requests.post(
+            response = requests.post(
                 f"{self.api_url}/api/direct-parser/agent/task/{task_id}/status",
+                params={"agent_id": self.agent_id},
                 headers=self.headers,
-                json={
-                    "status": status,
-                    "message": message,
-                    "progress": progress
-                },
+                json=payload,
                 timeout=10
             )
+            if response.status_code == 409:
+                logger.warning(f"⚠ Аренда задачи {task_id} потеряна: {message}")
+                return False
         except requests.exceptions.RequestException as e:
             logger.warning(f"Не удалось обновить статус: {e}")
+        return True
     
     def submit_results(self, task_id: str, results: List[Dict]):
-        """Отправка результатов парсинга"""
+        """Отправка результатов парсинга (LeaseLostError, если аренда истекла)"""
         try:
             logger.info(f"Отправка {len(results)} результатов для задачи {task_id}...")
             
@@ -155,6 +196,7 @@ class DirectParserAgent:
             
             response = requests.post(
                 f"{self.api_url}/api/direct-parser/agent/task/{task_id}/results",
+                params={"agent_id": self.agent_id},
                 json=payload,
                 headers=self.headers,
                 timeout=60  # Увеличиваем таймаут для больших данных
@@ -170,6 +212,9 @@ class DirectParserAgent:
                 logger.warning(f"⚠ API вернул 500, но данные могут быть сохранены. Проверьте фронтенд.")
                 logger.debug(f"Тело ответа: {response.text[:500]}")
                 return True  # Считаем успехом, т.к. данные часто сохраняются
+            elif response.status_code == 409:
+                # Аренда истекла - шард уже выполняет другой агент
+                raise LeaseLostError("результаты не засчитаны")
             else:
                 logger.error(f"✗ Ошибка отправки результатов: {response.status_code}")
                 logger.error(f"Тело ответа: {response.text[:500]}")
@@ -178,83 +223,110 @@ class DirectParserAgent:
             logger.error(f"✗ Ошибка отправки результатов: {e}")
             return False
     
-    def status_callback(self, message: str):
+    def status_callback(self, worker_name: str, message: str):
         """Колбэк для обновления статуса из парсера"""
-        logger.info(f"[Парсер] {message}")
-        if self.current_task_id:
-            self.update_task_status(self.current_task_id, "running", message)
+        logger.info(f"[{worker_name}] {message}")
+        task_id = self.current_tasks.get(worker_name)
+        if task_id:
+            self.update_task_status(task_id, "running", message)
+    
+    def make_worker(self, name: str, headless: bool) -> BrowserWorker:
+        """Воркер с браузером, который переиспользуется между задачами"""
+        return BrowserWorker(
+            lambda: AdParser(headless=headless, status_callback=lambda m: self.status_callback(name, m)),
+            name=name
+        )
     
-    def execute_task(self, task: Dict):
-        """Выполнение задачи парсинга"""
-        self.current_task_id = task['id']
+    def execute_task(self, task: Dict, worker: BrowserWorker):
+        """Выполнение задачи парсинга на браузере воркера"""
         queries = task.get('queries', [])
         max_pages = task.get('max_pages', 2)
-        headless = task.get('headless', False)  # По умолчанию НЕ headless для капчи
         
         logger.info(f"=" * 50)
-        logger.info(f"Начало задачи {task['id']}")
+        logger.info(f"[{worker.name}] Начало задачи {task['id']}")
         logger.info(f"Запросы: {queries}")
         logger.info(f"Макс. страниц: {max_pages}")
-        logger.info(f"Headless: {headless}")
         logger.info(f"=" * 50)
         
-        self.update_task_status(task['id'], "running", "Запуск парсера...")
+        self.current_tasks[worker.name] = task['id']
         
         try:
-            # Создаём парсер
-            self.parser = AdParser(
-                headless=headless,
-                status_callback=self.status_callback
-            )
-            
-            # Запускаем браузер
-            if not self.parser.start_browser():
+            if not self.update_task_status(task['id'], "running", "Запуск парсера...", progress=0):
+                raise LeaseLostError("задача уже назначена другому агенту")
+            if not worker.ensure_browser():
                 raise Exception("Не удалось запустить браузер")
             
             all_results = []
+            timings = []
             
             for idx, query in enumerate(queries, 1):
-                logger.info(f">>> Парсинг запроса {idx}/{len(queries)}: '{query}'")
-                self.update_task_status(
+                logger.info(f">>> [{worker.name}] Парсинг запроса {idx}/{len(queries)}: '{query}'")
+                if not self.update_task_status(
                     task['id'], 
                     "running", 
                     f"Парсинг запроса {idx}/{len(queries)}: {query}",
                     progress=int((idx - 1) / len(queries) * 100)
-                )
+                ):
+                    raise LeaseLostError("задача уже назначена другому агенту")
                 
-                # Парсим запрос
-                results = self.parser.parse_yandex_ads(query, max_pages=max_pages)
-                logger.info(f"<<< Запрос '{query}': найдено {len(results)} объявлений")
+                # Парсим запрос (браузер остается открытым для следующих запросов)
+                results, timing = worker.parse(query, max_pages=max_pages)
+                if timing['error']:
+                    raise Exception(timing['error'])
+                logger.info(f"<<< Запрос '{query}': найдено {len(results)} объявлений за {timing['seconds']} сек")
                 all_results.extend(results)
+                timings.append(timing)
             
-            # Закрываем браузер
-            logger.info("Закрытие браузера...")
-            self.parser.close()
-            
+            summary = summarize_timings(timings)
             logger.info(f"=" * 50)
-            logger.info(f"ВСЕГО найдено объявлений: {len(all_results)}")
+            logger.info(f"ВСЕГО найдено объявлений: {len(all_results)} (среднее время запроса {summary['avg_seconds']} сек)")
             logger.info(f"=" * 50)
             
             # Отправляем результаты
-            self.update_task_status(task['id'], "completed", f"Готово: {len(all_results)} объявлений", 100)
+            if not self.update_task_status(task['id'], "completed", f"Готово: {len(all_results)} объявлений", 100):
+                raise LeaseLostError("результаты не засчитаны")
             success = self.submit_results(task['id'], all_results)
             
             if success:
                 logger.info(f"✓ Задача {task['id']} выполнена успешно: {len(all_results)} объявлений")
             else:
                 logger.error(f"✗ Задача выполнена, но результаты не отправлены!")
+                # Возвращаем задачу в очередь, чтобы ее повторил другой агент
+                self.update_task_status(task['id'], "failed", "Не удалось отправить результаты")
             
+        except LeaseLostError as e:
+            # Шард выполняет другой агент: failed сбросил бы уже его аренду
+            logger.warning(f"⚠ [{worker.name}] Аренда задачи {task['id']} истекла, {e}")
         except Exception as e:
             logger.error(f"✗ Ошибка выполнения задачи: {e}")
             self.update_task_status(task['id'], "failed", str(e))
-            if self.parser:
-                try:
-                    self.parser.close()
-                except:
-                    pass
+            # Браузер мог остаться в неизвестном состоянии - перезапустим при следующей задаче
+            worker.close()
         finally:
-            self.current_task_id = None
-            self.parser = None
+            self.current_tasks.pop(worker.name, None)
+    
+    def _worker_loop(self, name: str):
+        """Цикл воркера: ждет задачу, выполняет ее на своем браузере"""
+        worker = None
+        worker_headless = None
+        try:
+            while self.is_running:
+                # Запрос висит на сервере до появления задачи или таймаута
+                task = self.get_pending_task()
+                
+                if task:
+                    headless = task.get('headless', False)  # По умолчанию НЕ headless для капчи
+                    if worker is None or headless != worker_headless:
+                        if worker:
+                            worker.close()
+                        worker, worker_headless = self.make_worker(name, headless), headless
+                    self.execute_task(task, worker)
+                elif task is None:
+                    # Ошибка связи - ждём перед повтором
+                    time.sleep(self.poll_interval)
+        finally:
+            if worker:
+                worker.close()
     
     def run(self):
         """Основной цикл агента"""
@@ -262,7 +334,8 @@ class DirectParserAgent:
         logger.info("     DIRECT PARSER AGENT")
         logger.info("=" * 60)
         logger.info(f"API URL: {self.api_url}")
-        logger.info(f"Интервал опроса: {self.poll_interval} сек")
+        logger.info(f"ID агента: {self.agent_id}")
+        logger.info(f"Браузеров: {self.workers}")
         logger.info("=" * 60)
         
         # Проверяем подключение
@@ -273,40 +346,46 @@ class DirectParserAgent:
         self.is_running = True
         logger.info("Агент запущен. Ожидание задач... (Ctrl+C для выхода)")
         
-        last_heartbeat = 0
+        self._stop_event.clear()
+        heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat_thread.start()
+        
+        # Каждый воркер со своим браузером сам забирает задачи из очереди сервера
+        worker_threads = [
+            threading.Thread(target=self._worker_loop, args=(f"worker-{i + 1}",), daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in worker_threads:
+            thread.start()
         
         try:
-            while self.is_running:
-                # Отправляем heartbeat каждые 15 секунд
-                now = time.time()
-                if now - last_heartbeat > 15:
-                    self.send_heartbeat()
-                    last_heartbeat = now
-                
-                # Проверяем наличие задачи
-                task = self.get_pending_task()
-                
-                if task:
-                    self.execute_task(task)
-                else:
-                    # Ждём перед следующей проверкой
-                    time.sleep(self.poll_interval)
+            while self.is_running and any(t.is_alive() for t in worker_threads):
+                time.sleep(1)
                     
         except KeyboardInterrupt:
             logger.info("\nОстановка агента...")
             self.is_running = False
+        finally:
+            self._stop_event.set()
         
         logger.info("Агент остановлен")
     
     def run_single_task(self, queries: List[str], max_pages: int = 2, headless: bool = False):
         """Выполнение одиночной задачи без опроса API (для тестирования)"""
-        task = {
-            'id': f'local_{int(time.time())}',
-            'queries': queries,
-            'max_pages': max_pages,
-            'headless': headless
-        }
-        self.execute_task(task)
+        pool = BrowserPool(
+            lambda: AdParser(headless=headless, status_callback=lambda m: logger.info(f"[Парсер] {m}")),
+            size=min(self.workers, len(queries))
+        )
+        try:
+            results, timings = pool.map_queries(queries, max_pages=max_pages)
+        finally:
+            pool.close()
+        
+        for timing in timings:
+            logger.info(f"  {timing['worker']}: '{timing['query']}' - {timing['ads']} объявлений, {timing['seconds']} сек")
+        summary = summarize_timings(timings)
+        logger.info(f"ВСЕГО найдено объявлений: {len(results)}, среднее время запроса {summary['avg_seconds']} сек")
+        return results
 
 
 def main():
@@ -324,6 +403,9 @@ def main():
 
   # Headless режим (без GUI)
   python direct_agent.py --api-url https://tools.connecting-server.ru --headless
+
+  # Три браузера параллельно (каждый берет свои запросы задачи)
+  python direct_agent.py --api-url https://tools.connecting-server.ru --workers 3
         """
     )
     
@@ -338,7 +420,21 @@ def main():
         '--poll-interval',
         type=int,
         default=10,
-        help='Интервал опроса API в секундах (default: 10)'
+        help='Пауза перед повтором при ошибке связи с API, сек (default: 10)'
+    )
+    
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Число браузеров, параллельно выполняющих задачи (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--agent-id',
+        type=str,
+        default='',
+        help='ID агента для нескольких агентов на одной задаче (default: hostname-pid)'
     )
     
     parser.add_argument(
@@ -378,7 +474,9 @@ def main():
     agent = DirectParserAgent(
         api_url=args.api_url,
         poll_interval=args.poll_interval,
-        api_key=args.api_key
+        api_key=args.api_key,
+        agent_id=args.agent_id or None,
+        workers=args.workers
     )
     
     if args.test: